@@ -4,19 +4,33 @@ import json
 from inspect_ai.agent import agent
 
 from inspect_agentic_mcq.agents.structured_agent import (
-    structured_agent,
+    astructured_agent,
     StructuredInput,
     StructuredOutput,
 )
+from inspect_agentic_mcq.agents.structured_parser import (
+    OUTPUT_CONFIDENCE_THRESHOLD,
+    parse_structured_input,
+    parse_structured_output,
+)
+from inspect_agentic_mcq.ledger import CostLedger
+from inspect_agentic_mcq.rate_limit import count_tokens
+from inspect_agentic_mcq.timing import StageTimer
 
 
 @agent
-def bridge_agent(custom_agent: Callable, template: str | None = None, **kwargs):
+def bridge_agent(
+    custom_agent: Callable,
+    template: str | None = None,
+    ledger: CostLedger | None = None,
+    **kwargs,
+):
     """Custom agent wrapper to handle the bridging mechanic in inspect_ai. Deals with lack of options in TaskState by using AG2 agents to structure outputs into json schemas.
 
     Args:
         custom_agent (Callable): Function containing user's custom agent. E.g. def custom_agent(prompt: str, **kwargs)
         template (str | None, optional): Template for the prompt into custom agent. Must be able to format with a variable called 'question'. Defaults to None.
+        ledger (CostLedger | None, optional): Live cost ledger updated after every sample, samples are skipped once its budget is reached. Defaults to None.
         **kwargs: Any kwargs needed for custom agent.
 
     Returns:
@@ -28,10 +42,36 @@ def bridge_agent(custom_agent: Callable, template: str | None = None, **kwargs):
         template = MULTIPLE_CHOICE_TEMPLATE_BRIDGE
 
     async def run(sample: dict[str]) -> dict:
-        print(sample)
-        # Use structured agent to format the input
-        input_result = structured_agent(sample["messages"][0]["content"], StructuredInput)
-        message = json.loads(input_result["output"])
+        # Do not start new samples once the budget is spent
+        if ledger is not None and ledger.exhausted:
+            ledger.skip()
+            output_json = json.dumps(
+                {
+                    "answer": "",
+                    "explanation": "ERROR: Budget reached, sample skipped",
+                    "skipped": True,
+                }
+            )
+            return {
+                "output": output_json,
+                "cost": 0.0,
+                "token_counts": {},
+                "metrics": {"cost": 0.0, "token_counts": {}},
+            }
+
+        # Time every stage of the sample
+        timer = StageTimer()
+
+        # Parse the known prompt layout locally, only use the structured agent for unrecognised inputs
+        prompt = sample["messages"][0]["content"]
+        with timer.span("parse_input"):
+            message = parse_structured_input(prompt, metadata=sample.get("metadata"))
+        if message is None:
+            with timer.span("structured_input") as span:
+                input_result = await astructured_agent(prompt, StructuredInput)
+                span["tokens"] = input_result.get("tokens", 0)
+                span["cost"] = input_result.get("cost", 0.0)
+            message = json.loads(input_result["output"])
         question = message["question"]
         target = message["target"]
 
@@ -39,26 +79,59 @@ def bridge_agent(custom_agent: Callable, template: str | None = None, **kwargs):
         query = template.format(question=question)
 
         # Pass arguments to custom agent, including any kwargs
-        agent_result = await custom_agent(query, **kwargs)
+        with timer.span("agent") as span:
+            agent_result = await custom_agent(query, **kwargs)
+            span["tokens"] = count_tokens(agent_result.get("token_counts", {}))
+            span["cost"] = agent_result.get("cost", 0.0)
         
         # Add the target to the string response so that it can be parsed by the structured agent
         # output_str = agent_result["answer"] + f"\nTarget: {target}"
         output_str = agent_result["answer"]
-        formatted_result = structured_agent(output_str, StructuredOutput)
-        
+
+        # Extract the answer locally, only use the structured agent if the extraction is ambiguous
+        with timer.span("parse_output"):
+            output_dict, confidence = parse_structured_output(output_str)
+        if output_dict is None or confidence < OUTPUT_CONFIDENCE_THRESHOLD:
+            with timer.span("structured_output") as span:
+                formatted_result = await astructured_agent(output_str, StructuredOutput)
+                span["tokens"] = formatted_result.get("tokens", 0)
+                span["cost"] = formatted_result.get("cost", 0.0)
+            output_dict = json.loads(formatted_result["output"])
+
         # Pass the target after, avoid interaction with Structured Input
-        output_dict = json.loads(formatted_result["output"])
         output_dict["Target"] = target
+
+        # Total the usage of the custom agent and the structured agent
+        cost = agent_result.get("cost", 0.0)
+        token_counts = dict(agent_result.get("token_counts", {}))
+        structured_spans = [span for span in timer.spans if span["stage"].startswith("structured_")]
+        structured_tokens = sum(span["tokens"] for span in structured_spans)
+        if structured_tokens:
+            token_counts["structured_agent"] = [structured_tokens, 0]
+        cost += sum(span["cost"] for span in structured_spans)
+
+        # Keep the cost with the answer so the scorer can checkpoint it
+        output_dict["cost"] = cost
+        output_dict["token_counts"] = token_counts
+        if "evidence_cache" in agent_result:
+            output_dict["evidence_cache"] = agent_result["evidence_cache"]
+        if "response_cache" in agent_result:
+            output_dict["response_cache"] = agent_result["response_cache"]
+        output_dict["timings"] = timer.spans
         output_json = json.dumps(output_dict)
 
+        # Update the live totals
+        if ledger is not None:
+            ledger.record(cost, token_counts)
+
         # Create the output dictionary with all metrics
         output = {
             "output": output_json,
-            "cost": agent_result.get("cost", 0.0),
-            "token_counts": agent_result.get("token_counts", {}),
+            "cost": cost,
+            "token_counts": token_counts,
             "metrics": {
-                "cost": agent_result.get("cost", 0.0),
-                "token_counts": agent_result.get("token_counts", {})
+                "cost": cost,
+                "token_counts": token_counts
             }
         }
 
@@ -1,22 +1,60 @@
-from paperqa import Settings, agent_query
-from paperqa.settings import AgentSettings, AnswerSettings
+from contextlib import nullcontext
+import threading
+from typing import TYPE_CHECKING
+
+from inspect_agentic_mcq.cache import RESPONSE_CACHE_MISS, ResponseCache
+from inspect_agentic_mcq.rate_limit import (
+    PAPERQA_GOVERNOR,
+    count_tokens,
+    get_governor,
+    model_tokens_per_minute,
+    rate_limit_string,
+)
+
+# PaperQA is imported when the agent first queries it, and the default settings are built on first use
+if TYPE_CHECKING:
+    from paperqa import Settings
+
+    from inspect_agentic_mcq.agents.paperqa_evidence_cache import EvidenceSummaryCache
 
 
-async def paperqa_agent(prompt: str, settings: Settings | None = None) -> dict:
+async def paperqa_agent(
+    prompt: str,
+    settings: "Settings | None" = None,
+    cache: ResponseCache | None = None,
+    evidence_cache: "EvidenceSummaryCache | None" = None,
+) -> dict:
     """PaperQA agent wrapper.
 
     Args:
         prompt (str): Prompt for PaperQA2
         settings (Settings | None, optional): PaperQA2 Settings. Defaults to None.
+        cache (ResponseCache | None, optional): Opt-in cache of responses keyed by prompt and settings. Defaults to None.
+        evidence_cache (EvidenceSummaryCache | None, optional): Opt-in cache of evidence summaries, shared across settings that only differ in how the evidence is used. Defaults to None.
 
     Returns:
-        dict: PaperQA answer, cost, and token usage.
+        dict: PaperQA answer, cost, and token usage (and the response and evidence cache usage if the caches are given).
     """
     # Use provided settings or default to paperqa_settings
-    settings_to_use = settings if settings is not None else paperqa_settings
+    settings_to_use = settings if settings is not None else _default_settings()["paperqa_settings"]
+
+    # Replay previous responses for identical prompts and settings
+    if cache is not None:
+        cached = cache.lookup(prompt, settings_to_use)
+        if cached is not None:
+            return cached
+
+    from paperqa import agent_query
 
+    # Queries have their own governor, so the formatting calls do not wait for their slots. The query's own LLM calls
+    # are metered by the rate limits in its settings
+    governor = get_governor(PAPERQA_GOVERNOR)
     try:
-        response = await agent_query(query=prompt, settings=settings_to_use)
+        # The cost of a query is only known afterwards, so only a concurrency slot is reserved
+        async with governor.slot():
+            # Reuse evidence summaries of previous queries with the same question and chunks
+            with evidence_cache.use() if evidence_cache is not None else nullcontext() as evidence_usage:
+                response = await agent_query(query=prompt, settings=settings_to_use)
         session = response.session
         
         # Get cost and token counts from the session
@@ -30,12 +68,23 @@ async def paperqa_agent(prompt: str, settings: Settings | None = None) -> dict:
                     token_counts[model] = [int(counts[0]), int(counts[1])]
                 else:
                     token_counts[model] = [0, 0]
-        
-        return {
+        # The provider's token budget is shared, so the query's tokens also draw down the default governor
+        tokens = count_tokens(token_counts)
+        governor.record_usage(tokens)
+        get_governor().record_usage(tokens)
+
+        result = {
             "answer": session.answer,
             "cost": cost,
             "token_counts": token_counts
         }
+        if cache is not None:
+            cache.store(prompt, settings_to_use, result)
+            result["response_cache"] = dict(RESPONSE_CACHE_MISS)
+        if evidence_usage is not None:
+            result["evidence_cache"] = evidence_usage
+
+        return result
     except Exception as e:
         print(f"Error in paperqa_agent: {str(e)}")
         return {
@@ -45,6 +94,9 @@ async def paperqa_agent(prompt: str, settings: Settings | None = None) -> dict:
         }
 
 
+# Shared provider rate limit, see inspect_agentic_mcq.rate_limit
+DEFAULT_RATE_LIMIT = rate_limit_string(model_tokens_per_minute())
+
 # Set up LLM config (main LLM for reasoning, extract metadata, ...)
 llm_config_dict = {
     "model_list": [
@@ -57,43 +109,74 @@ llm_config_dict = {
             },
         }
     ],
-    "rate_limit": {"gpt-4o-mini": "30000 per 1 minute"},
+    "rate_limit": {"gpt-4o-mini": DEFAULT_RATE_LIMIT},
 }
 
-# Set up agent (answer search and selecting tools):
-agent_settings = AgentSettings(
-    agent_llm="gpt-4o-mini", agent_llm_config={"rate_limit": "30000 per 1 minute"}, timeout=1200.0
-)
-
 # Set up summary LLM config
-summary_config_dict = {"rate_limit": {"gpt-4o-mini": "30000 per 1 minute"}}
-
-# Set up answer format
-answer_settings = AnswerSettings(
-    evidence_k=30,
-    evidence_detailed_citations=False,
-    evidence_retrieval=False,
-    evidence_summary_length="around 100 words",
-    evidence_skip_summary=False,
-    answer_max_sources=1,
-    max_answer_attempts=3,
-    answer_length="1 letter",
-)
+summary_config_dict = {"rate_limit": {"gpt-4o-mini": DEFAULT_RATE_LIMIT}}
 
-# Set up the final settings object
-paperqa_settings = Settings(
-    llm="gpt-4o-mini",
-    llm_config=llm_config_dict,
-    summary_llm="gpt-4o-mini",
-    summary_llm_config=summary_config_dict,
-    agent=agent_settings,
-    temperature=0,
-    batch_size=1,
-    verbosity=1,
-    paper_directory="/root/paperQA2_analysis/data/LitQA_data/LitQA2_test_pdfs",
-)
+# Default settings, built by _default_settings on first use
+_DEFAULT_SETTINGS: dict | None = None
+_DEFAULT_SETTINGS_LOCK = threading.Lock()
+
+
+def _default_settings() -> dict:
+    """Build the default PaperQA settings once, importing PaperQA only then.
+
+    Returns:
+        dict: 'agent_settings', 'answer_settings' and 'paperqa_settings'.
+    """
+    global _DEFAULT_SETTINGS
+    with _DEFAULT_SETTINGS_LOCK:
+        if _DEFAULT_SETTINGS is not None:
+            return _DEFAULT_SETTINGS
+
+        from paperqa import Settings
+        from paperqa.settings import AgentSettings, AnswerSettings
+
+        # Set up agent (answer search and selecting tools):
+        agent_settings = AgentSettings(
+            agent_llm="gpt-4o-mini", agent_llm_config={"rate_limit": DEFAULT_RATE_LIMIT}, timeout=1200.0
+        )
+
+        # Set up answer format
+        answer_settings = AnswerSettings(
+            evidence_k=30,
+            evidence_detailed_citations=False,
+            evidence_retrieval=False,
+            evidence_summary_length="around 100 words",
+            evidence_skip_summary=False,
+            answer_max_sources=1,
+            max_answer_attempts=3,
+            answer_length="1 letter",
+        )
+
+        # Set up the final settings object
+        paperqa_settings = Settings(
+            llm="gpt-4o-mini",
+            llm_config=llm_config_dict,
+            summary_llm="gpt-4o-mini",
+            summary_llm_config=summary_config_dict,
+            agent=agent_settings,
+            temperature=0,
+            batch_size=1,
+            verbosity=1,
+            paper_directory="/root/paperQA2_analysis/data/LitQA_data/LitQA2_test_pdfs",
+        )
+
+        _DEFAULT_SETTINGS = {
+            "agent_settings": agent_settings,
+            "answer_settings": answer_settings,
+            "paperqa_settings": paperqa_settings,
+        }
+        return _DEFAULT_SETTINGS
 
 
+def __getattr__(name: str):
+    # The default settings are still importable as module attributes, e.g. `from ... import paperqa_settings`
+    if name in ("agent_settings", "answer_settings", "paperqa_settings"):
+        return _default_settings()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,180 @@
+# Cache of PaperQA evidence summaries, shared across configurations that only differ downstream of evidence gathering
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+from pathlib import Path
+import threading
+from typing import TYPE_CHECKING
+
+from inspect_agentic_mcq.cache import DEFAULT_CACHE_DIR, SQLiteCache, cache_key
+from inspect_agentic_mcq.embedding_store import chunk_hash
+
+# PaperQA is imported when the cache is first used in a query
+if TYPE_CHECKING:
+    from lmi import LLMResult
+    from paperqa.types import Context, Text
+
+
+class EvidenceSummaryCache(SQLiteCache):
+    """Summaries of (question, chunk) pairs keyed by chunk content hash, question, summary model and summary length.
+
+    Changing e.g. evidence_k or answer_max_sources only changes which summaries are used, so variants of a sweep reuse the
+    summaries of each other instead of paying the summary LLM again.
+    """
+
+    def __init__(self, path: str | Path | None = None, max_entries: int = 1_000_000) -> None:
+        if path is None:
+            path = DEFAULT_CACHE_DIR / "evidence_summaries.sqlite"
+        super().__init__(path, max_entries=max_entries)
+
+        # Tokens and cost of the summary calls that were skipped in this process
+        self.tokens_saved = 0
+        self.cost_saved = 0.0
+        self._saved_lock = threading.Lock()
+
+    def __setstate__(self, state: dict) -> None:
+        super().__setstate__(state)
+        self._saved_lock = threading.Lock()
+
+    def summary_key(
+        self,
+        text: str,
+        question: str,
+        summary_model: str,
+        summary_length: str | None,
+        prompt_templates: tuple[str, str],
+        use_json: bool,
+    ) -> str:
+        """Create the cache key of a summary.
+
+        Args:
+            text (str): Chunk text.
+            question (str): Question the chunk is summarised for.
+            summary_model (str): Name of the summary LLM.
+            summary_length (str | None): Evidence summary length, e.g. "around 100 words".
+            prompt_templates (tuple[str, str]): Summary user and system prompt templates.
+            use_json (bool): Whether the summary is parsed as json.
+
+        Returns:
+            str: Cache key.
+        """
+        return cache_key(
+            chunk_hash(text), question, summary_model, summary_length, prompt_templates, use_json
+        )
+
+    def stats(self) -> dict:
+        """Get the cache usage for this process.
+
+        Returns:
+            dict: Hits, misses, hit rate, number of stored entries, and the tokens and cost saved.
+        """
+        return {
+            **super().stats(),
+            "tokens_saved": self.tokens_saved,
+            "cost_saved": self.cost_saved,
+        }
+
+    @contextmanager
+    def use(self):
+        """Serve PaperQA evidence summaries from this cache for the PaperQA queries run inside the context.
+
+        Only affects the current asyncio task (and the tasks it starts), so concurrent queries can use different caches.
+
+        Yields:
+            dict: Hits, misses and the tokens and cost saved by the queries inside the context.
+        """
+        _install()
+        usage = {"hits": 0, "misses": 0, "tokens_saved": 0, "cost_saved": 0.0}
+        token = _ACTIVE_CACHE.set((self, usage))
+        try:
+            yield usage
+        finally:
+            _ACTIVE_CACHE.reset(token)
+
+
+# Cache and usage counters of the current query, set by EvidenceSummaryCache.use
+_ACTIVE_CACHE: ContextVar[tuple[EvidenceSummaryCache, dict] | None] = ContextVar(
+    "evidence_summary_cache", default=None
+)
+_INSTALL_LOCK = threading.Lock()
+
+
+async def _cached_map_fxn_summary(
+    text: "Text",
+    question: str,
+    summary_llm_model,
+    prompt_templates: tuple[str, str] | None,
+    extra_prompt_data: dict[str, str] | None = None,
+    parser=None,
+    callbacks=None,
+) -> "tuple[Context, LLMResult]":
+    """Drop-in replacement of paperqa.core.map_fxn_summary that reuses cached summaries."""
+    from lmi import LLMResult
+    from paperqa.core import map_fxn_summary
+    from paperqa.types import Context, Text
+
+    active = _ACTIVE_CACHE.get()
+    if active is None or summary_llm_model is None or prompt_templates is None:
+        return await map_fxn_summary(
+            text, question, summary_llm_model, prompt_templates, extra_prompt_data, parser, callbacks
+        )
+
+    cache, usage = active
+    key = cache.summary_key(
+        text.text,
+        question,
+        summary_llm_model.name,
+        (extra_prompt_data or {}).get("summary_length"),
+        prompt_templates,
+        parser is not None,
+    )
+
+    cached = cache.get(key)
+    if cached is not None:
+        entry = json.loads(cached)
+        tokens = entry["prompt_count"] + entry["completion_count"]
+        usage["hits"] += 1
+        usage["tokens_saved"] += tokens
+        usage["cost_saved"] += entry["cost"]
+        with cache._saved_lock:
+            cache.tokens_saved += tokens
+            cache.cost_saved += entry["cost"]
+
+        # Rebuild the context around this chunk the same way PaperQA does
+        context = Context(
+            **entry["context"],
+            question=question,
+            text=Text(
+                doc=text.doc.model_dump(exclude={"embedding"}),
+                **text.model_dump(exclude={"embedding", "doc"}),
+            ),
+        )
+        # No LLM call was made, so no tokens are added to the session
+        return context, LLMResult(model="", date="")
+
+    usage["misses"] += 1
+    context, llm_result = await map_fxn_summary(
+        text, question, summary_llm_model, prompt_templates, extra_prompt_data, parser, callbacks
+    )
+    cache.set(
+        key,
+        json.dumps(
+            {
+                "context": context.model_dump(mode="json", exclude={"id", "question", "text"}),
+                "prompt_count": llm_result.prompt_count,
+                "completion_count": llm_result.completion_count,
+                "cost": llm_result.cost,
+            }
+        ),
+    )
+    return context, llm_result
+
+
+def _install() -> None:
+    """Route PaperQA's evidence gathering through the cache. Queries outside EvidenceSummaryCache.use are unaffected."""
+    import paperqa.docs
+
+    with _INSTALL_LOCK:
+        if paperqa.docs.map_fxn_summary is not _cached_map_fxn_summary:
+            paperqa.docs.map_fxn_summary = _cached_map_fxn_summary
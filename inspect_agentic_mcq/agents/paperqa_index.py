@@ -0,0 +1,54 @@
+import time
+
+from paperqa import Settings
+from paperqa.agents.search import get_directory_index
+
+
+def is_paperqa_settings(settings) -> bool:
+    """Check if an object is PaperQA Settings, which configure a paper index.
+
+    Args:
+        settings: Object to check, usually the 'settings' kwarg of a custom agent.
+
+    Returns:
+        bool: True if the settings configure a PaperQA index.
+    """
+    return isinstance(settings, Settings)
+
+
+async def warm_up_index(settings: Settings) -> Settings:
+    """Build or validate the PaperQA index once, before any sample is run.
+
+    Args:
+        settings (Settings): PaperQA2 Settings pointing at the paper directory.
+
+    Returns:
+        Settings: Copy of the settings which reuses the built index without rebuilding or re-syncing it on every query.
+    """
+    index_name = settings.get_index_name()
+    print(f"Warming up PaperQA index '{index_name}'...")
+
+    start = time.perf_counter()
+    index = await get_directory_index(settings=settings, build=True)
+    elapsed = time.perf_counter() - start
+
+    index_files = await index.index_files
+    print(f"Index '{index_name}' ready with {len(index_files)} files in {elapsed:.2f}s")
+
+    return reuse_index(settings)
+
+
+def reuse_index(settings: Settings) -> Settings:
+    """Copy settings so that queries open the existing index instead of racing to build or sync it.
+
+    Args:
+        settings (Settings): PaperQA2 Settings of an index that has already been warmed up.
+
+    Returns:
+        Settings: Copy of the settings with index rebuilding and syncing disabled.
+    """
+    reused_settings = settings.model_copy(deep=True)
+    reused_settings.agent.rebuild_index = False
+    reused_settings.agent.index.sync_with_paper_directory = False
+
+    return reused_settings
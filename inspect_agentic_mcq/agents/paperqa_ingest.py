@@ -0,0 +1,477 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+from pathlib import Path
+import time
+
+from paperqa import Docs, Settings
+from paperqa.agents.search import FAILED_DOCUMENT_ADD_ID, SearchIndex, fetch_kwargs_from_manifest, maybe_get_manifest
+from paperqa.types import Doc, DocDetails, Text
+
+from inspect_agentic_mcq.embedding_store import EmbeddingStore, chunk_hash
+
+
+def hash_file(path: str | Path) -> str:
+    """Hash the contents of a file.
+
+    Args:
+        path (str | Path): File to hash.
+
+    Returns:
+        str: Hex sha256 digest of the file contents.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def open_index(settings: Settings) -> SearchIndex:
+    """Open (or create) the PaperQA search index for the settings, without building it.
+
+    The index has the same fields, name and directory as in paperqa.agents.search.get_directory_index, and its files
+    are stored at the locations given by index_file_location.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+
+    Returns:
+        SearchIndex: The same index that paperqa_agent queries.
+    """
+    index_settings = settings.agent.index
+    return SearchIndex(
+        fields=[*SearchIndex.REQUIRED_FIELDS, "title", "year"],
+        index_name=index_settings.name or settings.get_index_name(),
+        index_directory=index_settings.index_directory,
+    )
+
+
+def paper_file(paper_directory: str | Path, path: str | Path) -> str:
+    """Get the path of a paper relative to the paper directory.
+
+    Symlinks inside the paper directory keep their own name, while other paths are resolved first, so absolute paths
+    and paths through symlinked directories are also accepted.
+
+    Args:
+        paper_directory (str | Path): Directory containing the PDFs.
+        path (str | Path): Paper, either absolute or relative to the working directory.
+
+    Raises:
+        ValueError: If the paper is not inside the paper directory.
+
+    Returns:
+        str: Path of the paper relative to the paper directory.
+    """
+    paper_directory = Path(paper_directory)
+    abs_path = Path(os.path.normpath(Path(path).absolute()))
+    if abs_path.is_relative_to(paper_directory.absolute()):
+        return str(abs_path.relative_to(paper_directory.absolute()))
+    abs_path = Path(path).absolute()
+    if abs_path.resolve().is_relative_to(paper_directory.resolve()):
+        return str(abs_path.resolve().relative_to(paper_directory.resolve()))
+    raise ValueError(f"{path} is not inside the paper directory {paper_directory}")
+
+
+def index_file_location(settings: Settings, path: str | Path) -> tuple[str, str]:
+    """Get the location of a paper in the index, and the fallback location of its metadata manifest entry.
+
+    Papers are stored by their absolute path or their path relative to the paper directory, following the
+    'use_absolute_paper_directory' index setting as PaperQA's own index builder does.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+        path (str | Path): Paper, either absolute or relative to the paper directory.
+
+    Raises:
+        ValueError: If the paper is not inside the paper directory.
+
+    Returns:
+        tuple[str, str]: File location in the index, and the other (absolute or relative) location.
+    """
+    paper_directory = Path(settings.agent.index.paper_directory).absolute()
+    rel_path = paper_file(paper_directory, paper_directory / path)
+    abs_path = paper_directory / rel_path
+    if settings.agent.index.use_absolute_paper_directory:
+        return str(abs_path), str(rel_path)
+    return str(rel_path), str(abs_path)
+
+
+def _manifest_metadata(settings: Settings, path: str | Path, manifest: dict) -> dict:
+    """Get the Docs.aadd kwargs of a paper from PaperQA's metadata manifest, empty if it has no entry."""
+    file_location, fallback_location = index_file_location(settings, path)
+    return fetch_kwargs_from_manifest(file_location, manifest, fallback_location)
+
+
+def _read_pdf(path: str, settings: dict, metadata: dict) -> tuple[Doc, list[Text], float]:
+    """Parse, chunk and add the metadata of a single PDF, without embedding it. Runs in a worker process.
+
+    The document goes through Docs.aadd like in PaperQA's own index builder, so it gets the same citation, title, year
+    and other metadata (from the metadata manifest, the LLM citation and the metadata clients if 'use_doc_details').
+
+    Args:
+        path (str): Path to the PDF.
+        settings (dict): Dumped PaperQA2 Settings, with the embedding deferred.
+        metadata (dict): Entry of the PDF in the metadata manifest, empty if it has none.
+
+    Returns:
+        tuple[Doc, list[Text], float]: Document, its chunks, and the parsing time in seconds.
+    """
+    start = time.perf_counter()
+
+    docs = Docs()
+    asyncio.run(
+        docs.aadd(
+            path=path,
+            fields=["title", "author", "journal", "year"],
+            settings=Settings.model_validate(settings),
+            **metadata,
+        )
+    )
+    doc = next(iter(docs.docs.values()))
+
+    return doc, docs.texts, time.perf_counter() - start
+
+
+async def _embed_texts(
+    texts: list[Text],
+    embedding_model,
+    batch_size: int,
+    semaphore: asyncio.Semaphore,
+    embedding_store: EmbeddingStore | None = None,
+    model_name: str | None = None,
+) -> None:
+    """Embed chunks in batches, with the number of in-flight batches bounded by the semaphore.
+
+    Chunks already in the embedding store are not embedded again, and new embeddings are added to the store.
+    """
+    # Reuse stored embeddings and only embed the missing chunks
+    to_embed = texts
+    if embedding_store is not None:
+        stored = embedding_store.get(model_name, [chunk_hash(t.text) for t in texts])
+        to_embed = []
+        for text in texts:
+            embedding = stored.get(chunk_hash(text.text))
+            if embedding is None:
+                to_embed.append(text)
+            else:
+                text.embedding = embedding.tolist()
+
+    async def embed_batch(batch: list[Text]) -> None:
+        async with semaphore:
+            embeddings = await embedding_model.embed_documents([t.text for t in batch])
+        for text, embedding in zip(batch, embeddings):
+            text.embedding = embedding
+        if embedding_store is not None:
+            embedding_store.put(model_name, [chunk_hash(t.text) for t in batch], embeddings)
+
+    batches = [to_embed[i : i + batch_size] for i in range(0, len(to_embed), batch_size)]
+    await asyncio.gather(*(embed_batch(batch) for batch in batches))
+
+
+async def ingest_papers(
+    settings: Settings,
+    paths: list[str | Path] | None = None,
+    max_workers: int | None = None,
+    embedding_batch_size: int = 32,
+    max_inflight_batches: int = 4,
+    embedding_store: EmbeddingStore | None = None,
+) -> dict:
+    """Parse, chunk and embed PDFs in parallel and add them to the PaperQA index used by paperqa_agent.
+
+    Parsing runs in a process pool, while embedding runs concurrently in the event loop with a bounded number of in-flight batches.
+    PDFs outside the paper directory are skipped and reported as failed.
+
+    Args:
+        settings (Settings): PaperQA2 Settings, the index and paper directory are taken from these.
+        paths (list[str | Path] | None, optional): PDFs to ingest. Defaults to None, which ingests every PDF in the paper directory.
+        max_workers (int | None, optional): Number of parsing processes. Defaults to None (one per CPU).
+        embedding_batch_size (int, optional): Number of chunks per embedding request. Defaults to 32.
+        max_inflight_batches (int, optional): Maximum number of embedding requests in flight. Defaults to 4.
+        embedding_store (EmbeddingStore | None, optional): Store of previously computed embeddings to reuse. Defaults to None.
+
+    Returns:
+        dict: Per-file and total ingestion statistics.
+    """
+    paper_directory = Path(settings.agent.index.paper_directory)
+    if paths is None:
+        paths = sorted(paper_directory.rglob("*.pdf"))
+    paths = [Path(p) for p in paths]
+
+    files = []
+
+    # Papers are stored relative to the paper directory, so skip any paper outside it
+    paper_files = {}
+    for path in paths:
+        try:
+            paper_files[path] = paper_file(paper_directory, path)
+        except ValueError as e:
+            print(f"Skipping {path}: {str(e)}")
+            files.append({"file": str(path), "size_mb": 0.0, "error": str(e)})
+    paths = list(paper_files)
+
+    search_index = open_index(settings)
+    manifest = await maybe_get_manifest(filename=await settings.agent.index.finalize_manifest_file())
+
+    # The chunks are embedded here (with the embedding store), not while parsing. The files filter is a lambda, which
+    # cannot be sent to the worker processes
+    parse_settings = settings.model_copy(deep=True)
+    parse_settings.parsing.defer_embedding = True
+    parse_settings = parse_settings.model_dump(exclude={"agent": {"index": {"files_filter"}}})
+
+    embedding_model = settings.get_embedding_model()
+    semaphore = asyncio.Semaphore(max_inflight_batches)
+    loop = asyncio.get_running_loop()
+
+    start = time.perf_counter()
+
+    async def ingest_one(path: Path, parsed: asyncio.Future) -> None:
+        file = paper_files[path]
+        file_location, _ = index_file_location(settings, file)
+        size_mb = path.stat().st_size / 1e6
+        try:
+            doc, texts, parse_time = await parsed
+
+            embed_start = time.perf_counter()
+            await _embed_texts(
+                texts,
+                embedding_model,
+                embedding_batch_size,
+                semaphore,
+                embedding_store=embedding_store,
+                model_name=settings.embedding,
+            )
+            embed_time = time.perf_counter() - embed_start
+
+            # Store the document the same way PaperQA's own index builder does
+            docs = Docs()
+            await docs.aadd_texts(texts=texts, doc=doc, settings=settings)
+            if isinstance(doc, DocDetails):
+                title, year = doc.title or path.name, doc.year or "Unknown year"
+            else:
+                title, year = path.name, "Unknown year"
+            await search_index.add_document(
+                {
+                    "title": title,
+                    "year": year,
+                    "file_location": file_location,
+                    "body": "".join(t.text for t in texts),
+                },
+                document=docs,
+            )
+        except Exception as e:
+            print(f"Error ingesting {file_location}: {str(e)}")
+            await search_index.mark_failed_document(file_location)
+            files.append({"file": file, "size_mb": size_mb, "error": str(e)})
+            return
+
+        print(
+            f"{file}: {len(texts)} chunks, {size_mb:.1f} MB, parsed in {parse_time:.2f}s, embedded in {embed_time:.2f}s"
+        )
+        files.append(
+            {
+                "file": file,
+                "size_mb": size_mb,
+                "chunks": len(texts),
+                "parse_time": parse_time,
+                "embed_time": embed_time,
+            }
+        )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        parsed = [
+            loop.run_in_executor(
+                pool,
+                _read_pdf,
+                str(path),
+                parse_settings,
+                _manifest_metadata(settings, paper_files[path], manifest),
+            )
+            for path in paths
+        ]
+        await asyncio.gather(*(ingest_one(path, p) for path, p in zip(paths, parsed)))
+
+    if search_index.changed:
+        await search_index.save_index()
+    elapsed = time.perf_counter() - start
+
+    # Summarise the throughput
+    ingested = [f for f in files if "error" not in f]
+    total_mb = sum(f["size_mb"] for f in ingested)
+    total_chunks = sum(f["chunks"] for f in ingested)
+    stats = {
+        "files": files,
+        "ingested": len(ingested),
+        "failed": len(files) - len(ingested),
+        "total_time": elapsed,
+        "files_per_second": len(ingested) / elapsed if elapsed else 0.0,
+        "mb_per_second": total_mb / elapsed if elapsed else 0.0,
+        "chunks_per_second": total_chunks / elapsed if elapsed else 0.0,
+    }
+
+    print("\n--- Ingestion Summary ---")
+    print(f"Ingested {stats['ingested']} files ({stats['failed']} failed) in {elapsed:.2f}s")
+    print(
+        f"Throughput: {stats['files_per_second']:.2f} files/s, {stats['mb_per_second']:.2f} MB/s, {stats['chunks_per_second']:.1f} chunks/s"
+    )
+    print("-------------------------\n")
+
+    return stats
+
+
+def manifest_path(settings: Settings) -> Path:
+    """Location of the content-hash manifest for the index of a paper directory.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+
+    Returns:
+        Path: Manifest file stored next to the index.
+    """
+    index_directory = Path(settings.agent.index.index_directory)
+    return index_directory / f"{open_index(settings).index_name}_manifest.json"
+
+
+def load_manifest(settings: Settings) -> dict[str, str]:
+    """Load the content hashes of the files already in the index.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+
+    Returns:
+        dict[str, str]: File location (relative to the paper directory) to content hash.
+    """
+    path = manifest_path(settings)
+    if not path.exists():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(settings: Settings, manifest: dict[str, str]) -> None:
+    """Save the content hashes of the files in the index.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+        manifest (dict[str, str]): File location (relative to the paper directory) to content hash.
+    """
+    path = manifest_path(settings)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=2)
+
+
+async def bootstrap_manifest(settings: Settings) -> dict[str, str]:
+    """Build the content-hash manifest of an index that has none, from the files already in the index.
+
+    The files are hashed as they are now, so they count as unchanged. Files that failed to ingest, are missing or are
+    excluded by the 'files_filter' index setting are left out, so they are ingested again.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+
+    Returns:
+        dict[str, str]: File location (relative to the paper directory) to content hash.
+    """
+    index_settings = settings.agent.index
+    paper_directory = Path(index_settings.paper_directory)
+
+    manifest = {}
+    for file_location, status in (await open_index(settings).index_files).items():
+        if status == FAILED_DOCUMENT_ADD_ID:
+            continue
+        try:
+            file = paper_file(paper_directory, paper_directory / file_location)
+        except ValueError:
+            continue
+        path = paper_directory / file
+        if path.suffix == ".pdf" and path.is_file() and index_settings.files_filter(path):
+            manifest[file] = hash_file(path)
+    return manifest
+
+
+def diff_manifest(paper_directory: str | Path, manifest: dict[str, str]) -> dict:
+    """Compare the PDFs in a paper directory against a manifest.
+
+    Args:
+        paper_directory (str | Path): Directory containing the PDFs.
+        manifest (dict[str, str]): File location to content hash, see load_manifest.
+
+    Returns:
+        dict: Lists of 'added', 'changed', 'removed' and 'unchanged' file locations, and the current 'hashes'.
+    """
+    paper_directory = Path(paper_directory)
+    hashes = {
+        str(path.relative_to(paper_directory)): hash_file(path)
+        for path in sorted(paper_directory.rglob("*.pdf"))
+    }
+
+    return {
+        "added": [f for f in hashes if f not in manifest],
+        "changed": [f for f in hashes if f in manifest and manifest[f] != hashes[f]],
+        "removed": [f for f in manifest if f not in hashes],
+        "unchanged": [f for f in hashes if manifest.get(f) == hashes[f]],
+        "hashes": hashes,
+    }
+
+
+async def sync_papers(settings: Settings, embedding_store: EmbeddingStore | None = None, **kwargs) -> dict:
+    """Incrementally update the PaperQA index to match its paper directory.
+
+    Only new or changed PDFs are parsed and embedded, and deleted PDFs are pruned from the index. An index without a
+    manifest (e.g. built by PaperQA itself) gets one from the files already in it, see bootstrap_manifest.
+
+    Args:
+        settings (Settings): PaperQA2 Settings.
+        embedding_store (EmbeddingStore | None, optional): Store of previously computed embeddings, so the unchanged chunks
+            of changed PDFs are not embedded again. Defaults to None.
+        **kwargs: Passed to ingest_papers, e.g. max_workers.
+
+    Returns:
+        dict: The manifest diff and the ingestion statistics.
+    """
+    paper_directory = Path(settings.agent.index.paper_directory)
+    if manifest_path(settings).exists():
+        manifest = load_manifest(settings)
+    else:
+        manifest = await bootstrap_manifest(settings)
+    diff = diff_manifest(paper_directory, manifest)
+    print(
+        f"Manifest: {len(diff['added'])} added, {len(diff['changed'])} changed, {len(diff['removed'])} removed, {len(diff['unchanged'])} unchanged"
+    )
+
+    # Prune deleted and outdated files from the index
+    search_index = open_index(settings)
+    for file_location in diff["removed"] + diff["changed"]:
+        await search_index.remove_from_index(index_file_location(settings, file_location)[0])
+        manifest.pop(file_location, None)
+    if search_index.changed:
+        await search_index.save_index()
+
+    # Only ingest the new and changed files
+    stats = None
+    to_ingest = diff["added"] + diff["changed"]
+    if to_ingest:
+        stats = await ingest_papers(
+            settings, paths=[paper_directory / f for f in to_ingest], embedding_store=embedding_store, **kwargs
+        )
+        for f in stats["files"]:
+            if "error" not in f:
+                manifest[f["file"]] = diff["hashes"][f["file"]]
+
+    save_manifest(settings, manifest)
+
+    return {
+        "added": diff["added"],
+        "changed": diff["changed"],
+        "removed": diff["removed"],
+        "ingestion": stats,
+    }
+
+
+if __name__ == "__main__":
+    from inspect_agentic_mcq.agents.paperqa_agent import paperqa_settings
+
+    asyncio.run(sync_papers(paperqa_settings, embedding_store=EmbeddingStore()))
@@ -1,8 +1,18 @@
+from contextlib import contextmanager
+import json
 import os
+import threading
+from typing import TYPE_CHECKING
 
-from autogen import ConversableAgent, LLMConfig
 from pydantic import BaseModel, Field
 
+from inspect_agentic_mcq.cache import DEFAULT_CACHE_DIR, SQLiteCache, cache_key
+from inspect_agentic_mcq.rate_limit import get_governor
+
+# AG2 (and the OpenAI client) is imported when the first formatting agent is created, most answers never need one
+if TYPE_CHECKING:
+    from autogen import ConversableAgent
+
 
 # Using a Pydantic Base Class to structure the output of the agent
 class StructuredInput(BaseModel):
@@ -51,11 +61,203 @@ Text:
 """
 
 
+# Idle formatting agents, reused across calls and keyed by (model, schema, temperature). Every call leases an agent of
+# its own, so the usage the agent records during the call is the usage of that call only
+_AGENT_POOL: dict[tuple, list["ConversableAgent"]] = {}
+_AGENT_POOL_LOCK = threading.Lock()
+
+
+def _create_structured_agent(
+    structure: StructuredInput | StructuredOutput, model: tuple, temp: float
+) -> "ConversableAgent":
+    from autogen import ConversableAgent, LLMConfig
+
+    llm_config = LLMConfig(
+        api_type=model[0],
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=model[1],
+        temperature=temp,
+        response_format=structure,
+    )
+    return ConversableAgent(
+        name="structured_agent",
+        llm_config=llm_config,
+        system_message=AGENT_INSTRUCTIONS,
+    )
+
+
+@contextmanager
+def lease_structured_agent(
+    structure: StructuredInput | StructuredOutput,
+    model: tuple | None = None,
+    temp: float = 0.1,
+):
+    """Lease an idle formatting agent for a single call, creating one if all are in use, and return it afterwards.
+
+    No other call uses the agent while it is leased, so its usage summary can be read before and after the call. The
+    agents (and their OpenAI clients and connection pools) are reused by later calls with the same model, schema and
+    temperature.
+
+    Args:
+        structure (StructuredInput | StructuredOutput): Desired json schema.
+        model (tuple | None, optional): Model provider and name e.g. (openai, "gpt-4o-mini). Defaults to None.
+        temp (float, optional): Temperature of formatting LLM. Defaults to 0.1.
+
+    Yields:
+        ConversableAgent: Agent configured to respond in the desired format.
+    """
+    if model is None:
+        model = ("openai", "gpt-4o-mini")
+
+    key = (tuple(model), structure, temp)
+    with _AGENT_POOL_LOCK:
+        idle = _AGENT_POOL.setdefault(key, [])
+        agent = idle.pop() if idle else None
+    if agent is None:
+        agent = _create_structured_agent(structure, tuple(model), temp)
+    try:
+        yield agent
+    finally:
+        with _AGENT_POOL_LOCK:
+            _AGENT_POOL[key].append(agent)
+
+
+def _usage_totals(agent: "ConversableAgent") -> tuple[int, float]:
+    """Get the tokens and cost an AG2 agent has used so far, from its client's total usage summary."""
+    usage = agent.get_total_usage() or {}
+    tokens = sum(
+        int(counts.get("prompt_tokens", 0)) + int(counts.get("completion_tokens", 0))
+        for counts in usage.values()
+        if isinstance(counts, dict)
+    )
+    return tokens, float(usage.get("total_cost", 0.0))
+
+
+# Persistent cache of formatting results, created on first use
+_STRUCTURED_CACHE: SQLiteCache | None = None
+
+
+def get_structured_cache() -> SQLiteCache:
+    """Get the default on-disk cache for structured agent results.
+
+    Returns:
+        SQLiteCache: Cache stored in DEFAULT_CACHE_DIR.
+    """
+    global _STRUCTURED_CACHE
+    with _AGENT_POOL_LOCK:
+        if _STRUCTURED_CACHE is None:
+            _STRUCTURED_CACHE = SQLiteCache(DEFAULT_CACHE_DIR / "structured_agent.sqlite")
+        return _STRUCTURED_CACHE
+
+
+def _resolve_cache(cache: SQLiteCache | bool) -> SQLiteCache | None:
+    if cache is True:
+        return get_structured_cache()
+    # Not `cache or None`, an empty cache has a length of 0
+    if cache is False or cache is None:
+        return None
+    return cache
+
+
+def _structured_cache_key(
+    input_text: str,
+    structure: StructuredInput | StructuredOutput,
+    model: tuple | None,
+    temp: float,
+) -> str:
+    if model is None:
+        model = ("openai", "gpt-4o-mini")
+    # Include the schema fields so changing a field or its description invalidates old results
+    return cache_key(
+        input_text,
+        structure.__name__,
+        structure.model_json_schema(),
+        list(model),
+        temp,
+    )
+
+
+def _reply_text(reply) -> str:
+    """Get the reply of a formatting agent as the schema's json.
+
+    Args:
+        reply (str | dict): Content string, full message, or the schema's format() dict that AG2 replaces the content with.
+
+    Returns:
+        str: JSON of the structured output, with lowercase field names.
+    """
+    # Replies can be either the content string or the full message
+    if isinstance(reply, dict) and "content" in reply:
+        reply = reply["content"]
+
+    # AG2 replaces the content with the schema's format() dict, convert it back to the schema's json
+    if isinstance(reply, dict):
+        reply = json.dumps({key.lower(): value for key, value in reply.items()})
+    return reply
+
+
+async def astructured_agent(
+    input_text: str,
+    structure: StructuredInput | StructuredOutput,
+    model: tuple | None = None,
+    temp: float = 0.1,
+    cache: SQLiteCache | bool = True,
+) -> dict:
+    """Async agent to structure text to specified format, safe to await concurrently.
+
+    Args:
+        input_text (str): Input to format.
+        structure (StructuredInput | StructuredOutput): Desired json schema.
+        model (tuple | None, optional): Model provider and name e.g. (openai, "gpt-4o-mini). Defaults to None.
+        temp (float, optional): Temperature of formatting LLM. Defaults to 0.1.
+        cache (SQLiteCache | bool, optional): Cache for results, True for the default on-disk cache, False to disable. Defaults to True.
+
+    Returns:
+        dict: Output string in the desired format, and the tokens and cost used (0 when cached).
+    """
+    # Return previously formatted results
+    cache = _resolve_cache(cache)
+    if cache is not None:
+        key = _structured_cache_key(input_text, structure, model, temp)
+        cached = cache.get(key)
+        if cached is not None:
+            return {"output": cached, "tokens": 0, "cost": 0.0}
+
+    # Rough token estimate of the prompt, schema and reply for the shared rate limit
+    governor = get_governor()
+    estimated_tokens = len(input_text) // 4 + 500
+
+    with lease_structured_agent(structure, model=model, temp=temp) as agent:
+        tokens_before, cost_before = _usage_totals(agent)
+
+        # Pass the messages explicitly so the reused agent keeps no chat history between calls
+        async with governor.slot(estimated_tokens):
+            reply = await agent.a_generate_reply(
+                messages=[
+                    {"role": "user", "content": ANSWER_MESSAGE_TEMPLATE.format(text=input_text)}
+                ]
+            )
+
+        # The actual usage of the call, as recorded by AG2 (falling back to the estimate if it recorded none)
+        tokens_after, cost_after = _usage_totals(agent)
+    tokens = tokens_after - tokens_before or estimated_tokens
+    cost = cost_after - cost_before
+    governor.record_usage(tokens, reserved=estimated_tokens)
+
+    reply = _reply_text(reply)
+
+    if cache is not None:
+        cache.set(key, reply)
+
+    return {"output": reply, "tokens": tokens, "cost": cost}
+
+
 def structured_agent(
     input_text: str,
     structure: StructuredInput | StructuredOutput,
     model: tuple | None = None,
     temp: float = 0.1,
+    cache: SQLiteCache | bool = True,
 ) -> dict:
     """Agent to structure text to specified format.
 
@@ -64,10 +266,21 @@ def structured_agent(
         structure (StructuredInput | StructuredOutput): Desired json schema.
         model (tuple | None, optional): Model provider and name e.g. (openai, "gpt-4o-mini). Defaults to None.
         temp (float, optional): Temperature of formatting LLM. Defaults to 0.1.
+        cache (SQLiteCache | bool, optional): Cache for results, True for the default on-disk cache, False to disable. Defaults to True.
 
     Returns:
         dict: Output string in the desired format.
     """
+    # Return previously formatted results
+    cache = _resolve_cache(cache)
+    if cache is not None:
+        key = _structured_cache_key(input_text, structure, model, temp)
+        cached = cache.get(key)
+        if cached is not None:
+            return {"output": cached}
+
+    from autogen import ConversableAgent, LLMConfig
+
     # Default model to OpenAI gpt-4o-mini
     if model is None:
         model = ("openai", "gpt-4o-mini")
@@ -94,11 +307,14 @@ def structured_agent(
 
     response.process()
 
-    # Get the final message
-    final_message = response.messages[-1]
+    # Get the final message, as the same json as astructured_agent
+    output = _reply_text(response.messages[-1])
+
+    if cache is not None:
+        cache.set(key, output)
 
     return {
-        "output": final_message["content"]
+        "output": output
     }
 
 
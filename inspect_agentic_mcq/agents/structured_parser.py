@@ -0,0 +1,111 @@
+import re
+
+
+# Patterns for the prompt layout produced by record_to_sample_custom
+QUESTION_PATTERN = re.compile(r"^Question:\s*\S", re.MULTILINE)
+CHOICE_PATTERN = re.compile(r"^[A-Z]\)\s*\S", re.MULTILINE)
+TARGET_PATTERN = re.compile(r"^Target:\s*([A-Z]{1,2})\s*$", re.MULTILINE)
+
+# Patterns for PaperQA answers produced with answer_length="1 letter"
+ANSWER_PATTERN = re.compile(r"\bANSWER:\s*\(?(NA|[A-Z])\)?(?![A-Za-z])")
+ANSWER_LINE_PATTERN = re.compile(r"^ANSWER:\s*\(?(NA|[A-Z])\)?\.?$")
+LETTER_ONLY_PATTERN = re.compile(r"^\(?(NA|[A-Z])\)?\.?$")
+CITATION_PATTERN = re.compile(r"\(([^()]*?\bpages?\s+\d+(?:-\d+)?[^()]*)\)")
+
+# Minimum confidence for the rule-based output to be used instead of the LLM formatter
+OUTPUT_CONFIDENCE_THRESHOLD = 0.8
+
+
+def _normalise_lines(text: str) -> str:
+    """Strip the indentation of every line so indented prompts (e.g. triple quoted strings) still match."""
+    return "\n".join(line.strip() for line in text.strip().splitlines())
+
+
+def parse_structured_input(text: str, metadata: dict | None = None) -> dict | None:
+    """Deterministically recover the question and target from a bridge prompt without an LLM call.
+
+    Args:
+        text (str): Prompt generated by record_to_sample_custom ("Question: ...", lettered choices, "NA) ...", "Target: X").
+        metadata (dict | None, optional): Sample metadata, used directly if it contains 'question' and 'target'. Defaults to None.
+
+    Returns:
+        dict | None: Dictionary with 'question' and 'target' keys (same as StructuredInput), or None if the layout is not recognised.
+    """
+    # Prefer the metadata stored on the Sample
+    if metadata and metadata.get("question") and metadata.get("target"):
+        return {"question": metadata["question"], "target": metadata["target"]}
+
+    normalised = _normalise_lines(text)
+
+    # The prompt must have a question and at least one lettered choice
+    question_match = QUESTION_PATTERN.search(normalised)
+    if question_match is None or CHOICE_PATTERN.search(normalised) is None:
+        return None
+
+    # Exactly one target line is expected, anything else is left to the LLM
+    target_matches = list(TARGET_PATTERN.finditer(normalised))
+    if len(target_matches) != 1:
+        return None
+    target_match = target_matches[0]
+
+    # The question block is everything before the target line
+    question = normalised[question_match.start() : target_match.start()].strip()
+    if not question:
+        return None
+
+    return {"question": question, "target": target_match.group(1)}
+
+
+def parse_structured_output(text: str) -> tuple[dict | None, float]:
+    """Extract the answer letter, explanation and citations from an agent answer without an LLM call.
+
+    Args:
+        text (str): Answer from the custom agent, e.g. a PaperQA answer ending in "ANSWER: E".
+
+    Returns:
+        tuple[dict | None, float]: Dictionary with 'answer', 'explanation' and 'citations' keys (same as StructuredOutput), or None if no answer was found, and the confidence of the extraction between 0 and 1.
+    """
+    normalised = _normalise_lines(text)
+
+    # Target lines are added by the bridge, they are not part of the answer
+    lines = [
+        line
+        for line in normalised.splitlines()
+        if line and not TARGET_PATTERN.fullmatch(line)
+    ]
+    if not lines:
+        return None, 0.0
+
+    letters = {match.group(1) for match in ANSWER_PATTERN.finditer(normalised)}
+    answer_lines = [line for line in lines if ANSWER_LINE_PATTERN.fullmatch(line)]
+    letter_only = LETTER_ONLY_PATTERN.fullmatch("\n".join(lines))
+
+    # Work out the answer and how much to trust it
+    if len(letters) > 1:
+        # Conflicting answers, leave it to the LLM
+        return None, 0.0
+    elif answer_lines and answer_lines[-1] == lines[-1]:
+        # The expected layout, a final "ANSWER: X" line
+        answer, confidence = letters.pop(), 1.0
+    elif answer_lines:
+        answer, confidence = letters.pop(), 0.9
+    elif letter_only:
+        answer, confidence = letter_only.group(1), 0.9
+    elif letters:
+        # Only mentioned within the text
+        answer, confidence = letters.pop(), 0.5
+    else:
+        return None, 0.0
+
+    # The explanation is the answer text without the answer line
+    explanation = "\n".join(line for line in lines if line not in answer_lines)
+
+    # Collect the unique citation keys in order of appearance
+    citations = []
+    for match in CITATION_PATTERN.finditer(normalised):
+        for citation in re.split(r"[;,]\s*(?=\S+\s+pages?\b)", match.group(1)):
+            citation = citation.strip()
+            if citation and citation not in citations:
+                citations.append(citation)
+
+    return {"answer": answer, "explanation": explanation, "citations": citations}, confidence
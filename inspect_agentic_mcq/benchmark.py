@@ -0,0 +1,357 @@
+# Benchmarks of the harness hot paths on synthetic datasets, saved as JSON and compared against a baseline to flag slowdowns
+
+import asyncio
+from collections.abc import Callable
+from datetime import datetime, timezone
+import json
+import os
+from pathlib import Path
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from inspect_ai.scorer import CORRECT, INCORRECT, NOANSWER, Target
+
+from inspect_agentic_mcq.agents.bridge_agent import bridge_agent
+from inspect_agentic_mcq.evaluate import MultipleChoiceEval, _usage_totals
+from inspect_agentic_mcq.inspect_ai_custom.paperqa_scorer import paperqa_scorer
+from inspect_agentic_mcq.inspect_ai_custom.score_stats import score_summary
+from inspect_agentic_mcq.inspect_ai_custom.sample import df_2_sample_bridge
+
+
+# Dataset sizes of the stage benchmarks, and of the end-to-end benchmark (which runs a full inspect_ai eval)
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000]
+DEFAULT_END_TO_END_SIZE = 500
+
+# Distinct inputs generated for the per-sample benchmarks, cycled through for larger sizes to bound memory
+INPUT_POOL_SIZE = 10_000
+
+# Modules whose import time is measured, the entry points of a short CLI or test invocation
+IMPORT_MODULES = [
+    "inspect_agentic_mcq.evaluate",
+    "inspect_agentic_mcq.agents.bridge_agent",
+    "inspect_agentic_mcq.agents.paperqa_agent",
+    "inspect_agentic_mcq.agents.paperqa_gemini_embed_agent",
+    "inspect_agentic_mcq.sweep",
+    "inspect_agentic_mcq.log_dataset",
+]
+
+# Slowdown (fraction of the baseline samples/sec) flagged as a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def synthetic_dataset(n: int, n_distractors: int = 4, seed: int = 0) -> pd.DataFrame:
+    """Build a LitQA-shaped DataFrame of random questions.
+
+    Args:
+        n (int): Number of questions.
+        n_distractors (int, optional): Wrong choices per question. Defaults to 4.
+        seed (int, optional): Seed of the questions. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: 'id', 'question', 'ideal' and 'distractors' columns.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 100, size=(n, n_distractors + 1))
+    return pd.DataFrame(
+        {
+            "id": [f"q{i:07d}" for i in range(n)],
+            "question": [
+                f"Approximately what percentage of domains in cell line {i % 997} are reorganized in condition {i % 13}?"
+                for i in range(n)
+            ],
+            "ideal": [f"{v}%" for v in values[:, 0]],
+            "distractors": [[f"{v}%" for v in row] for row in values[:, 1:]],
+        }
+    )
+
+
+async def _stub_agent(prompt: str) -> dict:
+    """Custom agent that answers instantly, so only the harness is timed."""
+    letter = "ABCDE"[len(prompt) % 5]
+    return {
+        "answer": f"The source supports this option (bench2024 pages 1-2).\n\nANSWER: {letter}",
+        "cost": 0.0001,
+        "token_counts": {"stub": [len(prompt) // 4, 20]},
+    }
+
+
+def _bridge_inputs(n: int) -> list[dict]:
+    """Bridge agent inputs (as passed by inspect_ai's bridge) of up to INPUT_POOL_SIZE synthetic samples."""
+    samples = df_2_sample_bridge(synthetic_dataset(min(n, INPUT_POOL_SIZE)))
+    return [
+        {"messages": [{"role": "user", "content": sample.input}], "metadata": sample.metadata}
+        for sample in samples
+    ]
+
+
+def _bridge_outputs(n: int) -> list[tuple[str, Target]]:
+    """Bridge agent outputs and the targets of up to INPUT_POOL_SIZE synthetic samples."""
+    run = bridge_agent(custom_agent=_stub_agent)
+    inputs = _bridge_inputs(n)
+
+    async def outputs() -> list[str]:
+        return [(await run(sample))["output"] for sample in inputs]
+
+    completions = asyncio.run(outputs())
+    return [
+        (completion, Target(sample["metadata"]["target"]))
+        for completion, sample in zip(completions, inputs)
+    ]
+
+
+def bench_samples(n: int) -> float:
+    """Time df_2_sample_bridge, converting the DataFrame in chunks so the Samples of every size fit in memory."""
+    data = synthetic_dataset(n)
+    chunk_size = 100_000
+    elapsed = 0.0
+    for start in range(0, n, chunk_size):
+        chunk = data.iloc[start : start + chunk_size]
+        t0 = time.perf_counter()
+        df_2_sample_bridge(chunk)
+        elapsed += time.perf_counter() - t0
+    return elapsed
+
+
+def bench_bridge(n: int) -> float:
+    """Time the bridge agent around an instant custom agent: input parsing, output parsing and the JSON round-trips."""
+    run = bridge_agent(custom_agent=_stub_agent)
+    inputs = _bridge_inputs(n)
+
+    async def run_all() -> None:
+        for i in range(n):
+            await run(inputs[i % len(inputs)])
+
+    t0 = time.perf_counter()
+    asyncio.run(run_all())
+    return time.perf_counter() - t0
+
+
+def bench_scorer(n: int) -> float:
+    """Time paperqa_scorer on bridge agent outputs, without a checkpoint."""
+    score = paperqa_scorer()
+    outputs = _bridge_outputs(n)
+    states = [
+        SimpleNamespace(output=SimpleNamespace(completion=completion), sample_id=i, epoch=1)
+        for i, (completion, _) in enumerate(outputs)
+    ]
+
+    async def score_all() -> None:
+        for i in range(n):
+            j = i % len(outputs)
+            await score(states[j], outputs[j][1])
+
+    t0 = time.perf_counter()
+    asyncio.run(score_all())
+    return time.perf_counter() - t0
+
+
+def bench_metrics(n: int) -> float:
+    """Time score_summary (metrics and their confidence intervals) over n score values."""
+    rng = np.random.default_rng(0)
+    values = list(rng.choice([CORRECT, INCORRECT, NOANSWER], size=n, p=[0.6, 0.3, 0.1]))
+
+    t0 = time.perf_counter()
+    score_summary(values)
+    return time.perf_counter() - t0
+
+
+def bench_aggregation(n: int) -> float:
+    """Time the cost and token aggregation of MultipleChoiceEval.run over n sample results."""
+    records = [
+        {"cost": 0.0001 * (i % 7), "token_counts": {"gpt-4o-mini": [1000 + i % 100, 50], "embedding": [200, 0]}}
+        for i in range(n)
+    ]
+
+    t0 = time.perf_counter()
+    _usage_totals(records)
+    return time.perf_counter() - t0
+
+
+def bench_end_to_end(n: int) -> float:
+    """Time a full MultipleChoiceEval run with an instant custom agent, including inspect_ai's own overhead."""
+    evaluation = MultipleChoiceEval(synthetic_dataset(n), _stub_agent)
+
+    # Keep the benchmark logs out of the project's log directory, and use the mock model unless one is set
+    with tempfile.TemporaryDirectory() as log_dir:
+        previous = {name: os.environ.get(name) for name in ("INSPECT_LOG_DIR", "INSPECT_EVAL_MODEL")}
+        os.environ["INSPECT_LOG_DIR"] = log_dir
+        os.environ.setdefault("INSPECT_EVAL_MODEL", "mockllm/model")
+        try:
+            t0 = time.perf_counter()
+            evaluation.run(max_samples=64, time_limit=None, warm_up=False)
+            return time.perf_counter() - t0
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+
+def bench_import(module: str) -> float:
+    """Time importing a module in a fresh interpreter, so nothing is already loaded or cached in memory."""
+    code = f"import time; t0 = time.perf_counter(); import {module}; print(time.perf_counter() - t0)"
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+# Stage benchmarks, run at every size
+BENCHMARKS: dict[str, Callable[[int], float]] = {
+    "df_2_sample_bridge": bench_samples,
+    "bridge_agent": bench_bridge,
+    "paperqa_scorer": bench_scorer,
+    "score_summary": bench_metrics,
+    "usage_totals": bench_aggregation,
+}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    sizes: list[int] | None = None,
+    end_to_end_size: int | None = DEFAULT_END_TO_END_SIZE,
+    repeats: int = 3,
+    benchmarks: list[str] | None = None,
+    import_modules: list[str] | None = None,
+) -> dict:
+    """Run the benchmarks, keeping the fastest of the repeats of each.
+
+    Args:
+        sizes (list[int] | None, optional): Dataset sizes of the stage benchmarks. Defaults to None (DEFAULT_SIZES).
+        end_to_end_size (int | None, optional): Dataset size of the end-to-end benchmark, None to skip it. Defaults to DEFAULT_END_TO_END_SIZE.
+        repeats (int, optional): Runs of every benchmark, the fastest is kept. Defaults to 3.
+        benchmarks (list[str] | None, optional): Names of the stage benchmarks to run. Defaults to None (all of BENCHMARKS).
+        import_modules (list[str] | None, optional): Modules to time the import of, as benchmark "import:<module>" of size 1
+            (so samples/sec is imports/sec). Defaults to None (IMPORT_MODULES), an empty list skips them.
+
+    Returns:
+        dict: 'metadata' of the machine and commit, and the 'results' with the seconds and samples/sec of every benchmark and size.
+    """
+    sizes = sizes if sizes is not None else DEFAULT_SIZES
+    names = benchmarks if benchmarks is not None else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        raise ValueError(f"Unknown benchmarks {sorted(unknown)}, expected some of {list(BENCHMARKS)}")
+
+    import_modules = import_modules if import_modules is not None else IMPORT_MODULES
+
+    runs = [(name, BENCHMARKS[name], size) for name in names for size in sizes]
+    runs += [(f"import:{module}", lambda _, module=module: bench_import(module), 1) for module in import_modules]
+    if end_to_end_size:
+        # A full eval is slow enough that one run is representative
+        runs.append(("end_to_end", bench_end_to_end, end_to_end_size))
+
+    results = []
+    for name, bench, size in runs:
+        seconds = min(bench(size) for _ in range(1 if name == "end_to_end" else repeats))
+        results.append(
+            {
+                "benchmark": name,
+                "size": size,
+                "seconds": seconds,
+                "samples_per_sec": size / seconds if seconds > 0 else float("inf"),
+            }
+        )
+        print(f"{name:>20} n={size:<9} {seconds:9.4f}s {results[-1]['samples_per_sec']:14,.0f} samples/sec")
+
+    return {
+        "metadata": {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "repeats": repeats,
+        },
+        "results": results,
+    }
+
+
+def save_results(results: dict, path: str | Path) -> None:
+    """Write benchmark results as JSON.
+
+    Args:
+        results (dict): Results from run_benchmarks.
+        path (str | Path): JSON file to write.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path: str | Path) -> dict:
+    """Read benchmark results written by save_results.
+
+    Args:
+        path (str | Path): JSON file to read.
+
+    Returns:
+        dict: The results.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> pd.DataFrame:
+    """Compare the throughput of benchmark results against a baseline.
+
+    Args:
+        results (dict): Current results from run_benchmarks.
+        baseline (dict): Baseline results, e.g. from load_results.
+        tolerance (float, optional): Fraction of the baseline samples/sec that may be lost before a regression is flagged. Defaults to DEFAULT_TOLERANCE.
+
+    Returns:
+        pd.DataFrame: Samples/sec of every benchmark and size in both, their ratio, and whether it regressed.
+    """
+    current = pd.DataFrame(results["results"]).set_index(["benchmark", "size"])
+    reference = pd.DataFrame(baseline["results"]).set_index(["benchmark", "size"])
+
+    table = current[["samples_per_sec"]].join(
+        reference[["samples_per_sec"]].rename(columns={"samples_per_sec": "baseline_samples_per_sec"}),
+        how="inner",
+    )
+    table["ratio"] = table["samples_per_sec"] / table["baseline_samples_per_sec"]
+    table["regression"] = table["ratio"] < 1 - tolerance
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the harness hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--end-to-end-size", type=int, default=DEFAULT_END_TO_END_SIZE, help="0 to skip")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--benchmarks", nargs="+", default=None, choices=list(BENCHMARKS))
+    parser.add_argument("--imports", nargs="*", default=None, help="Modules to time the import of, none to skip")
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--baseline", default=None, help="Results to compare against")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sizes, args.end_to_end_size, args.repeats, args.benchmarks, args.imports)
+    save_results(results, args.output)
+    print(f"Saved results to {args.output}")
+
+    if args.baseline is not None:
+        table = compare(results, load_results(args.baseline), args.tolerance)
+        print(table.to_string())
+        if table["regression"].any():
+            print(f"Regressions: {table.index[table['regression']].tolist()}")
+            sys.exit(1)
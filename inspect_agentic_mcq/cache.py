@@ -0,0 +1,261 @@
+# Persistent caches to avoid paying for identical LLM calls across runs
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+from inspect_agentic_mcq.rate_limit import count_tokens
+
+
+def cache_key(*parts) -> str:
+    """Create a stable content hash from any json serialisable parts.
+
+    Args:
+        *parts: Values identifying the cached item, e.g. input text, schema and model.
+
+    Returns:
+        str: Hex sha256 digest of the canonical json dump of the parts.
+    """
+    dump = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(dump.encode("utf-8")).hexdigest()
+
+
+# Type of threading.Lock(), which is a factory function
+_LOCK_TYPE = type(threading.Lock())
+
+
+class SQLiteCache:
+    """Size-bounded, least recently used key-value cache stored in a SQLite file.
+
+    Safe to share between threads, and between processes through SQLite's own locking.
+    """
+
+    def __init__(self, path: str | Path, max_entries: int = 100_000) -> None:
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be at least 1, got {max_entries}")
+
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+
+        # Hit and miss counters for this process
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self) -> None:
+        """Open the SQLite file, creating the table if needed."""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)"
+        )
+        self._conn.commit()
+
+    def __getstate__(self) -> dict:
+        # Connections and locks cannot be pickled (e.g. to send the cache to a worker process), the copy reopens the file
+        return {
+            key: value
+            for key, value in self.__dict__.items()
+            if not isinstance(value, (sqlite3.Connection, _LOCK_TYPE))
+        }
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._connect()
+
+    def get(self, key: str) -> str | None:
+        """Get a cached value and mark it as recently used.
+
+        Args:
+            key (str): Cache key, see cache_key.
+
+        Returns:
+            str | None: Cached value, or None on a miss.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE cache SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        """Store a value, evicting the least recently used entries beyond max_entries.
+
+        Args:
+            key (str): Cache key, see cache_key.
+            value (str): Value to store.
+        """
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, last_access) VALUES (?, ?, ?)",
+                (key, value, time.time()),
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def clear(self) -> None:
+        """Remove every entry and reset the counters."""
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        """Get the cache usage for this process.
+
+        Returns:
+            dict: Hits, misses, hit rate and number of stored entries.
+        """
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+        }
+
+    def __len__(self) -> int:
+        return self.stats()["entries"]
+
+
+def merge_cache_usage(usages: list[dict]) -> dict:
+    """Add up the cache usage of several queries, e.g. the evidence cache usage of every sample in a run.
+
+    Args:
+        usages (list[dict]): Usage dictionaries with hits, misses, tokens_saved and cost_saved.
+
+    Returns:
+        dict: Total hits, misses, tokens and cost saved, and the overall hit rate.
+    """
+    total = {"hits": 0, "misses": 0, "tokens_saved": 0, "cost_saved": 0.0}
+    for usage in usages:
+        for key in total:
+            total[key] += usage.get(key, 0)
+    lookups = total["hits"] + total["misses"]
+    total["hit_rate"] = total["hits"] / lookups if lookups else 0.0
+    return total
+
+
+def settings_fingerprint(settings) -> str:
+    """Create a stable hash of a pydantic settings object, e.g. PaperQA Settings.
+
+    Args:
+        settings (BaseModel): Settings to fingerprint.
+
+    Returns:
+        str: Hex sha256 digest of the canonicalised settings dump.
+    """
+    return cache_key(settings.model_dump(mode="json"))
+
+
+class ResponseCache(SQLiteCache):
+    """Cache of custom agent responses (answer, cost and token counts) keyed by prompt and settings.
+
+    A replayed response costs nothing, so it is returned with a zero cost and no tokens. The original cost and tokens are
+    reported as saved in its 'response_cache' usage, like the evidence cache usage.
+
+    Modes:
+        read_through: Return cached responses, call the agent and store the response on a miss.
+        write_through: Always call the agent and store (or refresh) the response.
+        replay: Only return cached responses, a miss raises a KeyError instead of calling the agent.
+    """
+
+    MODES = ("read_through", "write_through", "replay")
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        mode: str = "read_through",
+        max_entries: int = 100_000,
+    ) -> None:
+        if mode not in self.MODES:
+            raise ValueError(f"Cache mode must be one of {self.MODES}, got {mode}")
+        if path is None:
+            path = DEFAULT_CACHE_DIR / "responses.sqlite"
+
+        super().__init__(path, max_entries=max_entries)
+        self.mode = mode
+
+    def lookup(self, prompt: str, settings) -> dict | None:
+        """Get a cached response according to the cache mode.
+
+        Args:
+            prompt (str): Prompt given to the agent.
+            settings (BaseModel): Settings used by the agent.
+
+        Raises:
+            KeyError: If in replay mode and the response is not cached.
+
+        Returns:
+            dict | None: Cached response with a zero cost and its 'response_cache' usage, or None if the agent should be called.
+        """
+        if self.mode == "write_through":
+            return None
+
+        cached = self.get(cache_key(prompt, settings_fingerprint(settings)))
+        if cached is not None:
+            response = json.loads(cached)
+            usage = {
+                "hits": 1,
+                "misses": 0,
+                "tokens_saved": count_tokens(response.get("token_counts") or {}),
+                "cost_saved": float(response.get("cost") or 0.0),
+            }
+            return {**response, "cost": 0.0, "token_counts": {}, "response_cache": usage}
+        if self.mode == "replay":
+            raise KeyError(f"No cached response for prompt in replay mode: {prompt[:80]!r}")
+        return None
+
+    def store(self, prompt: str, settings, response: dict) -> None:
+        """Store an agent response.
+
+        Args:
+            prompt (str): Prompt given to the agent.
+            settings (BaseModel): Settings used by the agent.
+            response (dict): Agent response with answer, cost and token_counts.
+        """
+        self.set(
+            cache_key(prompt, settings_fingerprint(settings)),
+            json.dumps(response, default=str),
+        )
+
+
+# Usage of a response that was not found in the ResponseCache
+RESPONSE_CACHE_MISS = {"hits": 0, "misses": 1, "tokens_saved": 0, "cost_saved": 0.0}
+
+
+# Default location of the caches, can be overridden with an environment variable
+DEFAULT_CACHE_DIR = Path(
+    os.getenv(
+        "INSPECT_AGENTIC_MCQ_CACHE_DIR",
+        Path.home() / ".cache" / "inspect_agentic_mcq",
+    )
+)
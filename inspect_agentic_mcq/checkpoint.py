@@ -0,0 +1,73 @@
+# Per-sample checkpoints so interrupted evaluations can be resumed
+
+import json
+import os
+from pathlib import Path
+import threading
+
+
+class Checkpoint:
+    """Append-only JSON lines file of per-sample results, written as each sample is scored."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def append(self, record: dict) -> None:
+        """Write the result of a sample, flushed to disk immediately.
+
+        Args:
+            record (dict): Sample result, must contain the sample 'id'.
+        """
+        line = json.dumps(record, default=str)
+        with self._lock, open(self.path, "a") as f:
+            f.write(line + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def load(self) -> dict[str, dict]:
+        """Load the latest result of every sample.
+
+        Returns:
+            dict[str, dict]: Sample id to its result. Later results of the same sample replace earlier ones.
+        """
+        if not self.path.exists():
+            return {}
+
+        records = {}
+        with open(self.path) as f:
+            for line in f:
+                # Skip a partially written last line
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                records[str(record["id"])] = record
+        return records
+
+    def completed(self) -> dict[str, dict]:
+        """Load the samples that have a valid result and do not need to be run again.
+
+        Returns:
+            dict[str, dict]: Sample id to its result.
+        """
+        return {i: r for i, r in self.load().items() if is_valid_result(r)}
+
+
+def is_valid_result(record: dict) -> bool:
+    """Check if a checkpointed result is a real answer rather than an error.
+
+    Args:
+        record (dict): Checkpointed sample result.
+
+    Returns:
+        bool: True if the sample does not need to be run again.
+    """
+    answer = str(record.get("answer", ""))
+    explanation = str(record.get("explanation", ""))
+    return (
+        record.get("value") is not None
+        and not answer.startswith("Error")
+        and not explanation.startswith("ERROR:")
+    )
@@ -0,0 +1,634 @@
+# Long-lived evaluation daemon: keeps imports, PaperQA indexes, clients and caches warm between runs, accepts eval jobs
+# over local HTTP and streams their results back as JSON lines
+
+from collections.abc import Callable, Iterator
+import asyncio
+import inspect
+import itertools
+import json
+import os
+from pathlib import Path
+import queue
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any
+
+from pandas import DataFrame
+
+from inspect_agentic_mcq.evaluate import MultipleChoiceEval
+from inspect_agentic_mcq.rate_limit import get_governor
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Agents that can be named in a job, any other agent is given as "module:function"
+DEFAULT_AGENTS = {
+    "paperqa": "inspect_agentic_mcq.agents.paperqa_agent:paperqa_agent",
+    "paperqa_gemini": "inspect_agentic_mcq.agents.paperqa_gemini_embed_agent:paperqa_gemini_agent",
+}
+
+# Keys of a job, and the arguments of MultipleChoiceEval.run it may set
+JOB_KEYS = {"data", "agent", "settings", "overrides", "kwargs", "template", "shuffle_seed", "limit", "run"}
+RUN_KEYS = {
+    "max_samples",
+    "time_limit",
+    "checkpoint",
+    "resume",
+    "epochs",
+    "min_epochs",
+    "trace",
+    "max_cost",
+    "max_tokens",
+}
+
+# Seconds between reads of a running job's checkpoint for newly scored samples
+POLL_INTERVAL = 0.1
+
+
+def _load_agent(spec: str) -> Callable:
+    """Import an agent given by name (see DEFAULT_AGENTS) or as "module:function"."""
+    import importlib
+
+    module, _, name = DEFAULT_AGENTS.get(spec, spec).partition(":")
+    if not name:
+        raise ValueError(f"Expected an agent in {list(DEFAULT_AGENTS)} or 'module:function', got {spec!r}")
+    return getattr(importlib.import_module(module), name)
+
+
+def _accepts(agent: Callable, parameter: str) -> bool:
+    """Check if an agent takes a keyword argument."""
+    return parameter in inspect.signature(agent).parameters
+
+
+class _Job:
+    """An eval job, and the events streamed back to the client that submitted it."""
+
+    def __init__(self, job_id: str, spec: dict, checkpoint: Path) -> None:
+        self.id = job_id
+        self.spec = spec
+        self.checkpoint = checkpoint
+        self.events: queue.Queue = queue.Queue()
+
+        # Bytes of the checkpoint written before the job started, e.g. by the run being resumed
+        self.offset = 0
+
+    def read_samples(self) -> list[dict]:
+        """Read the samples scored since the last call, only complete lines are consumed."""
+        if not self.checkpoint.exists():
+            return []
+        with open(self.checkpoint, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return [json.loads(line) for line in data[:end].splitlines() if line.strip()]
+
+
+class EvalDaemon:
+    """Local server that runs MultipleChoiceEval jobs in one long-lived process.
+
+    Everything that a fresh process pays for before its first question is kept between jobs: the imports of inspect_ai,
+    PaperQA and AG2, the default PaperQA Settings, each PaperQA index (built or validated once per index name), the pooled
+    formatting agents and HTTP clients, the response and evidence caches, the rate governor and the loaded datasets.
+
+    Jobs are JSON objects POSTed to /jobs:
+
+        {
+            "data": "data/LitQA_data/test-00000-of-00001.parquet",  # parquet file of questions (required)
+            "agent": "paperqa",                  # name in DEFAULT_AGENTS or "module:function", defaults to "paperqa"
+            "settings": "default",               # name of settings given to the daemon, defaults to the agent's default
+            "overrides": {"answer.evidence_k": 5},  # dotted overrides of the settings, see sweep.apply_overrides
+            "kwargs": {},                        # other JSON agent kwargs
+            "template": null,
+            "shuffle_seed": 0,
+            "limit": 10,                         # only the first questions
+            "run": {"max_samples": 4, "time_limit": 600}  # arguments of MultipleChoiceEval.run
+        }
+
+    and answered with JSON lines as the job progresses: "queued", "started", a "sample" for every scored sample, then
+    either "result" (the results of MultipleChoiceEval.run) or "error". Jobs run one at a time, in the order they were
+    submitted. The daemon imports and runs any agent it is given, so it only listens on localhost by default.
+    """
+
+    def __init__(
+        self,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        settings: dict[str, Any] | None = None,
+        cache=None,
+        evidence_cache=None,
+        preload: list[str] | None = None,
+        work_dir: str | Path | None = None,
+    ) -> None:
+        """
+        Args:
+            host (str, optional): Interface to listen on. Defaults to DEFAULT_HOST (localhost only).
+            port (int, optional): Port to listen on, 0 for any free port. Defaults to DEFAULT_PORT.
+            settings (dict[str, Any] | None, optional): Named agent settings that jobs can refer to, e.g. {"default": paperqa_settings}. Defaults to None.
+            cache (ResponseCache | None, optional): Response cache given to every agent that takes a 'cache'. Defaults to None.
+            evidence_cache (EvidenceSummaryCache | None, optional): Evidence summary cache given to every agent that takes an 'evidence_cache'. Defaults to None.
+            preload (list[str] | None, optional): Agents to import, with their default settings and index, before the first job. Defaults to None.
+            work_dir (str | Path | None, optional): Directory of the jobs' checkpoints. Defaults to None (a temporary directory).
+        """
+        self.settings = dict(settings or {})
+        self.cache = cache
+        self.evidence_cache = evidence_cache
+        self.preload = list(preload or [])
+        self.work_dir = Path(work_dir) if work_dir is not None else Path(tempfile.mkdtemp(prefix="inspect_agentic_mcq_daemon_"))
+
+        # Warm resources, reused by every job
+        self._agents: dict[str, Callable] = {}
+        self._default_settings: dict[str, Any] = {}
+        self._indexes: set[str] = set()
+        self._datasets: dict[tuple, DataFrame] = {}
+
+        self._jobs: queue.Queue = queue.Queue()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._counts = {"submitted": 0, "completed": 0, "failed": 0}
+        self._running: str | None = None
+        self._ready = threading.Event()
+        self._started_at = time.time()
+
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._server_thread: threading.Thread | None = None
+        self._worker: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the daemon, e.g. http://127.0.0.1:8765."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "EvalDaemon":
+        """Start serving and running jobs in background threads, the preloading happens before the first job."""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._work, daemon=True)
+            self._worker.start()
+            self._server_thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._server_thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop accepting jobs, wait for the queued jobs to finish and close the socket."""
+        if self._worker is not None:
+            self._server.shutdown()
+            self._server_thread.join()
+            self._jobs.put(None)
+            self._worker.join()
+            self._worker = None
+        self._server.server_close()
+
+    def __enter__(self) -> "EvalDaemon":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def wait_ready(self, timeout: float | None = None) -> bool:
+        """Wait until the preloading has finished.
+
+        Args:
+            timeout (float | None, optional): Seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            bool: True if the daemon is ready.
+        """
+        return self._ready.wait(timeout)
+
+    def status(self) -> dict:
+        """Get the state of the daemon.
+
+        Returns:
+            dict: Uptime, job counts, the running job, the warm agents, indexes and datasets, and the rate limits.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            running = self._running
+        return {
+            "ready": self._ready.is_set(),
+            "uptime": time.time() - self._started_at,
+            **counts,
+            "queued": self._jobs.qsize(),
+            "running": running,
+            "agents": sorted(self._agents),
+            "indexes": sorted(self._indexes),
+            "datasets": [str(key[0]) for key in self._datasets],
+            "rate_limits": get_governor().stats(),
+        }
+
+    def submit(self, spec: dict) -> _Job:
+        """Validate a job and queue it.
+
+        Args:
+            spec (dict): The job, see the class docstring.
+
+        Raises:
+            ValueError: If the job is invalid.
+
+        Returns:
+            _Job: The queued job, its events are streamed to the client.
+        """
+        if not isinstance(spec, dict):
+            raise ValueError("A job must be a JSON object")
+        unknown = set(spec) - JOB_KEYS
+        if unknown:
+            raise ValueError(f"Unknown job keys {sorted(unknown)}, expected some of {sorted(JOB_KEYS)}")
+        if "data" not in spec:
+            raise ValueError("A job requires the 'data' parquet path")
+        if not Path(spec["data"]).exists():
+            raise ValueError(f"Data file {spec['data']} does not exist")
+        unknown = set(spec.get("run") or {}) - RUN_KEYS
+        if unknown:
+            raise ValueError(f"Unknown run arguments {sorted(unknown)}, expected some of {sorted(RUN_KEYS)}")
+        if spec.get("settings") is not None and spec["settings"] not in self.settings:
+            raise ValueError(f"Unknown settings {spec['settings']!r}, expected one of {sorted(self.settings)}")
+
+        with self._lock:
+            job_id = f"job-{next(self._job_ids):04d}"
+            self._counts["submitted"] += 1
+        checkpoint = Path((spec.get("run") or {}).get("checkpoint") or self.work_dir / job_id / "checkpoint.jsonl")
+        job = _Job(job_id, spec, checkpoint)
+
+        job.events.put({"event": "queued", "job": job_id, "position": self._jobs.qsize() + (self._running is not None)})
+        self._jobs.put(job)
+        return job
+
+    def _work(self) -> None:
+        """Preload, then run the queued jobs one at a time."""
+        try:
+            self._preload()
+        except Exception as e:
+            # Jobs can still run, they warm up their own resources
+            print(f"Preloading failed, continuing without it: {type(e).__name__}: {e}")
+        finally:
+            self._ready.set()
+
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            with self._lock:
+                self._running = job.id
+            try:
+                job.events.put({"event": "result", "job": job.id, **self._run_job(job)})
+                outcome = "completed"
+            except Exception as e:
+                job.events.put({"event": "error", "job": job.id, "error": f"{type(e).__name__}: {e}"})
+                outcome = "failed"
+            with self._lock:
+                self._counts[outcome] += 1
+                self._running = None
+            # End of the job's stream
+            job.events.put(None)
+
+    def _preload(self) -> None:
+        """Import the eval machinery and the preloaded agents, and warm their default settings."""
+        start = time.perf_counter()
+
+        # inspect_ai, the bridge agent and the scorer, imported by every run
+        import inspect_ai  # noqa: F401
+
+        import inspect_agentic_mcq.agents.bridge_agent  # noqa: F401
+        import inspect_agentic_mcq.inspect_ai_custom.paperqa_scorer  # noqa: F401
+
+        # Formatting agents (and their OpenAI clients) are pooled for every sample, leasing one creates it
+        if os.getenv("OPENAI_API_KEY"):
+            from inspect_agentic_mcq.agents.structured_agent import (
+                StructuredInput,
+                StructuredOutput,
+                lease_structured_agent,
+            )
+
+            for structure in (StructuredInput, StructuredOutput):
+                with lease_structured_agent(structure):
+                    pass
+
+        for spec in self.preload:
+            self._agent_settings(spec, self._agent(spec), None, {})
+        for name, settings in self.settings.items():
+            self.settings[name] = self._warm_up(settings)
+
+        print(f"Daemon ready in {time.perf_counter() - start:.2f}s, listening on {self.url}")
+
+    def _agent(self, spec: str) -> Callable:
+        """Get an agent, importing it on first use."""
+        if spec not in self._agents:
+            self._agents[spec] = _load_agent(spec)
+        return self._agents[spec]
+
+    def _agent_settings(self, spec: str, agent: Callable, name: str | None, overrides: dict) -> Any:
+        """Get the settings of a job: the named settings or the agent's default, with the overrides applied."""
+        if name is not None:
+            settings = self.settings[name]
+        elif spec in self._default_settings:
+            settings = self._default_settings[spec]
+        else:
+            # The PaperQA agents build their default settings on first use
+            settings = getattr(sys.modules[agent.__module__], "paperqa_settings", None)
+            if settings is not None:
+                settings = self._warm_up(settings)
+            self._default_settings[spec] = settings
+
+        if overrides:
+            if settings is None:
+                raise ValueError(f"Agent {spec!r} has no settings to override")
+            from inspect_agentic_mcq.sweep import apply_overrides
+
+            settings = self._warm_up(apply_overrides(settings, overrides))
+        return settings
+
+    def _warm_up(self, settings: Any) -> Any:
+        """Build or validate the PaperQA index of some settings once, and point later settings at the same index."""
+        from inspect_agentic_mcq.agents.paperqa_index import (
+            is_paperqa_settings,
+            reuse_index,
+            warm_up_index,
+        )
+
+        if not is_paperqa_settings(settings):
+            return settings
+
+        index_name = settings.agent.index.name or settings.get_index_name()
+        if index_name in self._indexes:
+            return reuse_index(settings)
+        settings = asyncio.run(warm_up_index(settings))
+        self._indexes.add(index_name)
+        return settings
+
+    def _dataset(self, path: str | Path) -> DataFrame:
+        """Get the questions of a parquet file, read again only if the file has changed."""
+        path = Path(path).resolve()
+        stat = path.stat()
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        if key not in self._datasets:
+            import pandas as pd
+
+            # Forget older versions of the file
+            for old_key in [k for k in self._datasets if k[0] == path]:
+                del self._datasets[old_key]
+            self._datasets[key] = pd.read_parquet(path, columns=["question", "ideal", "distractors"])
+        return self._datasets[key]
+
+    def _run_job(self, job: _Job) -> dict:
+        """Run a job with the warm resources.
+
+        Args:
+            job (_Job): Job to run.
+
+        Returns:
+            dict: JSON results of MultipleChoiceEval.run, the per-sample results are streamed as they are scored instead.
+        """
+        start = time.perf_counter()
+        spec = job.spec
+        agent_spec = spec.get("agent") or "paperqa"
+        agent = self._agent(agent_spec)
+
+        kwargs = dict(spec.get("kwargs") or {})
+        if _accepts(agent, "settings") and "settings" not in kwargs:
+            settings = self._agent_settings(agent_spec, agent, spec.get("settings"), spec.get("overrides") or {})
+            if settings is not None:
+                kwargs["settings"] = settings
+        elif spec.get("settings") is not None or spec.get("overrides"):
+            raise ValueError(f"Agent {agent_spec!r} does not take settings")
+        if self.cache is not None and _accepts(agent, "cache"):
+            kwargs.setdefault("cache", self.cache)
+        if self.evidence_cache is not None and _accepts(agent, "evidence_cache"):
+            kwargs.setdefault("evidence_cache", self.evidence_cache)
+
+        data = self._dataset(spec["data"])
+        if spec.get("limit") is not None:
+            data = data.head(int(spec["limit"]))
+        evaluation = MultipleChoiceEval(
+            data,
+            agent,
+            template=spec.get("template"),
+            shuffle_seed=int(spec.get("shuffle_seed") or 0),
+            **kwargs,
+        )
+
+        run_kwargs = dict(spec.get("run") or {})
+        run_kwargs["checkpoint"] = job.checkpoint
+        job.offset = job.checkpoint.stat().st_size if job.checkpoint.exists() else 0
+        job.events.put(
+            {
+                "event": "started",
+                "job": job.id,
+                "samples": len(evaluation.dataset),
+                "setup_seconds": time.perf_counter() - start,
+            }
+        )
+
+        # The settings were warmed up above
+        result = evaluation.run(
+            max_samples=run_kwargs.pop("max_samples", None),
+            time_limit=run_kwargs.pop("time_limit", None),
+            warm_up=False,
+            **run_kwargs,
+        )
+
+        return {
+            "cost": result["cost"],
+            "token_counts": result["token_counts"],
+            "metrics": result["metrics"],
+            "evidence_cache": result["evidence_cache"],
+            "response_cache": result["response_cache"],
+            "epochs": result["epochs"],
+            "stages": result["stages"].to_dict(orient="index"),
+            "ledger": result["ledger"],
+            "logs": [log.location for log in result["eval_result"]],
+            "checkpoint": str(job.checkpoint),
+            "seconds": time.perf_counter() - start,
+        }
+
+
+def _handler(daemon: EvalDaemon) -> type[BaseHTTPRequestHandler]:
+    """Request handler class bound to an EvalDaemon."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args) -> None:
+            # The job results are printed by the evaluations
+            pass
+
+        def _send(self, status: int, body: dict) -> None:
+            payload = json.dumps(body, default=str).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _write_line(self, event: dict) -> None:
+            """Write an event as a JSON line in its own chunk, so the client sees it immediately."""
+            line = (json.dumps(event, default=str) + "\n").encode()
+            self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+            self.wfile.flush()
+
+        def _stream(self, job: _Job) -> None:
+            """Stream the events of a job, with its samples read from the checkpoint as they are scored."""
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            started = False
+            while True:
+                try:
+                    event = job.events.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    event = False
+
+                # Samples scored so far come before the job's next event, so the result is always last
+                if started:
+                    for record in job.read_samples():
+                        record.pop("timings", None)
+                        self._write_line({"event": "sample", "job": job.id, **record})
+                if event is None:
+                    break
+                if event:
+                    started = started or event["event"] == "started"
+                    self._write_line(event)
+
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def do_GET(self) -> None:
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/status":
+                self._send(200, daemon.status())
+            else:
+                self._send(404, {"error": f"Unknown path {self.path}"})
+
+        def do_POST(self) -> None:
+            path = self.path.split("?")[0].rstrip("/")
+            if path != "/jobs":
+                self._send(404, {"error": f"Unknown path {self.path}"})
+                return
+
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                job = daemon.submit(json.loads(self.rfile.read(length) or b"{}"))
+            except (json.JSONDecodeError, ValueError) as e:
+                self._send(400, {"error": str(e)})
+                return
+
+            try:
+                self._stream(job)
+            except (BrokenPipeError, ConnectionResetError):
+                # The job keeps running, its results are still saved to the checkpoint
+                pass
+
+    return Handler
+
+
+def submit_job(job: dict, url: str = f"http://{DEFAULT_HOST}:{DEFAULT_PORT}") -> Iterator[dict]:
+    """Submit a job to a running daemon and yield its events as they arrive.
+
+    Args:
+        job (dict): The job, see EvalDaemon.
+        url (str, optional): Base URL of the daemon. Defaults to the default host and port.
+
+    Raises:
+        ValueError: If the daemon rejects the job.
+
+    Yields:
+        dict: Events "queued", "started", "sample" (one per scored sample), then "result" or "error".
+    """
+    import urllib.error
+    import urllib.request
+
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/jobs",
+        data=json.dumps(job).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        response = urllib.request.urlopen(request)
+    except urllib.error.HTTPError as e:
+        raise ValueError(json.loads(e.read() or b"{}").get("error", str(e))) from e
+
+    with response:
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run evaluations in a long-lived process that keeps its resources warm")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Start the daemon")
+    serve_parser.add_argument("--host", default=DEFAULT_HOST)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--preload", nargs="*", default=["paperqa"], help="Agents to warm up before the first job")
+    serve_parser.add_argument("--cache", action="store_true", help="Share a response cache between jobs")
+    serve_parser.add_argument("--evidence-cache", action="store_true", help="Share an evidence summary cache between jobs")
+    serve_parser.add_argument("--work-dir", default=None)
+
+    submit_parser = subparsers.add_parser("submit", help="Submit a job and print its results")
+    submit_parser.add_argument("data", help="Parquet file of questions")
+    submit_parser.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}")
+    submit_parser.add_argument("--agent", default="paperqa")
+    submit_parser.add_argument("--override", action="append", default=[], help="Settings override, e.g. answer.evidence_k=5")
+    submit_parser.add_argument("--limit", type=int, default=None)
+    submit_parser.add_argument("--max-samples", type=int, default=None)
+    submit_parser.add_argument("--time-limit", type=float, default=None)
+    submit_parser.add_argument("--epochs", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        cache = evidence_cache = None
+        if args.cache:
+            from inspect_agentic_mcq.cache import ResponseCache
+
+            cache = ResponseCache()
+        if args.evidence_cache:
+            from inspect_agentic_mcq.agents.paperqa_evidence_cache import EvidenceSummaryCache
+
+            evidence_cache = EvidenceSummaryCache()
+
+        daemon = EvalDaemon(
+            args.host,
+            args.port,
+            cache=cache,
+            evidence_cache=evidence_cache,
+            preload=args.preload,
+            work_dir=args.work_dir,
+        ).start()
+        try:
+            daemon._worker.join()
+        except KeyboardInterrupt:
+            daemon.stop()
+    else:
+        # Override values are parsed as JSON where possible, e.g. numbers and booleans
+        overrides = {}
+        for override in args.override:
+            path, _, value = override.partition("=")
+            try:
+                overrides[path] = json.loads(value)
+            except json.JSONDecodeError:
+                overrides[path] = value
+
+        job = {
+            "data": str(Path(args.data).resolve()),
+            "agent": args.agent,
+            "overrides": overrides,
+            "limit": args.limit,
+            "run": {"max_samples": args.max_samples, "time_limit": args.time_limit, "epochs": args.epochs},
+        }
+        for event in submit_job(job, args.url):
+            if event["event"] == "sample":
+                print(f"{event['id'][:12]} {event['value']} {event['answer']}")
+            else:
+                print(json.dumps(event, default=str))
@@ -0,0 +1,202 @@
+# Persistent store of chunk embeddings shared across embedding models, runs and processes
+
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+import re
+import sqlite3
+import threading
+
+import numpy as np
+
+from inspect_agentic_mcq.cache import DEFAULT_CACHE_DIR
+
+
+def chunk_hash(text: str) -> str:
+    """Hash the contents of a text chunk.
+
+    Args:
+        text (str): Chunk text.
+
+    Returns:
+        str: Hex sha256 digest of the text.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingStore:
+    """Embeddings keyed by (chunk hash, embedding model), stored as memory-mapped float32 arrays.
+
+    Every embedding model has its own directory with an append-only 'vectors.f32' file and a small SQLite sidecar index mapping
+    chunk hashes to rows. Vectors are only appended under a file lock and indexed after they are written, so any number of
+    processes can read concurrently while another process is writing.
+    """
+
+    def __init__(self, root: str | Path | None = None) -> None:
+        if root is None:
+            root = DEFAULT_CACHE_DIR / "embeddings"
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        # Re-entrant, as put checks for stored chunks with get_hashes
+        self._lock = threading.RLock()
+        self._indexes: dict[str, sqlite3.Connection] = {}
+        self._memmaps: dict[str, np.memmap] = {}
+
+    def _model_directory(self, model: str) -> Path:
+        # Model names such as "gemini/text-embedding-004" are not valid directory names
+        directory = self.root / re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    def _index(self, model: str) -> sqlite3.Connection:
+        if model not in self._indexes:
+            conn = sqlite3.connect(
+                self._model_directory(model) / "index.sqlite",
+                check_same_thread=False,
+                timeout=30.0,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (hash TEXT PRIMARY KEY, row INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+            conn.commit()
+            self._indexes[model] = conn
+        return self._indexes[model]
+
+    def _dimension(self, model: str) -> int | None:
+        row = self._index(model).execute(
+            "SELECT value FROM meta WHERE key = 'dimension'"
+        ).fetchone()
+        return None if row is None else int(row[0])
+
+    def _vectors(self, model: str, min_rows: int) -> np.memmap:
+        """Get a read-only memory map of the vectors, re-mapping if other processes have appended rows."""
+        memmap = self._memmaps.get(model)
+        if memmap is None or memmap.shape[0] < min_rows:
+            dimension = self._dimension(model)
+            path = self._model_directory(model) / "vectors.f32"
+            rows = path.stat().st_size // (4 * dimension)
+            memmap = np.memmap(path, dtype=np.float32, mode="r", shape=(rows, dimension))
+            self._memmaps[model] = memmap
+        return memmap
+
+    def get(self, model: str, hashes: list[str]) -> dict[str, np.ndarray]:
+        """Get the stored embeddings of chunks.
+
+        Args:
+            model (str): Embedding model name, e.g. "text-embedding-3-small".
+            hashes (list[str]): Chunk hashes, see chunk_hash.
+
+        Returns:
+            dict[str, np.ndarray]: Chunk hash to embedding, as views into the memory map (no copy). Missing chunks are left out.
+        """
+        if not hashes:
+            return {}
+
+        with self._lock:
+            index = self._index(model)
+            rows = {}
+            # Stay under SQLite's limit on query parameters
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows.update(
+                    index.execute(
+                        f"SELECT hash, row FROM embeddings WHERE hash IN ({placeholders})",
+                        batch,
+                    ).fetchall()
+                )
+            if not rows:
+                return {}
+
+            vectors = self._vectors(model, max(rows.values()) + 1)
+            return {h: vectors[row] for h, row in rows.items()}
+
+    def put(self, model: str, hashes: list[str], embeddings: list[list[float]] | np.ndarray) -> None:
+        """Store the embeddings of chunks, skipping chunks that are already stored.
+
+        Args:
+            model (str): Embedding model name.
+            hashes (list[str]): Chunk hashes, see chunk_hash.
+            embeddings (list[list[float]] | np.ndarray): Embeddings in the same order as the hashes.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or embeddings.shape[0] != len(hashes):
+            raise ValueError(
+                f"Expected {len(hashes)} embeddings, got array of shape {embeddings.shape}"
+            )
+        if not hashes:
+            return
+
+        directory = self._model_directory(model)
+        with self._lock, open(directory / "vectors.lock", "w") as lock_file:
+            # Only one process appends at a time
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                index = self._index(model)
+
+                dimension = self._dimension(model)
+                if dimension is None:
+                    dimension = embeddings.shape[1]
+                    index.execute(
+                        "INSERT INTO meta (key, value) VALUES ('dimension', ?)", (dimension,)
+                    )
+                elif dimension != embeddings.shape[1]:
+                    raise ValueError(
+                        f"Embedding dimension {embeddings.shape[1]} does not match stored dimension {dimension} for {model}"
+                    )
+
+                # Skip chunks stored by another process in the meantime, and duplicates
+                seen = set(self.get_hashes(model, hashes))
+                new = []
+                for i, h in enumerate(hashes):
+                    if h not in seen:
+                        seen.add(h)
+                        new.append(i)
+                if not new:
+                    index.commit()
+                    return
+
+                # Write the vectors before indexing them, so readers never see unwritten rows
+                path = directory / "vectors.f32"
+                row_bytes = 4 * dimension
+                with open(path, "ab") as f:
+                    # Drop any partial row left by an interrupted write, it was never indexed
+                    start_row = os.path.getsize(path) // row_bytes
+                    f.truncate(start_row * row_bytes)
+                    f.write(embeddings[new].tobytes())
+
+                index.executemany(
+                    "INSERT INTO embeddings (hash, row) VALUES (?, ?)",
+                    [(hashes[i], start_row + n) for n, i in enumerate(new)],
+                )
+                index.commit()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_hashes(self, model: str, hashes: list[str]) -> list[str]:
+        """Get which of the chunk hashes are already stored.
+
+        Args:
+            model (str): Embedding model name.
+            hashes (list[str]): Chunk hashes, see chunk_hash.
+
+        Returns:
+            list[str]: The stored chunk hashes.
+        """
+        stored = []
+        with self._lock:
+            index = self._index(model)
+            for i in range(0, len(hashes), 500):
+                batch = hashes[i : i + 500]
+                placeholders = ",".join("?" * len(batch))
+                stored.extend(
+                    h
+                    for (h,) in index.execute(
+                        f"SELECT hash FROM embeddings WHERE hash IN ({placeholders})", batch
+                    )
+                )
+        return stored
@@ -1,39 +1,136 @@
 # Class to evaluate the performance of agent systems on multiple choice question answering
 
+import asyncio
+from collections import Counter
 from collections.abc import Callable
 import inspect
+from pathlib import Path
+import statistics
+import sys
+import threading
+from typing import TYPE_CHECKING
 
 from pandas import DataFrame
 
-from inspect_ai import Epochs, Task, task, eval
-from inspect_ai.agent import bridge
+from inspect_agentic_mcq.cache import merge_cache_usage
+from inspect_agentic_mcq.checkpoint import Checkpoint
+from inspect_agentic_mcq.inspect_ai_custom.score_stats import score_summary
+from inspect_agentic_mcq.ledger import CostLedger
+from inspect_agentic_mcq.rate_limit import get_governor
+from inspect_agentic_mcq.timing import export_trace, stage_summary
 
-from inspect_agentic_mcq.agents.bridge_agent import bridge_agent
-from inspect_agentic_mcq.inspect_ai_custom.sample import df_2_sample_bridge
+# inspect_ai's eval, the scorer and the agents are imported when first used, so importing this module stays fast
+if TYPE_CHECKING:
+    from inspect_ai import Task
 
-from inspect_agentic_mcq.inspect_ai_custom.paperqa_scorer import paperqa_scorer
+    from inspect_agentic_mcq.inspect_ai_custom.parquet_dataset import ParquetDataset
+
+
+def _is_parquet_dataset(data) -> bool:
+    """Check if data is a ParquetDataset, without importing pyarrow (the module of any instance is already imported)."""
+    module = sys.modules.get("inspect_agentic_mcq.inspect_ai_custom.parquet_dataset")
+    return module is not None and isinstance(data, module.ParquetDataset)
+
+
+def _agent_default_settings(agent: Callable):
+    """Get the default 'paperqa_settings' of an agent's module.
+
+    Args:
+        agent (Callable): Custom agent.
+
+    Returns:
+        Settings | None: The default settings, None if the agent takes no settings or its module has none.
+    """
+    if "settings" not in inspect.signature(agent).parameters:
+        return None
+    # The PaperQA agents build their default settings on first use
+    return getattr(sys.modules.get(agent.__module__), "paperqa_settings", None)
+
+
+def _run_coroutine(coroutine):
+    """Run a coroutine to completion from synchronous code, even when called from inside a running event loop.
+
+    Args:
+        coroutine: Coroutine to run.
+
+    Returns:
+        The result of the coroutine.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    # The running loop is blocked by the caller, so run the coroutine on a new loop in a helper thread
+    result = {}
+
+    def target() -> None:
+        try:
+            result["value"] = asyncio.run(coroutine)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+# With a budget, samples are run in evals of this many times the concurrency, and no eval is started once it is spent
+BUDGET_BATCH_FACTOR = 4
+
+# inspect_ai's default concurrency (its default max_connections)
+DEFAULT_MAX_SAMPLES = 10
 
 
 class MultipleChoiceEval:
     """Class for evaluating MCQ performance for inspect_ai using custom agents."""
 
     def __init__(
-        self, data: DataFrame, agent: Callable, template: str | None = None, **kwargs
+        self,
+        data: "DataFrame | str | Path | ParquetDataset",
+        agent: Callable,
+        template: str | None = None,
+        shuffle_seed: int = 0,
+        **kwargs,
     ) -> None:
+        """
+        Args:
+            data (DataFrame | str | Path | ParquetDataset): Questions with 'question', 'ideal' and 'distractors' columns. A
+                parquet path or ParquetDataset is read lazily, in batches, instead of being loaded up front.
+            agent (Callable): Custom agent, e.g. async def custom_agent(prompt: str, **kwargs) -> dict.
+            template (str | None, optional): Template for the prompt into the custom agent. Defaults to None.
+            shuffle_seed (int, optional): Seed of the choice orders, identical seeds give identical prompts. Defaults to 0.
+            **kwargs: Any kwargs needed for the custom agent.
+        """
+        req_cols = ["question", "ideal", "distractors"]
 
-        # Process the data into inspect_ai Dataset type
-        if not isinstance(data, DataFrame):
-            raise TypeError("Input data is not a pandas DataFrame")
+        # Stream parquet files, only reading the required columns (pyarrow is only imported for them)
+        if isinstance(data, (str, Path)):
+            from inspect_agentic_mcq.inspect_ai_custom.parquet_dataset import ParquetDataset
 
-        # Check that the DataFrame has the correct columns
-        req_cols = ["question", "ideal", "distractors"]
-        self._check_required_columns(data, req_cols)
+            data = ParquetDataset(data, columns=req_cols, seed=shuffle_seed)
+
+        # Process the data into inspect_ai Dataset type
+        if isinstance(data, DataFrame):
+            # Check that the DataFrame has the correct columns
+            self._check_required_columns(data, req_cols)
+        elif _is_parquet_dataset(data):
+            missing_cols = [col for col in req_cols if col not in data.column_names]
+            if missing_cols:
+                raise ValueError(f"Parquet data is missing required columns: {missing_cols}")
+        else:
+            raise TypeError("Input data is not a pandas DataFrame, parquet path or ParquetDataset")
 
         # Check that the agent is valid
         self._validate_custom_agent(agent)
 
-        # Set up the dataset
-        self.dataset = df_2_sample_bridge(data)
+        # Set up the dataset, the data is kept to reshuffle the choices for later epochs
+        self.data = data
+        self.shuffle_seed = shuffle_seed
+        self.dataset = self._samples(data)
 
         self.agent = agent
         self.template = template
@@ -43,69 +140,364 @@ class MultipleChoiceEval:
         self.cost = 0.0
         self.token_counts = {}
 
+        # Live cost ledger of the current run
+        self.ledger = CostLedger()
+
+        # Whether any shared resources (e.g. PaperQA index) have been prepared
+        self._warmed_up = False
+
+    def warm_up(self) -> None:
+        """Prepare shared resources once before the first sample, e.g. build or validate the PaperQA index.
+
+        Without a 'settings' kwarg, the default 'paperqa_settings' of the agent's module are warmed up (if the agent takes
+        settings). The prepared settings replace the 'settings' kwarg so every sample reuses the same index.
+        """
+        if self._warmed_up:
+            return
+
+        settings = self.kwargs.get("settings")
+        if settings is None:
+            settings = _agent_default_settings(self.agent)
+
+        if settings is not None:
+            from inspect_agentic_mcq.agents.paperqa_index import (
+                is_paperqa_settings,
+                warm_up_index,
+            )
+
+            if is_paperqa_settings(settings):
+                self.kwargs["settings"] = _run_coroutine(warm_up_index(settings))
+
+        self._warmed_up = True
+
     def run(
         self,
         max_samples: int | None,
         time_limit: float | None,
+        warm_up: bool = True,
+        checkpoint: str | Path | None = None,
+        resume: bool = False,
+        epochs: int = 1,
+        min_epochs: int = 2,
+        trace: str | Path | None = None,
+        max_cost: float | None = None,
+        max_tokens: int | None = None,
     ):
         """Run the inspect_ai benchmarking.
 
+        With several epochs, the choices are reshuffled every epoch and a sample stops being re-run once its answers (compared
+        by choice text, not letter) agree over min_epochs epochs. Only samples whose answers disagree use the remaining epochs.
+        Each sample is scored by the mode of its epochs.
+
+        Args:
+            max_samples (int | None): Maximum number of samples to run concurrently.
+            time_limit (float | None): Time limit per sample in seconds.
+            warm_up (bool, optional): Prepare shared resources (e.g. the PaperQA index) before the first sample. Defaults to True.
+            checkpoint (str | Path | None, optional): File that each sample's result is saved to as it completes. Defaults to None.
+            resume (bool, optional): Skip samples that already have a valid result in the checkpoint, and include them in the final report. Defaults to False.
+            epochs (int, optional): Maximum number of epochs per sample. Defaults to 1.
+            min_epochs (int, optional): Number of agreeing epochs after which a sample is stable. Defaults to 2.
+            trace (str | Path | None, optional): File to export the per-stage spans of every sample to, in Chrome trace format. Defaults to None.
+            max_cost (float | None, optional): Budget in dollars, no new samples are started once it is spent and the completed samples are reported. Defaults to None.
+            max_tokens (int | None, optional): Budget in tokens, as for max_cost. Defaults to None.
+
         Returns:
-            dict: Dictionary containing evaluation results, total cost, and token usage.
+            dict: Dictionary containing evaluation results, metrics, total cost, token usage, the ledger totals and the per-sample results.
         """
-        # Create the custom task
-        @task
-        def custom_agent_task():
-            return Task(
-                dataset=self.dataset,
-                solver=bridge(
-                    bridge_agent(
-                        custom_agent=self.agent, template=self.template, **self.kwargs
-                    )
-                ),
-                scorer=paperqa_scorer(),
-                epochs=Epochs(1, "mode"),
+        if resume and checkpoint is None:
+            raise ValueError("A checkpoint file is required to resume an evaluation")
+        if epochs < 1 or (epochs > 1 and not 1 <= min_epochs <= epochs):
+            raise ValueError(
+                f"Expected 1 <= min_epochs <= epochs, got {min_epochs} and {epochs}"
             )
+        if resume and epochs > 1:
+            raise ValueError("Resuming is only supported for single epoch runs")
+
+        from inspect_ai.dataset import MemoryDataset
+
+        # Skip the samples that were completed by a previous run
+        dataset = self.dataset
+        completed = {}
+        if resume:
+            sample_ids = {str(sample.id) for sample in self.dataset}
+            completed = {
+                i: r for i, r in Checkpoint(checkpoint).completed().items() if i in sample_ids
+            }
+            dataset = MemoryDataset(
+                [sample for sample in self.dataset if str(sample.id) not in completed]
+            )
+            print(
+                f"Resuming from checkpoint: {len(completed)} samples completed, {len(dataset)} remaining"
+            )
+
+        if warm_up and len(dataset) > 0:
+            self.warm_up()
+
+        # Track the spending of this run as samples complete
+        self.ledger = CostLedger(max_cost=max_cost, max_tokens=max_tokens)
+
+        epoch_summary = None
+        if epochs > 1:
+            eval_result, history = self._run_epochs(
+                max_samples, time_limit, epochs, min_epochs, checkpoint
+            )
+            attempts = [record for records in history.values() for record in records]
+            values = {
+                i: _mode([r["value"] for r in records]) for i, records in history.items() if records
+            }
+            epoch_summary = self._epoch_summary(history, epochs)
+        else:
+            # Run eval and collect outputs for cost/token usage
+            eval_result = []
+            if len(dataset) > 0:
+                eval_result = self._eval(dataset, max_samples, time_limit, checkpoint)
+
+            # Merge the results of this run with the ones from the checkpoint, leaving out samples skipped by the budget
+            new_records = self._sample_records(eval_result)
+            records = {
+                **completed,
+                **{i: r for i, r in new_records.items() if not r.get("skipped")},
+            }
+            attempts = list(records.values())
+            values = {i: record["value"] for i, record in records.items()}
+
+        result = _summarise_run(
+            attempts,
+            values,
+            eval_result,
+            ledger=self.ledger.snapshot(),
+            from_checkpoint=len(completed),
+            epoch_summary=epoch_summary,
+            trace=trace,
+        )
 
-        # Run eval and collect outputs for cost/token usage
-        eval_result = eval(tasks=custom_agent_task(), time_limit=time_limit, max_samples=max_samples)
-        
-        # Initialize tracking variables
-        total_cost = 0.0
-        total_token_counts = {}
-        
-        # Process results if eval_result is iterable
-        if hasattr(eval_result, '__iter__'):
-            for r in eval_result:
-                # Get cost and token counts from the eval log
-                if hasattr(r, 'eval') and hasattr(r.eval, 'cost'):
-                    total_cost += float(r.eval.cost)
-                
-                if hasattr(r, 'eval') and hasattr(r.eval, 'token_counts'):
-                    for model, counts in r.eval.token_counts.items():
-                        if model not in total_token_counts:
-                            total_token_counts[model] = [0, 0]  # [prompt_tokens, completion_tokens]
-                        if isinstance(counts, (list, tuple)) and len(counts) >= 2:
-                            total_token_counts[model][0] += int(counts[0])
-                            total_token_counts[model][1] += int(counts[1])
-        
         # Update instance variables
-        self.cost = total_cost
-        self.token_counts = total_token_counts
-        
-        # Print summary
-        print("\n--- Evaluation Cost Summary ---")
-        print(f"Total cost: ${total_cost:.6f}")
-        print(f"Total token usage: {total_token_counts}")
-        print("------------------------------\n")
-        
-        # Return results
+        self.cost = result["cost"]
+        self.token_counts = result["token_counts"]
+
+        return result
+
+    def _run_epochs(
+        self,
+        max_samples: int | None,
+        time_limit: float | None,
+        epochs: int,
+        min_epochs: int,
+        checkpoint: str | Path | None = None,
+    ) -> tuple[list, dict[str, list[dict]]]:
+        """Run epochs with reshuffled choices until every sample is stable or the epochs run out.
+
+        Args:
+            max_samples (int | None): Maximum number of samples to run concurrently.
+            time_limit (float | None): Time limit per sample in seconds.
+            epochs (int): Maximum number of epochs per sample.
+            min_epochs (int): Number of agreeing epochs after which a sample is stable.
+            checkpoint (str | Path | None, optional): File that each sample's result is saved to. Defaults to None.
+
+        Returns:
+            tuple[list, dict[str, list[dict]]]: The eval logs of every epoch, and the results of every epoch of every sample.
+        """
+        from inspect_ai.dataset import MemoryDataset
+
+        history = {str(sample.id): [] for sample in self.dataset}
+        pending = set(history)
+        eval_result = []
+
+        for epoch in range(1, epochs + 1):
+            if not pending or self.ledger.exhausted:
+                break
+
+            # Reshuffle the choices so that answers are not tied to a letter
+            dataset = self.dataset if epoch == 1 else self._samples(self.data, epoch=epoch)
+            dataset = MemoryDataset([sample for sample in dataset if str(sample.id) in pending])
+            choices = {str(sample.id): sample.choices for sample in dataset}
+
+            logs = self._eval(dataset, max_samples, time_limit, checkpoint)
+            eval_result.extend(logs)
+
+            for i, record in self._sample_records(logs).items():
+                if record["skipped"]:
+                    continue
+                record["epoch"] = epoch
+                record["choice"] = _answer_choice(record["answer"], choices[i])
+                history[i].append(record)
+
+            # Stop re-running samples whose answers agree
+            pending = {
+                i
+                for i in pending
+                if len(history[i]) < min_epochs or len({r["choice"] for r in history[i]}) > 1
+            }
+            print(f"Epoch {epoch}: {len(dataset)} samples run, {len(pending)} not yet stable")
+
+        return eval_result, history
+
+    @staticmethod
+    def _epoch_summary(history: dict[str, list[dict]], epochs: int) -> dict:
+        """Estimate the spread of the metrics over epochs.
+
+        Samples that stopped early agreed on every epoch they ran, so their result is carried over to the epochs they skipped.
+
+        Args:
+            history (dict[str, list[dict]]): Results of every epoch of every sample, see _run_epochs.
+            epochs (int): Maximum number of epochs per sample.
+
+        Returns:
+            dict: Metrics of every epoch, mean and std of the accuracy, and the number of calls made and saved.
+        """
+        epoch_metrics = []
+        for epoch in range(epochs):
+            # In id order, so the intervals do not depend on the order of the samples
+            values = [
+                history[i][min(epoch, len(history[i]) - 1)]["value"]
+                for i in sorted(history)
+                if history[i]
+            ]
+            epoch_metrics.append(score_summary(values))
+
+        accuracies = [m["paperqa_accuracy"] for m in epoch_metrics]
+        calls = sum(len(records) for records in history.values())
         return {
-            "cost": total_cost,
-            "token_counts": total_token_counts,
-            "eval_result": eval_result
+            "epoch_metrics": epoch_metrics,
+            "accuracy_mean": statistics.fmean(accuracies),
+            "accuracy_std": statistics.stdev(accuracies) if len(accuracies) > 1 else 0.0,
+            "calls": calls,
+            "calls_saved": epochs * len(history) - calls,
+            "unstable": sum(
+                1 for records in history.values() if len({r["choice"] for r in records}) > 1
+            ),
         }
 
+    def _samples(self, data: "DataFrame | ParquetDataset", epoch: int = 1):
+        """Get the inspect_ai Dataset of the data, with the choices ordered for an epoch.
+
+        Args:
+            data (DataFrame | ParquetDataset): Question data.
+            epoch (int, optional): Epoch, every epoch has its own choice order. Defaults to 1.
+
+        Returns:
+            Dataset: MemoryDataset for a DataFrame, a lazy ParquetDataset otherwise.
+        """
+        from inspect_agentic_mcq.inspect_ai_custom.sample import df_2_sample_bridge
+
+        if isinstance(data, DataFrame):
+            return df_2_sample_bridge(data, seed=self.shuffle_seed, epoch=epoch)
+        return data.with_choice_order(self.shuffle_seed, epoch)
+
+    def _eval(
+        self,
+        dataset,
+        max_samples: int | None,
+        time_limit: float | None,
+        checkpoint: str | Path | None = None,
+    ) -> list:
+        """Run the custom agent on a dataset with inspect_ai eval.
+
+        Without a budget the whole dataset is a single eval. With a budget the samples are run in batches of
+        BUDGET_BATCH_FACTOR times the concurrency, and once the ledger is exhausted the remaining batches are not
+        scheduled but counted as skipped.
+
+        Args:
+            dataset: inspect_ai Dataset to evaluate.
+            max_samples (int | None): Maximum number of samples to run concurrently.
+            time_limit (float | None): Time limit per sample in seconds.
+            checkpoint (str | Path | None, optional): File that each sample's result is saved to. Defaults to None.
+
+        Returns:
+            list: The eval logs of every batch.
+        """
+        from inspect_ai import eval, task
+
+        if self.ledger.max_cost is None and self.ledger.max_tokens is None:
+            batches = [dataset]
+        else:
+            size = BUDGET_BATCH_FACTOR * (max_samples or DEFAULT_MAX_SAMPLES)
+            batches = [dataset[i : i + size] for i in range(0, len(dataset), size)]
+
+        logs = []
+        for n, batch in enumerate(batches):
+            if self.ledger.exhausted:
+                self.ledger.skip(sum(len(b) for b in batches[n:]))
+                break
+
+            @task
+            def custom_agent_task():
+                return self._task(batch, self.kwargs, checkpoint=checkpoint, ledger=self.ledger)
+
+            logs.extend(eval(tasks=custom_agent_task(), time_limit=time_limit, max_samples=max_samples))
+        return logs
+
+    def _task(
+        self,
+        dataset,
+        kwargs: dict,
+        checkpoint: str | Path | None = None,
+        name: str | None = None,
+        ledger: CostLedger | None = None,
+    ) -> "Task":
+        """Create the inspect_ai Task wrapping the custom agent.
+
+        Args:
+            dataset: inspect_ai Dataset to evaluate.
+            kwargs (dict): Kwargs for the custom agent, e.g. settings.
+            checkpoint (str | Path | None, optional): File that each sample's result is saved to. Defaults to None.
+            name (str | None, optional): Task name, shown in the logs. Defaults to None.
+            ledger (CostLedger | None, optional): Live cost ledger, samples are skipped once its budget is reached. Defaults to None.
+
+        Returns:
+            Task: The inspect_ai Task.
+        """
+        from inspect_ai import Epochs, Task
+        from inspect_ai.agent import bridge
+
+        from inspect_agentic_mcq.agents.bridge_agent import bridge_agent
+        from inspect_agentic_mcq.inspect_ai_custom.paperqa_scorer import paperqa_scorer
+
+        return Task(
+            dataset=dataset,
+            solver=bridge(
+                bridge_agent(
+                    custom_agent=self.agent, template=self.template, ledger=ledger, **kwargs
+                )
+            ),
+            scorer=paperqa_scorer(
+                checkpoint=str(checkpoint) if checkpoint is not None else None
+            ),
+            epochs=Epochs(1, "mode"),
+            name=name,
+        )
+
+    def _sample_records(self, eval_result) -> dict[str, dict]:
+        """Flatten the scored samples of inspect_ai eval logs into per-sample results.
+
+        Args:
+            eval_result: EvalLogs returned by inspect_ai eval.
+
+        Returns:
+            dict[str, dict]: Sample id to its score value, answer, cost and token counts.
+        """
+        records = {}
+        for log in eval_result:
+            for sample in log.samples or []:
+                score = (sample.scores or {}).get("paperqa_scorer")
+                if score is None:
+                    continue
+                metadata = score.metadata or {}
+                records[str(sample.id)] = {
+                    "id": str(sample.id),
+                    "epoch": sample.epoch,
+                    "value": score.value,
+                    "answer": score.answer,
+                    "explanation": score.explanation,
+                    "cost": metadata.get("cost", 0.0),
+                    "token_counts": metadata.get("token_counts", {}),
+                    "evidence_cache": metadata.get("evidence_cache"),
+                    "response_cache": metadata.get("response_cache"),
+                    "timings": metadata.get("timings"),
+                    "skipped": metadata.get("skipped", False),
+                }
+        return records
+
     def _check_required_columns(
         self, df: DataFrame, required_columns: list[str]
     ) -> None:
@@ -150,3 +542,130 @@ class MultipleChoiceEval:
             raise TypeError(
                 f"Custom agent must return a dict with 'answer', 'cost', and 'token_counts' keys, got return type annotation {return_annotation}"
             )
+
+
+def _summarise_run(
+    attempts: list[dict],
+    values: dict[str, str],
+    eval_result: list,
+    ledger: dict,
+    from_checkpoint: int = 0,
+    epoch_summary: dict | None = None,
+    trace: str | Path | None = None,
+) -> dict:
+    """Aggregate and print the results of a run, also used to merge the shards of a sharded run.
+
+    Samples are ordered by id (and epoch) first, so the result does not depend on the order the samples finished in.
+
+    Args:
+        attempts (list[dict]): Result of every run of every sample, see MultipleChoiceEval._sample_records.
+        values (dict[str, str]): Sample id to its final score value.
+        eval_result (list): The eval logs.
+        ledger (dict): Snapshot of the cost ledger.
+        from_checkpoint (int, optional): Number of samples loaded from a checkpoint. Defaults to 0.
+        epoch_summary (dict | None, optional): Spread of the metrics over epochs. Defaults to None.
+        trace (str | Path | None, optional): File to export the per-stage spans to. Defaults to None.
+
+    Returns:
+        dict: Cost, token usage, metrics, evidence and response cache usage, epochs, stages, ledger, per-sample results and the eval logs.
+    """
+    attempts = sorted(attempts, key=lambda r: (str(r["id"]), r.get("epoch") or 1))
+
+    # Total cost and tokens of every attempt
+    total_cost, total_token_counts = _usage_totals(attempts)
+
+    metrics = score_summary([values[i] for i in sorted(values)])
+
+    # Evidence summaries reused by the samples of this run
+    evidence_usages = [r["evidence_cache"] for r in attempts if r.get("evidence_cache")]
+    evidence_cache = merge_cache_usage(evidence_usages) if evidence_usages else None
+
+    # Responses replayed from the response cache, which are not included in the cost and tokens
+    response_usages = [r["response_cache"] for r in attempts if r.get("response_cache")]
+    response_cache = merge_cache_usage(response_usages) if response_usages else None
+
+    # Latency, tokens and cost of every stage of the samples
+    stages = stage_summary([span for r in attempts for span in r.get("timings") or []])
+    if trace is not None:
+        export_trace(attempts, trace)
+
+    # Print summary
+    print("\n--- Evaluation Cost Summary ---")
+    print(f"Samples: {len(values)} ({from_checkpoint} from checkpoint)")
+    if ledger["skipped"]:
+        print(
+            f"Budget reached: {ledger['skipped']} samples skipped, results are partial"
+        )
+    print(f"Metrics: {metrics}")
+    if epoch_summary is not None:
+        print(
+            f"Epochs: accuracy {epoch_summary['accuracy_mean']:.3f} +/- {epoch_summary['accuracy_std']:.3f}, "
+            f"{epoch_summary['calls']} calls ({epoch_summary['calls_saved']} saved by early stopping), "
+            f"{epoch_summary['unstable']} unstable samples"
+        )
+    print(f"Total cost: ${total_cost:.6f}")
+    print(f"Total token usage: {total_token_counts}")
+    if evidence_cache is not None:
+        print(
+            f"Evidence cache: {evidence_cache['hit_rate']:.1%} hit rate, {evidence_cache['tokens_saved']} tokens (${evidence_cache['cost_saved']:.6f}) saved"
+        )
+    if response_cache is not None:
+        print(
+            f"Response cache: {response_cache['hit_rate']:.1%} hit rate, {response_cache['tokens_saved']} tokens (${response_cache['cost_saved']:.6f}) saved"
+        )
+    if len(stages):
+        print(f"Stages (seconds):\n{stages.round(4).to_string()}")
+    print(f"Rate limits: {get_governor().stats()}")
+    print("------------------------------\n")
+
+    # Return results
+    return {
+        "cost": total_cost,
+        "token_counts": total_token_counts,
+        "metrics": metrics,
+        "evidence_cache": evidence_cache,
+        "response_cache": response_cache,
+        "epochs": epoch_summary,
+        "stages": stages,
+        "ledger": ledger,
+        "samples": attempts,
+        "eval_result": eval_result
+    }
+
+
+def _answer_choice(answer: str, choices: list[str]) -> str:
+    """Get the choice text of an answer letter, so answers can be compared across shuffled epochs."""
+    answer = str(answer)
+    index = ord(answer) - 65 if len(answer) == 1 and answer.isupper() else -1
+    if 0 <= index < len(choices):
+        return choices[index]
+    return answer
+
+
+def _usage_totals(records: list[dict]) -> tuple[float, dict[str, list[int]]]:
+    """Sum the cost and the tokens per model of sample results.
+
+    Args:
+        records (list[dict]): Sample results with a 'cost' and 'token_counts'.
+
+    Returns:
+        tuple[float, dict[str, list[int]]]: Total cost, and [prompt_tokens, completion_tokens] per model.
+    """
+    total_cost = 0.0
+    total_token_counts = {}
+
+    for record in records:
+        total_cost += float(record.get("cost") or 0.0)
+        for model, counts in (record.get("token_counts") or {}).items():
+            if model not in total_token_counts:
+                total_token_counts[model] = [0, 0]  # [prompt_tokens, completion_tokens]
+            if isinstance(counts, (list, tuple)) and len(counts) >= 2:
+                total_token_counts[model][0] += int(counts[0])
+                total_token_counts[model][1] += int(counts[1])
+
+    return total_cost, total_token_counts
+
+
+def _mode(values: list):
+    """Most common value, ties go to the earliest."""
+    return Counter(values).most_common(1)[0][0]
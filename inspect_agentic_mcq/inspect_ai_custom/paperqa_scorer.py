@@ -17,6 +17,10 @@ from inspect_ai.scorer import (
 )
 from inspect_ai.solver import TaskState
 
+from inspect_agentic_mcq.checkpoint import Checkpoint
+from inspect_agentic_mcq.inspect_ai_custom.score_stats import score_array
+from inspect_agentic_mcq.timing import StageTimer
+
 
 # Custom Value to Float function
 def precision_value_to_float(
@@ -57,83 +61,148 @@ def accuracy_value_to_float(
         
 
 
+def _sample_values(scores: list[SampleScore]) -> list[Value]:
+    # Samples skipped by the budget cap were never answered, so they are left out of the metrics
+    return [i.score.value for i in scores if not (i.score.metadata or {}).get("skipped")]
+
+
 # Custom Metrics
 @metric
 def paperqa_precision(to_float: ValueToFloat = precision_value_to_float()) -> Metric:
 
     def metric(scores: list[SampleScore]) -> float:
+        values = score_array(_sample_values(scores), to_float)
         # Get the answered questions
-        answered = [i for i in scores if to_float(i.score.value) != -1]
+        answered = values != -1
         # Check if no questions answered
-        if len(answered) == 0:
+        if not answered.any():
             return 0.0
-
-        total = 0.0
-        for i in answered:
-            total += to_float(i.score.value)
-        return total / float(len(answered))
+        return float(values[answered].mean())
 
     return metric
 
 
-# Is this wrong?
 @metric
 def paperqa_accuracy(to_float: ValueToFloat = accuracy_value_to_float()) -> Metric:
 
     def metric(scores: list[SampleScore]) -> float:
-        total = 0.0
-        for i in scores:
-            total += to_float(i.score.value)
-        return total / float(len(scores))
+        values = score_array(_sample_values(scores), to_float)
+        if values.size == 0:
+            return 0.0
+        return float(values.mean())
 
     return metric
 
 
-@scorer(metrics=[paperqa_accuracy(), paperqa_precision()])
-def paperqa_scorer() -> Scorer:
+@metric
+def paperqa_coverage(to_float: ValueToFloat = precision_value_to_float()) -> Metric:
+    """Fraction of questions that were answered rather than declined."""
+
+    def metric(scores: list[SampleScore]) -> float:
+        values = score_array(_sample_values(scores), to_float)
+        if values.size == 0:
+            return 0.0
+        return float((values != -1).mean())
+
+    return metric
+
+
+def _score_completion(completion: str, target: Target) -> Score:
+    """Score the json output of the bridge agent against the target."""
+    try:
+        # use json to load the answer
+        output = json.loads(completion)
+
+        answer = output.get("answer", "")
+        explanation = output.get("explanation", "")
+        metadata = {
+            "cost": output.get("cost", 0.0),
+            "token_counts": output.get("token_counts", {}),
+        }
+        if "evidence_cache" in output:
+            metadata["evidence_cache"] = output["evidence_cache"]
+        if "response_cache" in output:
+            metadata["response_cache"] = output["response_cache"]
+        if "timings" in output:
+            metadata["timings"] = output["timings"]
+
+        # Samples skipped by the budget cap have no answer to score
+        if output.get("skipped"):
+            metadata["skipped"] = True
+            return Score(value=NOANSWER, answer=answer, explanation=explanation, metadata=metadata)
+
+        no_answer = "NA"
+
+        # If target is provided as JSON
+        try:
+            target_value = json.loads(target.text)
+            expected_answer = target_value.get("answer", "")
+        except json.JSONDecodeError:
+            # If target is not JSON, use it directly
+            expected_answer = target.text
+
+        # Calculate metrics
+        is_correct = answer == expected_answer
+        is_no_answer_target = expected_answer == no_answer
+        is_no_answer_output = answer == no_answer
+
+        # Determine the score value
+        if is_no_answer_target and is_no_answer_output:
+            value = CORRECT
+        elif is_no_answer_output:
+            value = NOANSWER
+        elif is_correct:
+            value = CORRECT
+        else:
+            value = INCORRECT
+        return Score(value=value, answer=answer, explanation=explanation, metadata=metadata)
+
+    except (json.JSONDecodeError, AttributeError, KeyError) as e:
+        # Handle errors in parsing
+        return Score(value=INCORRECT, answer=f"Error: {str(e)},")
+
+
+@scorer(metrics=[paperqa_accuracy(), paperqa_precision(), paperqa_coverage()])
+def paperqa_scorer(checkpoint: str | None = None) -> Scorer:
     """Custom inspect_ai Scorer. No partial marks. Handles custom accuracy and precision.
 
+    Args:
+        checkpoint (str | None, optional): Path of a checkpoint file that each sample's result is appended to as it is scored. Defaults to None.
+
     Returns:
         Scorer: For the inspect_ai interface.
     """
+    checkpoint_file = Checkpoint(checkpoint) if checkpoint is not None else None
 
     # Create async score function
     async def score(state: TaskState, target: Target) -> Score:
-
-        try:
-            # use json to load the answer
-            output = json.loads(state.output.completion)
-
-            answer = output.get("answer", "")
-            explanation = output.get("explanation", "")
-
-            no_answer = "NA"
-
-            # If target is provided as JSON
-            try:
-                target_value = json.loads(target.text)
-                expected_answer = target_value.get("answer", "")
-            except json.JSONDecodeError:
-                # If target is not JSON, use it directly
-                expected_answer = target.text
-
-            # Calculate metrics
-            is_correct = answer == expected_answer
-            is_no_answer_target = expected_answer == no_answer
-            is_no_answer_output = answer == no_answer
-
-            # Determine the score value
-            if is_no_answer_target and is_no_answer_output:
-                return Score(value=CORRECT, answer=answer, explanation=explanation)
-            elif is_no_answer_output:
-                return Score(value=NOANSWER, answer=answer, explanation=explanation)
-            elif is_correct:
-                return Score(value=CORRECT, answer=answer, explanation=explanation)
-            else:
-                return Score(value=INCORRECT, answer=answer, explanation=explanation)
-
-        except (json.JSONDecodeError, AttributeError, KeyError) as e:
-            # Handle errors in parsing
-            return Score(value=INCORRECT, answer=f"Error: {str(e)},")
+        timer = StageTimer()
+        with timer.span("score"):
+            result = _score_completion(state.output.completion, target)
+
+        # Add the scoring time to the stages of the bridge agent
+        metadata = result.metadata or {}
+        metadata = {**metadata, "timings": metadata.get("timings", []) + timer.spans}
+        result.metadata = metadata
+
+        # Save the result as soon as the sample is scored, skipped samples are left to be resumed
+        if checkpoint_file is not None and not metadata.get("skipped"):
+            checkpoint_file.append(
+                {
+                    "id": state.sample_id,
+                    "epoch": state.epoch,
+                    "value": result.value,
+                    "answer": result.answer,
+                    "explanation": result.explanation,
+                    "target": target.text,
+                    "cost": metadata.get("cost", 0.0),
+                    "token_counts": metadata.get("token_counts", {}),
+                    "evidence_cache": metadata.get("evidence_cache"),
+                    "response_cache": metadata.get("response_cache"),
+                    "timings": metadata["timings"],
+                }
+            )
+
+        return result
 
     return score
@@ -0,0 +1,178 @@
+import copy
+from collections.abc import Callable, Iterator
+from pathlib import Path
+import random
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from inspect_ai.dataset import Dataset, Sample
+
+from inspect_agentic_mcq.inspect_ai_custom.sample import (
+    record_to_sample_custom,
+    records_to_samples,
+)
+
+
+class ParquetDataset(Dataset):
+    """inspect_ai Dataset that streams Samples from parquet files instead of holding them all in memory.
+
+    Rows are read in batches with only the requested columns, row filters are pushed down to the parquet reader (skipping
+    row groups where possible), and Samples are only built when they are accessed. The choice orders of every batch are
+    computed at once from the seed and epoch, so a row always gives the same Sample.
+    """
+
+    def __init__(
+        self,
+        path: str | Path | list[str | Path],
+        sample_fn: Callable[..., Sample] = record_to_sample_custom,
+        columns: list[str] | None = None,
+        filters: ds.Expression | list | None = None,
+        batch_size: int = 1024,
+        name: str | None = None,
+        seed: int = 0,
+        epoch: int = 1,
+    ) -> None:
+        """
+        Args:
+            path (str | Path | list[str | Path]): Parquet file, directory, or list of files (e.g. train, valid and test splits).
+            sample_fn (Callable[..., Sample], optional): Converts a row and its choice permutation to a Sample. Defaults to record_to_sample_custom.
+            columns (list[str] | None, optional): Columns to read. Defaults to None (all columns).
+            filters (ds.Expression | list | None, optional): Row filter, either a pyarrow Expression or pandas style
+                filters, e.g. [("split", "==", "test")]. Defaults to None.
+            batch_size (int, optional): Number of rows read at a time. Defaults to 1024.
+            name (str | None, optional): Dataset name. Defaults to None (the file name).
+            seed (int, optional): Seed of the choice orders. Defaults to 0.
+            epoch (int, optional): Epoch of the choice orders. Defaults to 1.
+        """
+        paths = [str(p) for p in path] if isinstance(path, list) else str(path)
+        self._dataset = ds.dataset(paths, format="parquet")
+        self._location = ",".join(paths) if isinstance(paths, list) else paths
+        self._name = name if name is not None else Path(self._location.split(",")[0]).stem
+
+        if isinstance(filters, list):
+            filters = pq.filters_to_expression(filters)
+        self._filter = filters
+        self._columns = columns
+        self._sample_fn = sample_fn
+        self._batch_size = batch_size
+        self._seed = seed
+        self._epoch = epoch
+
+        # Selected rows (after filtering) in order, None while all rows are selected in file order
+        self._rows: list[int] | None = None
+        self._count: int | None = None
+        self._shuffled = False
+
+    @property
+    def name(self) -> str | None:
+        return self._name
+
+    @property
+    def location(self) -> str | None:
+        return self._location
+
+    @property
+    def shuffled(self) -> bool:
+        return self._shuffled
+
+    @property
+    def column_names(self) -> list[str]:
+        """Columns available in the parquet files."""
+        return self._dataset.schema.names
+
+    def _scanner(self) -> ds.Scanner:
+        return self._dataset.scanner(
+            columns=self._columns, filter=self._filter, batch_size=self._batch_size
+        )
+
+    def _selected_rows(self) -> list[int] | range:
+        return self._rows if self._rows is not None else range(len(self))
+
+    def _take(self, rows: list[int]) -> list[Sample]:
+        """Build the Samples of rows (numbered after filtering)."""
+        return self._to_samples(self._scanner().take(rows).to_pylist())
+
+    def _to_samples(self, records: list[dict]) -> list[Sample]:
+        return records_to_samples(records, self._sample_fn, seed=self._seed, epoch=self._epoch)
+
+    def _with_rows(self, rows: list[int], name: str | None = None) -> "ParquetDataset":
+        view = copy.copy(self)
+        view._rows = list(rows)
+        if name is not None:
+            view._name = name
+        return view
+
+    def __len__(self) -> int:
+        if self._rows is not None:
+            return len(self._rows)
+        if self._count is None:
+            self._count = self._scanner().count_rows()
+        return self._count
+
+    def __iter__(self) -> Iterator[Sample]:
+        if self._rows is None:
+            # Stream the batches in file order
+            for batch in self._scanner().to_batches():
+                yield from self._to_samples(batch.to_pylist())
+        else:
+            for start in range(0, len(self._rows), self._batch_size):
+                yield from self._take(self._rows[start : start + self._batch_size])
+
+    def __getitem__(self, index: int | slice) -> Sample | Dataset:
+        rows = self._selected_rows()
+        if isinstance(index, slice):
+            return self._with_rows(rows[index])
+        return self._take([rows[index]])[0]
+
+    def sort(self, reverse: bool = False, key=None) -> None:
+        if key is None:
+            from inspect_ai.dataset._dataset import sample_input_len
+
+            key = sample_input_len
+
+        # Only the keys are kept in memory, not the Samples
+        rows = self._selected_rows()
+        keys = [key(sample) for sample in self]
+        order = sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+        self._rows = [rows[i] for i in order]
+
+    def filter(self, predicate: Callable[[Sample], bool], name: str | None = None) -> "ParquetDataset":
+        rows = self._selected_rows()
+        return self._with_rows(
+            [row for row, sample in zip(rows, self) if predicate(sample)], name=name
+        )
+
+    def shuffle(self, seed: int | None = None) -> None:
+        rows = list(self._selected_rows())
+        random.Random(seed).shuffle(rows)
+        self._rows = rows
+        self._shuffled = True
+
+    def shuffle_choices(self, seed: int | None = None) -> None:
+        self._seed = seed if seed is not None else random.getrandbits(32)
+
+    def with_choice_order(self, seed: int, epoch: int) -> "ParquetDataset":
+        """Get a view of the same rows with the choices ordered for another seed or epoch.
+
+        Args:
+            seed (int): Seed of the choice orders.
+            epoch (int): Epoch of the choice orders.
+
+        Returns:
+            ParquetDataset: The view, this dataset is left unchanged.
+        """
+        view = copy.copy(self)
+        view._seed = seed
+        view._epoch = epoch
+        return view
+
+
+if __name__ == "__main__":
+    dataset = ParquetDataset(
+        "data/LitQA_data/test-00000-of-00001.parquet",
+        columns=["question", "ideal", "distractors"],
+    )
+    print(len(dataset))
+    print(dataset[0].input)
+    print(len(dataset[:10]), len(dataset.filter(lambda sample: "cell" in sample.input)))
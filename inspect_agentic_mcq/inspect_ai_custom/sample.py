@@ -1,32 +1,105 @@
-import random
+import hashlib
 
+import numpy as np
 from pandas import DataFrame
 
 from inspect_ai.dataset import MemoryDataset, Sample
 
 
-def record_to_sample_custom(record: dict) -> Sample:
+def sample_id(record: dict) -> str:
+    """Stable id of a question, derived from its content so it does not depend on row order or choice shuffling.
+
+    Args:
+        record (dict): Contains the question, ideal answer and distractors.
+
+    Returns:
+        str: Short hex digest identifying the question.
+    """
+    choices = sorted([str(record["ideal"]), *map(str, record["distractors"])])
+    content = "\n".join([str(record["question"]).strip(), *choices])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:16]
+
+
+def _mix64(x: np.ndarray) -> np.ndarray:
+    """SplitMix64 finaliser, applied elementwise to uint64 arrays."""
+    with np.errstate(over="ignore"):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def choice_permutations(
+    ids: list[str], n_choices: list[int], seed: int = 0, epoch: int = 1
+) -> list[np.ndarray]:
+    """Compute the choice order of many questions in one vectorised pass.
+
+    Every choice gets a pseudo-random key from a hash of (seed, epoch, question id, choice position) and the choices are
+    ordered by their keys. The order of a question therefore only depends on the seed, the epoch and the question itself,
+    not on the other questions or the order they are read in.
+
+    Args:
+        ids (list[str]): Hex sample ids of the questions, see sample_id.
+        n_choices (list[int]): Number of choices (ideal plus distractors) of every question.
+        seed (int, optional): Seed of the ordering. Defaults to 0.
+        epoch (int, optional): Epoch, each epoch gets a different ordering. Defaults to 1.
+
+    Returns:
+        list[np.ndarray]: For every question, indices into [ideal, *distractors] in the order they are shown.
+    """
+    if len(ids) == 0:
+        return []
+    n_choices = np.asarray(n_choices, dtype=np.int64)
+    width = int(n_choices.max())
+
+    # One random stream per (seed, epoch), then one key per question and choice position
+    stream = _mix64(np.array([(seed * 0x9E3779B97F4A7C15 + epoch) & (2**64 - 1)], dtype=np.uint64))
+    questions = np.array([int(i[:16], 16) for i in ids], dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        keys = _mix64((questions[:, None] ^ stream) + np.arange(width, dtype=np.uint64)[None, :])
+
+    # Padding positions sort last
+    keys[np.arange(width)[None, :] >= n_choices[:, None]] = np.iinfo(np.uint64).max
+    order = np.argsort(keys, axis=1, kind="stable")
+    return [order[i, :n] for i, n in enumerate(n_choices)]
+
+
+def _records_permutations(records: list[dict], seed: int, epoch: int) -> list[np.ndarray]:
+    return choice_permutations(
+        [sample_id(record) for record in records],
+        [1 + len(record["distractors"]) for record in records],
+        seed=seed,
+        epoch=epoch,
+    )
+
+
+def record_to_sample_custom(record: dict, permutation: list[int] | None = None) -> Sample:
     """Custom function to transform dictionaries into inspect_ai Samples.
 
     Args:
         record (dict): Conatins information needed for MCQ.
+        permutation (list[int] | None, optional): Order of [ideal, *distractors] to show the choices in, see
+            choice_permutations. Defaults to None (the seed 0, epoch 1 order).
 
     Returns:
         Sample: Completed Sample object for MCQ
     """
     # Get the question
-    message = f"Question: {record["question"]} \n"
+    message = f"Question: {record['question']} \n"
 
     # Concatenate the choices
     choices = [record["ideal"]]
     choices.extend(record["distractors"])
 
     # Shuffle because we want the final answer to be unsure
-    # Shuffle the dataset
-    random.shuffle(choices)
+    # Reproducible order, so that identical configs produce identical prompts
+    if permutation is None:
+        permutation = _records_permutations([record], seed=0, epoch=1)[0]
+    permutation = [int(i) for i in permutation]
+    choices = [choices[i] for i in permutation]
 
     # Find the ideal answer
-    ideal_idx = choices.index(record["ideal"])
+    ideal_idx = permutation.index(0)
 
     # Add prefixes to the shuffled choices
     # indices = list[range(len(choices))]
@@ -34,48 +107,90 @@ def record_to_sample_custom(record: dict) -> Sample:
 
     message += f"\nNA) {UNCERTAIN_ANSWER_CHOICE}"
 
+    # Keep the parsed question and target so the bridge agent does not need to re-parse them
+    metadata = {
+        "question": message.strip(),
+        "target": chr(65 + ideal_idx),
+        "permutation": permutation,
+    }
+
     # Add the target to the message:
     message += f"\n\nTarget: {chr(65 + ideal_idx)}"
 
     # Make the message a part of the Sample
-    return Sample(input=message, choices=choices, target=f"{chr(65 + ideal_idx)}")
+    return Sample(
+        id=sample_id(record),
+        input=message,
+        choices=choices,
+        target=f"{chr(65 + ideal_idx)}",
+        metadata=metadata,
+    )
+
 
+def records_to_samples(
+    records: list[dict], sample_fn=record_to_sample_custom, seed: int = 0, epoch: int = 1
+) -> list[Sample]:
+    """Transform records into Samples, with the choice orders of all records computed at once.
 
-def df_2_sample_bridge(data: DataFrame) -> MemoryDataset:
+    Args:
+        records (list[dict]): Records containing the question, ideal answer and distractors.
+        sample_fn (Callable, optional): Builds a Sample from a record and its permutation. Defaults to record_to_sample_custom.
+        seed (int, optional): Seed of the choice orders. Defaults to 0.
+        epoch (int, optional): Epoch of the choice orders. Defaults to 1.
+
+    Returns:
+        list[Sample]: One Sample per record.
+    """
+    permutations = _records_permutations(records, seed=seed, epoch=epoch)
+    return [sample_fn(record, permutation=p) for record, p in zip(records, permutations)]
+
+
+def df_2_sample_bridge(data: DataFrame, seed: int = 0, epoch: int = 1) -> MemoryDataset:
     """Function to transform a pandas DataFrame to a MemoryDataset for inspect_ai processing.
 
     Args:
         data (DataFrame): DataFrame containing required information.
+        seed (int, optional): Seed of the choice orders. Defaults to 0.
+        epoch (int, optional): Epoch of the choice orders, later epochs reshuffle the choices. Defaults to 1.
 
     Returns:
         MemoryDataset: Full MemoryDataset for inspect_ai processing
     """
     records = data.to_dict(orient="records")
-    samples = [record_to_sample_custom(i) for i in records]
+    samples = records_to_samples(records, record_to_sample_custom, seed=seed, epoch=epoch)
     return MemoryDataset(samples)
 
 
 UNCERTAIN_ANSWER_CHOICE = "Insufficient information to answer the question."
 
-def record_to_sample(record: dict) -> Sample:
+def record_to_sample(record: dict, permutation: list[int] | None = None) -> Sample:
 
     # Concatenate the choices
     choices = [record["ideal"]]
     choices.extend(record["distractors"])
 
     # Shuffle because we want the final answer to be unsure
-    # Shuffle the dataset
-    random.shuffle(choices)
+    # Reproducible order, see choice_permutations
+    if permutation is None:
+        permutation = _records_permutations([record], seed=0, epoch=1)[0]
+    permutation = [int(i) for i in permutation]
+    choices = [choices[i] for i in permutation]
 
     # Find the ideal answer
-    ideal_idx = choices.index(record["ideal"])
+    ideal_idx = permutation.index(0)
 
     # Make the message a part of the Sample
-    return Sample(input=record["question"], choices=choices, target=f"{chr(65 + ideal_idx)}")
+    return Sample(
+        id=sample_id(record),
+        input=record["question"],
+        choices=choices,
+        target=f"{chr(65 + ideal_idx)}",
+        metadata={"permutation": permutation},
+    )
 
-def df_2_sample(data: DataFrame) -> MemoryDataset:
+def df_2_sample(data: DataFrame, seed: int = 0, epoch: int = 1) -> MemoryDataset:
     records = data.to_dict(orient="records")
-    samples = [record_to_sample(i) for i in records]
+    samples = records_to_samples(records, record_to_sample, seed=seed, epoch=epoch)
     return MemoryDataset(samples)
 
 
@@ -0,0 +1,176 @@
+# Accuracy, precision and coverage of score values with confidence intervals, without importing inspect_ai
+
+from collections.abc import Callable
+from statistics import NormalDist
+
+import numpy as np
+
+
+# Score values of inspect_ai.scorer, so the summaries can be computed without importing it
+CORRECT = "C"
+INCORRECT = "I"
+NOANSWER = "N"
+
+
+def accuracy_value(value) -> float:
+    """Convert a score value as the paperqa_accuracy metric does: 1 if correct, 0 otherwise (including no answer).
+
+    Args:
+        value: Score value (CORRECT, INCORRECT or NOANSWER), or a number.
+
+    Returns:
+        float: Value of the score.
+    """
+    if isinstance(value, int | float | bool):
+        return float(value)
+    return 1.0 if value == CORRECT else 0.0
+
+
+def precision_value(value) -> float:
+    """Convert a score value as the paperqa_precision metric does: 1 if correct, -1 for no answer and 0 otherwise.
+
+    Args:
+        value: Score value (CORRECT, INCORRECT or NOANSWER), or a number.
+
+    Returns:
+        float: Value of the score.
+    """
+    if isinstance(value, int | float | bool):
+        return float(value)
+    if value == NOANSWER:
+        return -1.0
+    return 1.0 if value == CORRECT else 0.0
+
+
+def score_array(values: list, to_float: Callable) -> np.ndarray:
+    """Convert score values to a float array, calling to_float once per distinct value rather than per sample.
+
+    Args:
+        values (list): Score values (CORRECT, INCORRECT or NOANSWER).
+        to_float (Callable): Conversion of a score value, e.g. precision_value.
+
+    Returns:
+        np.ndarray: Float value of every score.
+    """
+    distinct = {value: to_float(value) for value in set(values)}
+    return np.fromiter((distinct[value] for value in values), dtype=float, count=len(values))
+
+
+def wilson_interval(successes: float, n: int, confidence: float = 0.95) -> tuple[float, float]:
+    """Wilson score interval of a proportion.
+
+    Args:
+        successes (float): Number of successes, e.g. correct answers.
+        n (int): Number of trials.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+
+    Returns:
+        tuple[float, float]: Lower and upper bound, (0.0, 1.0) if there are no trials.
+    """
+    if n == 0:
+        return 0.0, 1.0
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = successes / n
+    denominator = 1 + z**2 / n
+    centre = (p + z**2 / (2 * n)) / denominator
+    half_width = z * np.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return float(max(centre - half_width, 0.0)), float(min(centre + half_width, 1.0))
+
+
+def bootstrap_interval(
+    statistic,
+    *arrays: np.ndarray,
+    n_resamples: int = 10_000,
+    confidence: float = 0.95,
+    seed: int | None = 0,
+) -> tuple[float, float]:
+    """Percentile bootstrap interval of a statistic, with all resamples computed as one array operation per batch.
+
+    Args:
+        statistic (Callable): Takes the resampled arrays, each of shape (resamples, n), and returns one value per resample (NaN if undefined).
+        *arrays (np.ndarray): Per-sample arrays, resampled together.
+        n_resamples (int, optional): Number of bootstrap resamples. Defaults to 10_000.
+        confidence (float, optional): Confidence level. Defaults to 0.95.
+        seed (int | None, optional): Seed of the resampling. Defaults to 0.
+
+    Returns:
+        tuple[float, float]: Lower and upper bound, (nan, nan) if the statistic is never defined.
+    """
+    n = len(arrays[0])
+    if n == 0:
+        return float("nan"), float("nan")
+
+    rng = np.random.default_rng(seed)
+    # Bound the memory of the (resamples, n) index array
+    batch_size = max(1, min(n_resamples, 10_000_000 // n))
+    estimates = []
+    for start in range(0, n_resamples, batch_size):
+        indices = rng.integers(0, n, size=(min(batch_size, n_resamples - start), n))
+        estimates.append(statistic(*(array[indices] for array in arrays)))
+    estimates = np.concatenate(estimates)
+
+    if np.isnan(estimates).all():
+        return float("nan"), float("nan")
+    alpha = (1 - confidence) / 2
+    lower, upper = np.nanquantile(estimates, [alpha, 1 - alpha])
+    return float(lower), float(upper)
+
+
+def _resampled_precision(values: np.ndarray, answered: np.ndarray) -> np.ndarray:
+    """Precision of every resample (row), NaN for resamples without any answered question."""
+    n_answered = answered.sum(axis=1)
+    total = np.where(answered, values, 0.0).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(n_answered > 0, total / n_answered, np.nan)
+
+
+def score_summary(
+    values: list,
+    confidence: float = 0.95,
+    n_resamples: int = 10_000,
+    seed: int | None = 0,
+) -> dict:
+    """Compute the accuracy, precision and coverage of a list of score values with confidence intervals.
+
+    Accuracy and coverage use Wilson intervals, precision (a ratio of two random counts) uses a bootstrap interval.
+
+    Args:
+        values (list): Score values (CORRECT, INCORRECT or NOANSWER).
+        confidence (float, optional): Confidence level of the intervals. Defaults to 0.95.
+        n_resamples (int, optional): Number of bootstrap resamples. Defaults to 10_000.
+        seed (int | None, optional): Seed of the bootstrap. Defaults to 0.
+
+    Returns:
+        dict: Accuracy, precision and coverage matching the scorer metrics, and the '_ci_low' and '_ci_high' bound of each.
+    """
+    accuracy_values = score_array(values, accuracy_value)
+    precision_values = score_array(values, precision_value)
+    answered = precision_values != -1
+    n = len(values)
+
+    accuracy = float(accuracy_values.mean()) if n else 0.0
+    precision = float(precision_values[answered].mean()) if answered.any() else 0.0
+    coverage = float(answered.mean()) if n else 0.0
+
+    accuracy_ci = wilson_interval(float(accuracy_values.sum()), n, confidence)
+    coverage_ci = wilson_interval(float(answered.sum()), n, confidence)
+    precision_ci = bootstrap_interval(
+        _resampled_precision,
+        precision_values,
+        answered,
+        n_resamples=n_resamples,
+        confidence=confidence,
+        seed=seed,
+    )
+
+    return {
+        "paperqa_accuracy": accuracy,
+        "paperqa_precision": precision,
+        "paperqa_coverage": coverage,
+        "paperqa_accuracy_ci_low": accuracy_ci[0],
+        "paperqa_accuracy_ci_high": accuracy_ci[1],
+        "paperqa_precision_ci_low": precision_ci[0],
+        "paperqa_precision_ci_high": precision_ci[1],
+        "paperqa_coverage_ci_low": coverage_ci[0],
+        "paperqa_coverage_ci_high": coverage_ci[1],
+    }
@@ -0,0 +1,125 @@
+# Live cost ledger of an evaluation, with optional budget caps
+
+import threading
+
+
+class CostLedger:
+    """Running totals of the cost and tokens of an evaluation, updated as each sample completes.
+
+    Once max_cost or max_tokens is reached the ledger is exhausted, no further samples are scheduled and the bridge agent
+    skips the scheduled samples that have not started yet. Samples already in flight still finish and are recorded, so the totals can overshoot the caps by at most
+    the cost of the samples running concurrently.
+    """
+
+    def __init__(self, max_cost: float | None = None, max_tokens: int | None = None) -> None:
+        if max_cost is not None and max_cost < 0:
+            raise ValueError(f"max_cost must not be negative, got {max_cost}")
+        if max_tokens is not None and max_tokens < 0:
+            raise ValueError(f"max_tokens must not be negative, got {max_tokens}")
+
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+
+        self.cost = 0.0
+        self.token_counts: dict[str, list[int]] = {}
+        self.samples = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    @property
+    def tokens(self) -> int:
+        """Total tokens over every model."""
+        with self._lock:
+            return self._tokens_locked()
+
+    @property
+    def exhausted(self) -> bool:
+        """Whether a budget cap has been reached."""
+        with self._lock:
+            return self._exhausted_locked()
+
+    def _tokens_locked(self) -> int:
+        return sum(prompt + completion for prompt, completion in self.token_counts.values())
+
+    def _exhausted_locked(self) -> bool:
+        return (self.max_cost is not None and self.cost >= self.max_cost) or (
+            self.max_tokens is not None and self._tokens_locked() >= self.max_tokens
+        )
+
+    def record(self, cost: float, token_counts: dict) -> None:
+        """Add the usage of a completed sample.
+
+        Args:
+            cost (float): Cost in dollars.
+            token_counts (dict): Tokens per model, {model: [prompt_tokens, completion_tokens]}.
+        """
+        with self._lock:
+            was_exhausted = self._exhausted_locked()
+            self.cost += float(cost or 0.0)
+            for model, counts in (token_counts or {}).items():
+                if not isinstance(counts, (list, tuple)) or len(counts) < 2:
+                    continue
+                totals = self.token_counts.setdefault(model, [0, 0])
+                totals[0] += int(counts[0])
+                totals[1] += int(counts[1])
+            self.samples += 1
+
+            if not was_exhausted and self._exhausted_locked():
+                print(
+                    f"Budget reached after {self.samples} samples (${self.cost:.6f}), skipping the remaining samples"
+                )
+
+    def skip(self, samples: int = 1) -> None:
+        """Count samples that were skipped because the budget was reached.
+
+        Args:
+            samples (int, optional): Number of skipped samples. Defaults to 1.
+        """
+        with self._lock:
+            self.skipped += samples
+
+    def snapshot(self) -> dict:
+        """Get the current totals.
+
+        Returns:
+            dict: Cost, tokens per model, total tokens, completed and skipped samples, and the caps.
+        """
+        with self._lock:
+            return {
+                "cost": self.cost,
+                "token_counts": {model: list(counts) for model, counts in self.token_counts.items()},
+                "tokens": self._tokens_locked(),
+                "samples": self.samples,
+                "skipped": self.skipped,
+                "max_cost": self.max_cost,
+                "max_tokens": self.max_tokens,
+                "exhausted": self._exhausted_locked(),
+            }
+
+
+def merge_ledger_snapshots(snapshots: list[dict]) -> dict:
+    """Add up the ledgers of several runs, e.g. the shards of a sharded run.
+
+    Args:
+        snapshots (list[dict]): Ledger snapshots, see CostLedger.snapshot.
+
+    Returns:
+        dict: Total cost, tokens and samples in the same format as a snapshot, with the caps added up.
+    """
+    ledger = CostLedger()
+    caps = {"max_cost": None, "max_tokens": None}
+    for snapshot in snapshots:
+        ledger.cost += snapshot["cost"]
+        for model, counts in snapshot["token_counts"].items():
+            totals = ledger.token_counts.setdefault(model, [0, 0])
+            totals[0] += counts[0]
+            totals[1] += counts[1]
+        ledger.samples += snapshot["samples"]
+        ledger.skipped += snapshot["skipped"]
+        for cap in caps:
+            if snapshot.get(cap) is not None:
+                caps[cap] = (caps[cap] or 0) + snapshot[cap]
+
+    ledger.max_cost = caps["max_cost"]
+    ledger.max_tokens = caps["max_tokens"]
+    return ledger.snapshot()
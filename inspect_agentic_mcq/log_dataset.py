@@ -0,0 +1,208 @@
+# Flatten inspect_ai .eval logs into a Parquet dataset of per-sample results, and recompute metrics from it
+
+from concurrent.futures import ProcessPoolExecutor
+import json
+from pathlib import Path
+import re
+
+import pandas as pd
+
+from inspect_agentic_mcq.inspect_ai_custom.score_stats import wilson_interval
+from inspect_agentic_mcq.rate_limit import count_tokens
+
+
+# Runs are named after their configuration plus a repeat number, e.g. "pqa_4o_mini_top10_2"
+RUN_NAME_PATTERN = re.compile(r"^(?P<config>.*?)(?:_(?P<repeat>\d+))?$")
+
+
+def _completion_fields(completion: str) -> dict:
+    """Get the answer, cost and token counts from the json output of the bridge agent, if it is json."""
+    try:
+        output = json.loads(completion)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+    return output if isinstance(output, dict) else {}
+
+
+def flatten_log(path: str | Path) -> list[dict]:
+    """Read an .eval log into one flat record per sample.
+
+    Args:
+        path (str | Path): Path of the .eval log.
+
+    Returns:
+        list[dict]: Per-sample answer, target, score, cost, tokens, timings and the configuration of the run.
+    """
+    from inspect_ai.log import read_eval_log
+
+    path = Path(path)
+    log = read_eval_log(str(path))
+
+    name = RUN_NAME_PATTERN.match(path.stem)
+    stored_metrics = {
+        f"stored_{metric_name}": metric.value
+        for score in (log.results.scores if log.results else [])
+        for metric_name, metric in score.metrics.items()
+    }
+    run = {
+        "log_path": str(path.resolve()),
+        "log_mtime": path.stat().st_mtime,
+        "run": path.stem,
+        "config": name.group("config"),
+        "repeat": int(name.group("repeat")) if name.group("repeat") else 1,
+        "task": log.eval.task,
+        "model": log.eval.model,
+        "created": log.eval.created,
+        "status": log.status,
+        "task_args": json.dumps(log.eval.task_args, sort_keys=True, default=str),
+    }
+
+    records = []
+    for sample in log.samples or []:
+        scores = sample.scores or {}
+        # Prefer the custom scorer, older runs used other scorer names
+        scorer_name = "paperqa_scorer" if "paperqa_scorer" in scores else next(iter(scores), None)
+        score = scores.get(scorer_name)
+        score_metadata = (score.metadata if score is not None else None) or {}
+
+        completion = sample.output.completion if sample.output else ""
+        output = _completion_fields(completion)
+        token_counts = score_metadata.get("token_counts", output.get("token_counts")) or {}
+
+        records.append(
+            {
+                **run,
+                "sample_id": str(sample.id),
+                "epoch": sample.epoch,
+                "scorer": scorer_name,
+                "value": None if score is None else str(score.value),
+                "answer": None if score is None else score.answer,
+                "target": sample.target if isinstance(sample.target, str) else ",".join(sample.target),
+                "explanation": None if score is None else score.explanation,
+                "cost": float(score_metadata.get("cost", output.get("cost")) or 0.0),
+                "tokens": count_tokens(token_counts),
+                "token_counts": json.dumps(token_counts, sort_keys=True),
+                "total_time": sample.total_time,
+                "working_time": sample.working_time,
+                "error": None if sample.error is None else sample.error.message,
+                "skipped": bool(score_metadata.get("skipped", False)),
+                "score_metadata": json.dumps(score_metadata, sort_keys=True, default=str),
+                **stored_metrics,
+            }
+        )
+    return records
+
+
+def ingest_logs(
+    logs: str | Path | list[str | Path],
+    output: str | Path,
+    max_workers: int | None = None,
+) -> pd.DataFrame:
+    """Read many .eval logs in parallel into a Parquet dataset of per-sample records.
+
+    Logs that are already in the dataset and have not been modified since are not read again.
+
+    Args:
+        logs (str | Path | list[str | Path]): Directory of .eval logs, or a list of log paths.
+        output (str | Path): Parquet file of the dataset, updated in place if it exists.
+        max_workers (int | None, optional): Number of reading processes. Defaults to None (one per CPU).
+
+    Returns:
+        pd.DataFrame: The full dataset.
+    """
+    if isinstance(logs, (str, Path)):
+        logs = sorted(Path(logs).glob("*.eval"))
+    paths = [Path(p).resolve() for p in logs]
+    output = Path(output)
+
+    # Keep the records of unchanged logs
+    existing = pd.DataFrame()
+    unchanged = set()
+    if output.exists():
+        existing = pd.read_parquet(output)
+        mtimes = existing.groupby("log_path")["log_mtime"].first().to_dict()
+        unchanged = {str(p) for p in paths if mtimes.get(str(p)) == p.stat().st_mtime}
+        existing = existing[existing["log_path"].isin(unchanged)]
+        paths = [p for p in paths if str(p) not in unchanged]
+
+    # Reading a log is mostly decompression and json parsing, so use processes
+    frames = [existing]
+    if paths:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            for records in pool.map(flatten_log, paths):
+                frames.append(pd.DataFrame.from_records(records))
+    print(f"Read {len(paths)} logs, reused {len(unchanged)} unchanged logs")
+
+    frames = [f for f in frames if len(f)]
+    dataset = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    if len(dataset):
+        dataset = dataset.sort_values(["run", "epoch", "sample_id"], ignore_index=True)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        dataset.to_parquet(output, index=False)
+    return dataset
+
+
+def recompute_metrics(
+    dataset: pd.DataFrame | str | Path,
+    by: str = "run",
+    confidence: float = 0.95,
+) -> pd.DataFrame:
+    """Recompute accuracy, precision and coverage from the per-sample score values, matching paperqa_scorer's metrics.
+
+    Samples skipped by a budget cap were never answered, so they are left out like in paperqa_scorer.
+
+    Args:
+        dataset (pd.DataFrame | str | Path): Dataset from ingest_logs, or the path of its Parquet file.
+        by (str, optional): Column to group the samples by, e.g. "run" or "config". Defaults to "run".
+        confidence (float, optional): Confidence level of the Wilson accuracy interval. Defaults to 0.95.
+
+    Returns:
+        pd.DataFrame: Metrics, cost and tokens per group, next to the stored accuracy and precision of the logs.
+    """
+    if not isinstance(dataset, pd.DataFrame):
+        dataset = pd.read_parquet(dataset)
+
+    # Datasets ingested before the 'skipped' column was added have no skipped samples
+    if "skipped" in dataset:
+        dataset = dataset[~dataset["skipped"].fillna(False).astype(bool)]
+
+    samples = dataset.assign(
+        correct=dataset["value"] == "C",
+        answered=dataset["value"].isin(["C", "I"]),
+    )
+    grouped = samples.groupby(by, sort=True)
+    metrics = pd.DataFrame(
+        {
+            "runs": grouped["run"].nunique(),
+            "samples": grouped.size(),
+            "correct": grouped["correct"].sum(),
+            "answered": grouped["answered"].sum(),
+            "cost": grouped["cost"].sum(),
+            "tokens": grouped["tokens"].sum(),
+        }
+    )
+    metrics["paperqa_accuracy"] = metrics["correct"] / metrics["samples"]
+    metrics["paperqa_precision"] = (metrics["correct"] / metrics["answered"]).fillna(0.0)
+    metrics["paperqa_coverage"] = metrics["answered"] / metrics["samples"]
+
+    intervals = [
+        wilson_interval(correct, samples, confidence)
+        for correct, samples in zip(metrics["correct"], metrics["samples"])
+    ]
+    metrics["paperqa_accuracy_ci_low"] = [low for low, _ in intervals]
+    metrics["paperqa_accuracy_ci_high"] = [high for _, high in intervals]
+
+    # Metrics stored in the logs, to compare against (averaged over the runs of a group)
+    stored = [c for c in ("stored_paperqa_accuracy", "stored_paperqa_precision") if c in samples]
+    if stored:
+        metrics = metrics.join(samples.groupby([by, "run"])[stored].first().groupby(by).mean())
+
+    return metrics.drop(columns=["correct", "answered"])
+
+
+if __name__ == "__main__":
+    dataset = ingest_logs("logs", "logs/samples.parquet")
+
+    pd.set_option("display.width", 200)
+    print(recompute_metrics(dataset, by="run"))
+    print(recompute_metrics(dataset, by="config"))
@@ -0,0 +1,479 @@
+# Local stand-in for the OpenAI (chat completions, structured outputs, embeddings) and Gemini embedding APIs, to benchmark
+# the harness itself without network access, provider latency noise or cost
+
+from contextlib import contextmanager
+import base64
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Letters the canned answers are picked from, and the patterns of a chosen letter in a prompt
+ANSWER_LETTERS = "ABCDE"
+LETTER_PATTERN = re.compile(r"(?:ANSWER|Answer|Target)\s*:\s*\(?([A-Z]{1,2})\b")
+
+
+def _seed(*parts) -> int:
+    """Stable 64 bit seed of some request content."""
+    digest = hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).digest()
+    return int.from_bytes(digest[:8], "little")
+
+
+def _count_tokens(text: str) -> int:
+    """Rough token count, 4 characters per token."""
+    return max(1, len(text) // 4)
+
+
+def _message_text(messages: list[dict]) -> str:
+    """Concatenate the text of chat messages, including multi-part contents."""
+    texts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+        texts.append(content or "")
+    return "\n".join(texts)
+
+
+def embed(text: str, dimensions: int) -> list[float]:
+    """Deterministic unit-norm embedding of a text, identical texts get identical vectors.
+
+    Args:
+        text (str): Text to embed.
+        dimensions (int): Embedding size.
+
+    Returns:
+        list[float]: The embedding.
+    """
+    rng = random.Random(_seed("embedding", text))
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class MockLLMServer:
+    """OpenAI-compatible mock LLM and embedding server running in a background thread.
+
+    Replies are deterministic functions of the request: chat completions answer with a canned explanation ending in
+    "ANSWER: <letter>", JSON schema response formats are filled from the schema (reusing any letter in the prompt), tool
+    calls step through the offered tools in order, and embeddings are seeded by the input text. Latency and HTTP 429
+    rate limit errors are drawn from a seeded random generator, so runs are reproducible.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        latency_std: float = 0.0,
+        latency_per_token: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: float = 1.0,
+        answer: str | None = None,
+        embedding_dimensions: int = 1536,
+        seed: int = 0,
+    ) -> None:
+        """
+        Args:
+            host (str, optional): Interface to listen on. Defaults to "127.0.0.1".
+            port (int, optional): Port to listen on. Defaults to 0 (any free port).
+            latency (float, optional): Mean latency of a request in seconds. Defaults to 0.0.
+            latency_std (float, optional): Standard deviation of the latency, drawn from a lognormal distribution. Defaults to 0.0 (fixed).
+            latency_per_token (float, optional): Extra seconds per completion token, to mimic generation speed. Defaults to 0.0.
+            error_rate (float, optional): Fraction of requests answered with HTTP 429. Defaults to 0.0.
+            retry_after (float, optional): Retry-After header of the 429 responses in seconds. Defaults to 1.0.
+            answer (str | None, optional): Letter every question is answered with. Defaults to None (a letter seeded by the prompt).
+            embedding_dimensions (int, optional): Size of the embeddings. Defaults to 1536.
+            seed (int, optional): Seed of the latency and error draws. Defaults to 0.
+        """
+        if not 0.0 <= error_rate <= 1.0:
+            raise ValueError(f"error_rate must be between 0 and 1, got {error_rate}")
+        if latency < 0 or latency_std < 0 or latency_per_token < 0:
+            raise ValueError("Latencies must not be negative")
+
+        self.latency = latency
+        self.latency_std = latency_std
+        self.latency_per_token = latency_per_token
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.answer = answer
+        self.embedding_dimensions = embedding_dimensions
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "chat": 0, "embeddings": 0, "rate_limited": 0, "tokens": 0}
+
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        """OpenAI-compatible base URL, e.g. http://127.0.0.1:8000/v1."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        """Start serving in a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and close the socket."""
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def environ(self) -> dict[str, str]:
+        """Environment variables that point the OpenAI SDK, AG2 and litellm (so PaperQA) at this server.
+
+        Returns:
+            dict[str, str]: Base URLs and placeholder API keys.
+        """
+        return {
+            "OPENAI_BASE_URL": self.base_url,
+            "OPENAI_API_BASE": self.base_url,
+            "OPENAI_API_KEY": "mock",
+            # litellm appends ":batchEmbedContents" to the Gemini base
+            "GEMINI_API_BASE": self.base_url.removesuffix("/v1") + "/v1beta/models/mock",
+            "GEMINI_API_KEY": "mock",
+        }
+
+    @contextmanager
+    def patch_environ(self):
+        """Point the clients at this server for the duration of the context, restoring the environment afterwards."""
+        previous = {key: os.environ.get(key) for key in self.environ()}
+        os.environ.update(self.environ())
+        try:
+            yield self
+        finally:
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+    def stats(self) -> dict:
+        """Get the request counts.
+
+        Returns:
+            dict: Requests, chat and embedding requests, rate limited requests and completion tokens served.
+        """
+        with self._lock:
+            return dict(self._counts)
+
+    def _count(self, key: str, value: int = 1) -> None:
+        with self._lock:
+            self._counts[key] += value
+
+    def _draw(self) -> tuple[bool, float]:
+        """Draw whether the next request is rate limited, and its base latency."""
+        with self._lock:
+            limited = self._rng.random() < self.error_rate
+            if self.latency_std > 0 and self.latency > 0:
+                # Lognormal with the requested mean and standard deviation
+                sigma2 = math.log(1 + (self.latency_std / self.latency) ** 2)
+                latency = self._rng.lognormvariate(math.log(self.latency) - sigma2 / 2, math.sqrt(sigma2))
+            else:
+                latency = self.latency
+        return limited, latency
+
+    def _answer_letter(self, prompt: str) -> str:
+        if self.answer is not None:
+            return self.answer
+        return ANSWER_LETTERS[_seed("answer", prompt) % len(ANSWER_LETTERS)]
+
+    def _fill_schema(
+        self, schema: dict, prompt: str, name: str = "", defs: dict | None = None, question: str = ""
+    ):
+        """Build a value matching a JSON schema, reusing the letter chosen in the prompt for answer-like fields."""
+        defs = defs if defs is not None else schema.get("$defs", {})
+        if "$ref" in schema:
+            return self._fill_schema(defs[schema["$ref"].split("/")[-1]], prompt, name, defs, question)
+        for key in ("anyOf", "oneOf", "allOf"):
+            if key in schema:
+                return self._fill_schema(schema[key][0], prompt, name, defs, question)
+        if "enum" in schema:
+            return schema["enum"][0]
+
+        kind = schema.get("type", "object")
+        if isinstance(kind, list):
+            kind = next((k for k in kind if k != "null"), "null")
+        if kind == "object":
+            return {
+                field: self._fill_schema(subschema, prompt, field, defs, question)
+                for field, subschema in schema.get("properties", {}).items()
+            }
+        if kind == "array":
+            return [self._fill_schema(schema.get("items", {}), prompt, name, defs, question)]
+        if kind == "boolean":
+            return True
+        if kind == "integer":
+            return 8
+        if kind == "number":
+            return 0.8
+        if kind == "null":
+            return None
+
+        if name.lower() in ("answer", "target"):
+            match = LETTER_PATTERN.search(prompt)
+            return match.group(1) if match else self._answer_letter(prompt)
+        if name.lower() in ("question", "query"):
+            return question or prompt.strip()
+        if name.lower() in ("citation", "citations"):
+            return "mock2024 pages 1-2"
+        return f"Mock {name or 'text'} (mock2024 pages 1-2)."
+
+    def chat_completion(self, request: dict) -> dict:
+        """Build the reply to a chat completions request.
+
+        Args:
+            request (dict): Request body.
+
+        Returns:
+            dict: Chat completion response body.
+        """
+        messages = request.get("messages", [])
+        prompt = _message_text(messages)
+        # Text the last user message asks about, after any instructions (e.g. the structured agent's "Text:")
+        question = _message_text([m for m in messages if m.get("role") == "user"][-1:]).split("Text:")[-1].strip()
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+
+        response_format = request.get("response_format") or {}
+        tools = request.get("tools") or []
+        if tools:
+            # Step through the offered tools, one call per turn, in the order they are listed
+            called = sum(len(m.get("tool_calls") or []) for m in messages if m.get("role") == "assistant")
+            function = tools[min(called, len(tools) - 1)]["function"]
+            arguments = self._fill_schema(function.get("parameters", {}), prompt, question=question)
+            message["tool_calls"] = [
+                {
+                    "id": f"call_{_seed(prompt, called) % 10**12}",
+                    "type": "function",
+                    "function": {"name": function["name"], "arguments": json.dumps(arguments)},
+                }
+            ]
+            finish_reason = "tool_calls"
+        elif response_format.get("type") == "json_schema":
+            schema = response_format.get("json_schema", {}).get("schema", {})
+            message["content"] = json.dumps(self._fill_schema(schema, prompt, question=question))
+        elif response_format.get("type") == "json_object" or "relevance_score" in prompt:
+            # PaperQA's evidence summaries ask for JSON with a summary and a relevance score in the prompt
+            message["content"] = json.dumps(
+                {"summary": "Mock evidence summary (mock2024 pages 1-2).", "relevance_score": 8}
+            )
+        else:
+            letter = self._answer_letter(prompt)
+            message["content"] = (
+                f"The mock source supports option {letter} (mock2024 pages 1-2).\n\nANSWER: {letter}"
+            )
+
+        completion = message["content"] or json.dumps(message.get("tool_calls"))
+        prompt_tokens = _count_tokens(prompt)
+        completion_tokens = _count_tokens(completion)
+        return {
+            "id": f"chatcmpl-{_seed(prompt) % 10**12}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def embeddings(self, request: dict) -> dict:
+        """Build the reply to an OpenAI embeddings request.
+
+        Args:
+            request (dict): Request body.
+
+        Returns:
+            dict: Embeddings response body, base64 encoded if requested.
+        """
+        inputs = request.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or self.embedding_dimensions
+
+        data = []
+        for index, text in enumerate(inputs):
+            vector = embed(str(text), dimensions)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode()
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+
+        tokens = sum(_count_tokens(str(text)) for text in inputs)
+        return {
+            "object": "list",
+            "data": data,
+            "model": request.get("model", "mock"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    def gemini_embeddings(self, request: dict) -> dict:
+        """Build the reply to a Gemini embedContent or batchEmbedContents request.
+
+        Args:
+            request (dict): Request body.
+
+        Returns:
+            dict: Gemini embeddings response body.
+        """
+        def text(item: dict) -> str:
+            return " ".join(part.get("text", "") for part in item.get("content", {}).get("parts", []))
+
+        if "requests" in request:
+            return {
+                "embeddings": [
+                    {"values": embed(text(item), item.get("outputDimensionality") or self.embedding_dimensions)}
+                    for item in request["requests"]
+                ]
+            }
+        dimensions = request.get("outputDimensionality") or self.embedding_dimensions
+        return {"embedding": {"values": embed(text(request), dimensions)}}
+
+
+def _handler(server: MockLLMServer) -> type[BaseHTTPRequestHandler]:
+    """Request handler class bound to a MockLLMServer."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args) -> None:
+            # Keep benchmark output clean
+            pass
+
+        def _send(self, status: int, body: dict, headers: dict | None = None) -> None:
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _send_stream(self, body: dict) -> None:
+            """Send a chat completion as server-sent events, in a single content chunk."""
+            choice = body["choices"][0]
+            delta = {key: value for key, value in choice["message"].items() if value is not None}
+            for index, call in enumerate(delta.get("tool_calls", [])):
+                call["index"] = index
+            chunks = [
+                {**body, "object": "chat.completion.chunk", "choices": [{"index": 0, "delta": delta, "finish_reason": None}]},
+                {
+                    **body,
+                    "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": choice["finish_reason"]}],
+                },
+            ]
+            payload = "".join(f"data: {json.dumps(chunk)}\n\n" for chunk in chunks) + "data: [DONE]\n\n"
+            payload = payload.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self) -> None:
+            if self.path.rstrip("/").endswith("/stats"):
+                self._send(200, server.stats())
+            elif self.path.rstrip("/").endswith("/models"):
+                self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+            else:
+                self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError as e:
+                self._send(400, {"error": {"message": f"Invalid JSON: {e}", "type": "invalid_request_error"}})
+                return
+
+            path = self.path.split("?")[0].rstrip("/")
+            server._count("requests")
+            limited, latency = server._draw()
+            if limited:
+                server._count("rate_limited")
+                time.sleep(latency)
+                self._send(
+                    429,
+                    {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_error", "code": "rate_limit_exceeded"}},
+                    headers={"Retry-After": str(server.retry_after)},
+                )
+                return
+
+            if path.endswith("/chat/completions"):
+                server._count("chat")
+                body = server.chat_completion(request)
+                completion_tokens = body["usage"]["completion_tokens"]
+                server._count("tokens", completion_tokens)
+                time.sleep(latency + completion_tokens * server.latency_per_token)
+                if request.get("stream"):
+                    self._send_stream(body)
+                else:
+                    self._send(200, body)
+            elif path.endswith("/embeddings"):
+                server._count("embeddings")
+                time.sleep(latency)
+                self._send(200, server.embeddings(request))
+            elif path.endswith(":batchEmbedContents") or path.endswith(":embedContent"):
+                server._count("embeddings")
+                time.sleep(latency)
+                self._send(200, server.gemini_embeddings(request))
+            else:
+                self._send(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+
+    return Handler
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible LLM and embedding server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean latency per request in seconds")
+    parser.add_argument("--latency-std", type=float, default=0.0, help="Standard deviation of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--answer", default=None, help="Letter every question is answered with")
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        latency_std=args.latency_std,
+        error_rate=args.error_rate,
+        answer=args.answer,
+    )
+    print(f"Serving on {server.base_url}, set:")
+    for key, value in server.environ().items():
+        print(f"  export {key}={value}")
+    server.start()
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
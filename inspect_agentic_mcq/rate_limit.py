@@ -0,0 +1,292 @@
+# Shared rate limiting for every LLM caller (custom agents, PaperQA summaries and structured formatting)
+
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+import json
+import os
+from pathlib import Path
+import sys
+import threading
+import time
+
+
+# Model whose provider limit the shared governors default to
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Provider ceiling used when the limit of the model is unknown
+FALLBACK_TOKENS_PER_MINUTE = 30000
+
+
+@lru_cache
+def model_tokens_per_minute(model: str = DEFAULT_MODEL) -> int:
+    """Get the tokens per minute limit of a model.
+
+    The limit depends on the account, so the INSPECT_AGENTIC_MCQ_TOKENS_PER_MINUTE environment variable takes precedence.
+    Otherwise the 'tpm' of the model in litellm's model info is used, read from the file bundled with litellm if litellm
+    has not been imported yet (importing it takes seconds).
+
+    Args:
+        model (str, optional): Model name, as in litellm. Defaults to DEFAULT_MODEL.
+
+    Returns:
+        int: Tokens per minute, FALLBACK_TOKENS_PER_MINUTE if the limit of the model is unknown.
+    """
+    tokens_per_minute = os.getenv("INSPECT_AGENTIC_MCQ_TOKENS_PER_MINUTE")
+    if tokens_per_minute:
+        return int(tokens_per_minute)
+
+    if "litellm" in sys.modules:
+        model_info = sys.modules["litellm"].model_cost
+    else:
+        import importlib.util
+
+        spec = importlib.util.find_spec("litellm")
+        model_file = Path(spec.origin).parent / "model_prices_and_context_window_backup.json" if spec else None
+        if model_file is None or not model_file.exists():
+            return FALLBACK_TOKENS_PER_MINUTE
+        with open(model_file) as f:
+            model_info = json.load(f)
+
+    tokens_per_minute = model_info.get(model, {}).get("tpm")
+    return int(tokens_per_minute) if tokens_per_minute else FALLBACK_TOKENS_PER_MINUTE
+
+
+def rate_limit_string(tokens_per_minute: int) -> str:
+    """Format a token rate in the way PaperQA (litellm) rate limit configs expect.
+
+    Args:
+        tokens_per_minute (int): Token rate.
+
+    Returns:
+        str: E.g. "30000 per 1 minute".
+    """
+    return f"{int(tokens_per_minute)} per 1 minute"
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """Check if an exception is a provider rate limit (HTTP 429) error.
+
+    Args:
+        error (BaseException): Exception raised by an LLM call.
+
+    Returns:
+        bool: True if the call was throttled.
+    """
+    status = getattr(error, "status_code", None) or getattr(error, "status", None)
+    return status == 429 or "RateLimit" in type(error).__name__ or "429" in str(error)
+
+
+class RateGovernor:
+    """Token bucket plus an adaptive concurrency limit, shared by all LLM callers of a provider.
+
+    Concurrency grows by one after a full window of successful calls and halves on every rate limit error
+    (or when calls are slower than the target latency). Calls can reserve an estimate of their tokens up front
+    and report their actual usage afterwards, so calls whose cost is only known later (e.g. PaperQA queries)
+    still draw down the bucket. The bucket goes at most one window (a minute of tokens) into debt, so a single
+    oversized call delays later calls by at most a minute.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: int | None = None,
+        max_concurrency: int = 16,
+        min_concurrency: int = 1,
+        target_latency: float | None = None,
+        cooldown: float = 5.0,
+    ) -> None:
+        if tokens_per_minute is None:
+            tokens_per_minute = model_tokens_per_minute()
+        if tokens_per_minute <= 0:
+            raise ValueError(f"tokens_per_minute must be positive, got {tokens_per_minute}")
+        if not 1 <= min_concurrency <= max_concurrency:
+            raise ValueError(
+                f"Expected 1 <= min_concurrency <= max_concurrency, got {min_concurrency} and {max_concurrency}"
+            )
+
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+
+        # Start at the full bucket and half the maximum concurrency
+        self.concurrency = max(min_concurrency, max_concurrency // 2)
+        self.in_flight = 0
+        self.throttled = 0
+
+        self._tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._paused_until = 0.0
+        self._successes = 0
+        self._usage: deque[tuple[float, int]] = deque()
+        self._latencies: deque[float] = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        rate = self.tokens_per_minute / 60.0
+        self._tokens = min(
+            float(self.tokens_per_minute), self._tokens + (now - self._last_refill) * rate
+        )
+        self._last_refill = now
+
+    async def acquire(self, tokens: int = 0) -> None:
+        """Wait until a call may start, then reserve its concurrency slot and estimated tokens.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the call. Defaults to 0.
+        """
+        # Never wait for more tokens than the bucket can hold
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if (
+                    now >= self._paused_until
+                    and self.in_flight < self.concurrency
+                    and self._tokens >= tokens
+                ):
+                    self._tokens -= tokens
+                    self.in_flight += 1
+                    return
+
+                # Work out how long until the call could go ahead
+                wait = max(self._paused_until - now, 0.05)
+                if self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60.0 / self.tokens_per_minute)
+            await asyncio.sleep(min(wait, 1.0))
+
+    def release(self, latency: float, error: BaseException | None = None) -> None:
+        """Free a concurrency slot and adapt the concurrency limit to the outcome of the call.
+
+        Args:
+            latency (float): Duration of the call in seconds.
+            error (BaseException | None, optional): Exception raised by the call, if any. Defaults to None.
+        """
+        with self._lock:
+            self.in_flight -= 1
+            self._latencies.append(latency)
+
+            if error is not None and is_rate_limit_error(error):
+                # Back off hard on throttling
+                self.throttled += 1
+                self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                self._paused_until = time.monotonic() + self.cooldown
+                self._successes = 0
+            elif self.target_latency is not None and latency > self.target_latency:
+                self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+                self._successes = 0
+            elif error is None:
+                self._successes += 1
+                if self._successes >= self.concurrency:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+                    self._successes = 0
+
+    def record_usage(self, tokens: int, reserved: int = 0) -> None:
+        """Record the actual tokens used by a call, drawing down the bucket by any usage beyond the reservation.
+
+        The bucket is not drawn down below minus one window, so the next acquire waits at most one window.
+
+        Args:
+            tokens (int): Tokens used by the call.
+            reserved (int, optional): Tokens reserved for the call in acquire. Defaults to 0.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            excess = max(tokens - reserved, 0)
+            self._tokens = max(self._tokens - excess, -float(self.tokens_per_minute))
+            self._usage.append((now, tokens))
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0):
+        """Context manager around a single LLM call.
+
+        Args:
+            tokens (int, optional): Estimated tokens of the call. Defaults to 0.
+        """
+        await self.acquire(tokens)
+        start = time.monotonic()
+        try:
+            yield self
+        except BaseException as e:
+            self.release(time.monotonic() - start, error=e)
+            raise
+        self.release(time.monotonic() - start)
+
+    def stats(self) -> dict:
+        """Get the current state of the governor.
+
+        Returns:
+            dict: Tokens used in the last minute, requests in flight, concurrency limit, throttled calls and mean latency.
+        """
+        with self._lock:
+            now = time.monotonic()
+            while self._usage and self._usage[0][0] < now - 60.0:
+                self._usage.popleft()
+            latencies = list(self._latencies)
+            return {
+                "tokens_last_minute": sum(tokens for _, tokens in self._usage),
+                "tokens_per_minute_limit": self.tokens_per_minute,
+                "in_flight": self.in_flight,
+                "concurrency_limit": self.concurrency,
+                "throttled": self.throttled,
+                "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+            }
+
+    def rate_limit_string(self) -> str:
+        """Rate limit of this governor for PaperQA (litellm) configs, e.g. "30000 per 1 minute"."""
+        return rate_limit_string(self.tokens_per_minute)
+
+
+# Governor of whole PaperQA queries. A query holds its slot for minutes, so queries have their own concurrency limit
+# rather than taking the slots of single LLM calls (e.g. the structured formatting) on the default governor
+PAPERQA_GOVERNOR = "paperqa"
+
+# Governors shared across the package, keyed by name (e.g. provider)
+_GOVERNORS: dict[str, RateGovernor] = {}
+_GOVERNORS_LOCK = threading.Lock()
+
+
+def get_governor(name: str = "default") -> RateGovernor:
+    """Get a shared governor, creating it with the default limits on first use.
+
+    Args:
+        name (str, optional): Name of the governor. Defaults to "default".
+
+    Returns:
+        RateGovernor: The shared governor.
+    """
+    with _GOVERNORS_LOCK:
+        if name not in _GOVERNORS:
+            _GOVERNORS[name] = RateGovernor()
+        return _GOVERNORS[name]
+
+
+def set_governor(governor: RateGovernor, name: str = "default") -> None:
+    """Replace a shared governor, e.g. to change the provider limits.
+
+    Args:
+        governor (RateGovernor): Governor to share.
+        name (str, optional): Name of the governor. Defaults to "default".
+    """
+    with _GOVERNORS_LOCK:
+        _GOVERNORS[name] = governor
+
+
+def count_tokens(token_counts: dict) -> int:
+    """Total the tokens of a {model: [prompt_tokens, completion_tokens]} dictionary.
+
+    Args:
+        token_counts (dict): Token counts per model.
+
+    Returns:
+        int: Total number of tokens.
+    """
+    return sum(
+        int(counts[0]) + int(counts[1])
+        for counts in token_counts.values()
+        if isinstance(counts, (list, tuple)) and len(counts) >= 2
+    )
@@ -0,0 +1,397 @@
+# Split an evaluation into shards by stable sample id, run them in worker processes or on separate machines sharing a
+# filesystem, and merge their results into the same result as a single-process run
+
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+import hashlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pandas import DataFrame
+
+from inspect_agentic_mcq.checkpoint import Checkpoint
+from inspect_agentic_mcq.evaluate import MultipleChoiceEval, _mode, _summarise_run
+from inspect_agentic_mcq.ledger import merge_ledger_snapshots
+from inspect_agentic_mcq.rate_limit import PAPERQA_GOVERNOR, RateGovernor, get_governor, set_governor
+
+if TYPE_CHECKING:
+    from inspect_agentic_mcq.inspect_ai_custom.parquet_dataset import ParquetDataset
+
+
+# File each shard writes its results to once it has finished
+SHARD_RESULT_FILE = "result.json"
+
+# Shared governors whose limits are split between the shards
+SHARDED_GOVERNORS = ("default", PAPERQA_GOVERNOR)
+
+
+def shard_of(sample_id: str, n_shards: int) -> int:
+    """Get the shard of a sample, the same on every machine and for every row order.
+
+    Args:
+        sample_id (str): Stable sample id, see inspect_ai_custom.sample.sample_id.
+        n_shards (int): Number of shards.
+
+    Returns:
+        int: Shard index in [0, n_shards).
+    """
+    # Rehash so the shards are independent of the choice orders, which are also derived from the id
+    digest = hashlib.sha256(f"shard:{sample_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "little") % n_shards
+
+
+def shard_data(data: "DataFrame | ParquetDataset", n_shards: int, shard: int) -> "DataFrame | ParquetDataset":
+    """Select the questions of a shard.
+
+    Args:
+        data (DataFrame | ParquetDataset): Question data, as given to MultipleChoiceEval.
+        n_shards (int): Number of shards.
+        shard (int): Shard index.
+
+    Returns:
+        DataFrame | ParquetDataset: The questions of the shard, in their original order.
+    """
+    if not 0 <= shard < n_shards:
+        raise ValueError(f"Expected 0 <= shard < n_shards, got {shard} and {n_shards}")
+
+    from inspect_agentic_mcq.inspect_ai_custom.sample import sample_id
+
+    if isinstance(data, DataFrame):
+        shards = [shard_of(sample_id(record), n_shards) for record in data.to_dict(orient="records")]
+        return data[[s == shard for s in shards]]
+
+    return data.filter(lambda sample: shard_of(sample.id, n_shards) == shard)
+
+
+def shard_directory(output_dir: str | Path, n_shards: int, shard: int) -> Path:
+    """Get the directory of a shard's checkpoint, logs and results.
+
+    Args:
+        output_dir (str | Path): Directory shared by every shard.
+        n_shards (int): Number of shards.
+        shard (int): Shard index.
+
+    Returns:
+        Path: E.g. output_dir/shard-002-of-008.
+    """
+    return Path(output_dir) / f"shard-{shard:03d}-of-{n_shards:03d}"
+
+
+@contextmanager
+def _log_dir(path: Path):
+    """Write the inspect_ai logs of the context to a directory."""
+    previous = os.environ.get("INSPECT_LOG_DIR")
+    os.environ["INSPECT_LOG_DIR"] = str(path)
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("INSPECT_LOG_DIR", None)
+        else:
+            os.environ["INSPECT_LOG_DIR"] = previous
+
+
+def _governor_limits(governor: RateGovernor) -> dict:
+    """Get the limits of a governor, to create the governors of the shards from."""
+    return {
+        "tokens_per_minute": governor.tokens_per_minute,
+        "max_concurrency": governor.max_concurrency,
+        "min_concurrency": governor.min_concurrency,
+        "target_latency": governor.target_latency,
+        "cooldown": governor.cooldown,
+    }
+
+
+def _shared_governor_limits() -> dict[str, dict]:
+    """Get the limits of every sharded governor of this process, keyed by governor name."""
+    return {name: _governor_limits(get_governor(name)) for name in SHARDED_GOVERNORS}
+
+
+@contextmanager
+def _shard_governor(limits: dict, n_shards: int, name: str = "default"):
+    """Share the provider's limits evenly between the shards, each shard's process gets 1/n_shards of them."""
+    max_concurrency = max(limits["max_concurrency"] // n_shards, 1)
+    governor = RateGovernor(
+        tokens_per_minute=max(limits["tokens_per_minute"] // n_shards, 1),
+        max_concurrency=max_concurrency,
+        min_concurrency=min(limits["min_concurrency"], max_concurrency),
+        target_latency=limits["target_latency"],
+        cooldown=limits["cooldown"],
+    )
+
+    previous = get_governor(name)
+    set_governor(governor, name)
+    try:
+        yield governor
+    finally:
+        set_governor(previous, name)
+
+
+def _run_shard(
+    data: "DataFrame | ParquetDataset",
+    agent: Callable,
+    template: str | None,
+    shuffle_seed: int,
+    kwargs: dict,
+    n_shards: int,
+    shard: int,
+    output_dir: str | Path,
+    run_kwargs: dict,
+    limits: dict,
+) -> str:
+    """Run the questions of one shard and save their results, the target of the worker processes."""
+    directory = shard_directory(output_dir, n_shards, shard)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    # Every shard has its own checkpoint so it can be resumed on its own, and an even share of the budget
+    run_kwargs = dict(run_kwargs)
+    run_kwargs.setdefault("checkpoint", directory / "checkpoint.jsonl")
+    if run_kwargs.get("max_cost") is not None:
+        run_kwargs["max_cost"] = run_kwargs["max_cost"] / n_shards
+    if run_kwargs.get("max_tokens") is not None:
+        run_kwargs["max_tokens"] = run_kwargs["max_tokens"] // n_shards
+    # The trace is exported once all shards are merged
+    run_kwargs.pop("trace", None)
+
+    evaluation = MultipleChoiceEval(data, agent, template=template, shuffle_seed=shuffle_seed, **kwargs)
+
+    from_checkpoint = 0
+    if run_kwargs.get("resume"):
+        sample_ids = {str(sample.id) for sample in evaluation.dataset}
+        from_checkpoint = len(sample_ids & set(Checkpoint(run_kwargs["checkpoint"]).completed()))
+
+    with _log_dir(directory / "logs"), ExitStack() as stack:
+        for name, governor_limits in limits.items():
+            stack.enter_context(_shard_governor(governor_limits, n_shards, name))
+        result = evaluation.run(**run_kwargs)
+
+    shard_result = {
+        "n_shards": n_shards,
+        "shard": shard,
+        "epochs": run_kwargs.get("epochs", 1),
+        "from_checkpoint": from_checkpoint,
+        "ledger": result["ledger"],
+        "logs": [log.location for log in result["eval_result"]],
+        "samples": result["samples"],
+    }
+
+    # Write then rename, so a merge never reads a partially written result
+    path = directory / SHARD_RESULT_FILE
+    temp_path = path.with_suffix(".tmp")
+    with open(temp_path, "w") as f:
+        json.dump(shard_result, f, default=str)
+    os.replace(temp_path, path)
+    return str(path)
+
+
+def run_shard(
+    evaluation: MultipleChoiceEval,
+    n_shards: int,
+    shard: int,
+    output_dir: str | Path,
+    **run_kwargs,
+) -> str:
+    """Run one shard of an evaluation in this process, e.g. on one of several machines sharing output_dir.
+
+    Args:
+        evaluation (MultipleChoiceEval): Full evaluation, only the questions of the shard are run.
+        n_shards (int): Number of shards.
+        shard (int): Shard index.
+        output_dir (str | Path): Directory shared by every shard.
+        **run_kwargs: Arguments of MultipleChoiceEval.run, max_cost and max_tokens are split evenly between the shards.
+
+    Returns:
+        str: Path of the shard's results, see merge_shards.
+    """
+    # The shards usually share one provider account, so each only uses its share of this process's rate limits
+    return _run_shard(
+        shard_data(evaluation.data, n_shards, shard),
+        evaluation.agent,
+        evaluation.template,
+        evaluation.shuffle_seed,
+        evaluation.kwargs,
+        n_shards,
+        shard,
+        output_dir,
+        run_kwargs,
+        _shared_governor_limits(),
+    )
+
+
+def run_sharded(
+    evaluation: MultipleChoiceEval,
+    n_shards: int,
+    output_dir: str | Path,
+    max_workers: int | None = None,
+    **run_kwargs,
+) -> dict:
+    """Run an evaluation as shards in worker processes and merge their results.
+
+    The custom agent and its kwargs are sent to the workers, so the agent must be importable (defined at module level)
+    and the kwargs picklable. Shared resources (e.g. the PaperQA index) are prepared once, before the workers start.
+    The rate limits of this process's governors are split evenly between the workers.
+
+    Args:
+        evaluation (MultipleChoiceEval): Evaluation to run.
+        n_shards (int): Number of shards.
+        output_dir (str | Path): Directory of the shards' checkpoints, logs and results.
+        max_workers (int | None, optional): Number of worker processes. Defaults to None (one per shard).
+        **run_kwargs: Arguments of MultipleChoiceEval.run.
+
+    Returns:
+        dict: Results in the same format as MultipleChoiceEval.run, see merge_shards.
+    """
+    if n_shards < 1:
+        raise ValueError(f"n_shards must be at least 1, got {n_shards}")
+
+    # Warm up once here, the workers get the prepared settings
+    if run_kwargs.pop("warm_up", True):
+        evaluation.warm_up()
+    run_kwargs["warm_up"] = False
+    trace = run_kwargs.pop("trace", None)
+    limits = _shared_governor_limits()
+
+    # Spawn rather than fork, the parent may hold threads (e.g. the rate governor) and open connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers or n_shards, mp_context=context) as pool:
+        futures = [
+            pool.submit(
+                _run_shard,
+                shard_data(evaluation.data, n_shards, shard),
+                evaluation.agent,
+                evaluation.template,
+                evaluation.shuffle_seed,
+                evaluation.kwargs,
+                n_shards,
+                shard,
+                output_dir,
+                run_kwargs,
+                limits,
+            )
+            for shard in range(n_shards)
+        ]
+        for future in futures:
+            future.result()
+
+    return merge_shards(output_dir, n_shards, trace=trace)
+
+
+def merge_shards(output_dir: str | Path, n_shards: int, trace: str | Path | None = None) -> dict:
+    """Merge the results of every shard into the result of a single run.
+
+    Samples are combined in id order, so the result is the same whatever the number of shards or the order they finished
+    in, and the same as running every question in one process.
+
+    Args:
+        output_dir (str | Path): Directory shared by every shard.
+        n_shards (int): Number of shards.
+        trace (str | Path | None, optional): File to export the per-stage spans of every sample to. Defaults to None.
+
+    Raises:
+        FileNotFoundError: If a shard has not finished.
+
+    Returns:
+        dict: Results in the same format as MultipleChoiceEval.run, with the eval logs of every shard.
+    """
+    paths = [shard_directory(output_dir, n_shards, shard) / SHARD_RESULT_FILE for shard in range(n_shards)]
+    missing = [shard for shard, path in enumerate(paths) if not path.exists()]
+    if missing:
+        raise FileNotFoundError(f"Shards {missing} of {n_shards} in {output_dir} have not finished")
+
+    shards = []
+    for path in paths:
+        with open(path) as f:
+            shards.append(json.load(f))
+
+    attempts = sorted(
+        (record for shard in shards for record in shard["samples"]),
+        key=lambda r: (str(r["id"]), r.get("epoch") or 1),
+    )
+
+    # Same final values as a single run, the most common answer over the epochs of a sample
+    epochs = shards[0]["epochs"]
+    epoch_summary = None
+    if epochs > 1:
+        history = {}
+        for record in attempts:
+            history.setdefault(str(record["id"]), []).append(record)
+        values = {i: _mode([r["value"] for r in records]) for i, records in history.items()}
+        epoch_summary = MultipleChoiceEval._epoch_summary(history, epochs)
+    else:
+        values = {str(record["id"]): record["value"] for record in attempts}
+
+    from inspect_ai.log import read_eval_log
+
+    eval_result = [read_eval_log(location) for shard in shards for location in shard["logs"]]
+
+    return _summarise_run(
+        attempts,
+        values,
+        eval_result,
+        ledger=merge_ledger_snapshots([shard["ledger"] for shard in shards]),
+        from_checkpoint=sum(shard["from_checkpoint"] for shard in shards),
+        epoch_summary=epoch_summary,
+        trace=trace,
+    )
+
+
+def load_factory(spec: str) -> Callable[[], MultipleChoiceEval]:
+    """Import a function that creates the evaluation, so every machine builds the same one.
+
+    Args:
+        spec (str): "module:function", e.g. "experiments.litqa:make_evaluation".
+
+    Returns:
+        Callable[[], MultipleChoiceEval]: The function.
+    """
+    import importlib
+
+    module, _, name = spec.partition(":")
+    if not name:
+        raise ValueError(f"Expected 'module:function', got {spec!r}")
+    return getattr(importlib.import_module(module), name)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the shards of an evaluation on several machines and merge them")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run one shard")
+    run_parser.add_argument("--factory", required=True, help="'module:function' returning the MultipleChoiceEval")
+    run_parser.add_argument("--shard", type=int, required=True)
+    run_parser.add_argument("--max-samples", type=int, default=None)
+    run_parser.add_argument("--time-limit", type=float, default=None)
+    run_parser.add_argument("--epochs", type=int, default=1)
+    run_parser.add_argument("--max-cost", type=float, default=None)
+    run_parser.add_argument("--resume", action="store_true")
+
+    merge_parser = subparsers.add_parser("merge", help="Merge the results of every shard")
+    merge_parser.add_argument("--trace", default=None)
+
+    for subparser in (run_parser, merge_parser):
+        subparser.add_argument("--shards", type=int, required=True)
+        subparser.add_argument("--output", required=True)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        path = run_shard(
+            load_factory(args.factory)(),
+            args.shards,
+            args.shard,
+            args.output,
+            max_samples=args.max_samples,
+            time_limit=args.time_limit,
+            epochs=args.epochs,
+            max_cost=args.max_cost,
+            resume=args.resume,
+        )
+        print(f"Saved shard results to {path}")
+    else:
+        result = merge_shards(args.output, args.shards, trace=args.trace)
+        print(f"Merged {args.shards} shards: {result['metrics']}")
@@ -0,0 +1,264 @@
+# Run a grid of configuration variants of a MultipleChoiceEval in one process
+
+import itertools
+from typing import Any
+
+from pandas import DataFrame
+
+from inspect_agentic_mcq.cache import merge_cache_usage
+from inspect_agentic_mcq.evaluate import MultipleChoiceEval, _agent_default_settings, _run_coroutine
+from inspect_agentic_mcq.inspect_ai_custom.score_stats import score_summary
+from inspect_agentic_mcq.ledger import CostLedger
+from inspect_agentic_mcq.rate_limit import count_tokens, get_governor
+
+
+def expand_grid(grid: dict[str, list]) -> dict[str, dict[str, Any]]:
+    """Expand lists of override values into every combination of them.
+
+    Args:
+        grid (dict[str, list]): Dotted override path to the values to try, e.g. {"answer.evidence_k": [1, 5, 10]}.
+
+    Returns:
+        dict[str, dict[str, Any]]: Variant name (e.g. "evidence_k=5") to its overrides.
+    """
+    paths = list(grid)
+    variants = {}
+    for values in itertools.product(*(grid[path] for path in paths)):
+        name = ",".join(
+            f"{path.split('.')[-1]}={value}" for path, value in zip(paths, values)
+        )
+        variants[name] = dict(zip(paths, values))
+    return variants
+
+
+def apply_overrides(settings, overrides: dict[str, Any]):
+    """Copy PaperQA2 Settings with dotted overrides applied, e.g. {"answer.evidence_k": 10, "llm": "gpt-4o"}.
+
+    Args:
+        settings (Settings): PaperQA2 Settings to copy.
+        overrides (dict[str, Any]): Dotted path (relative to the Settings) to its new value.
+
+    Returns:
+        Settings: The overridden copy, the original settings are left unchanged.
+    """
+    settings = settings.model_copy(deep=True)
+    for path, value in overrides.items():
+        *parents, field = path.split(".")
+        target = settings
+        for parent in parents:
+            target = getattr(target, parent)
+        if not hasattr(target, field):
+            raise AttributeError(f"Unknown settings override '{path}'")
+        setattr(target, field, value)
+    return settings
+
+
+class ConfigSweep:
+    """Evaluate several configurations of the same MultipleChoiceEval in one process.
+
+    Every variant shares the dataset (including its shuffled choices), the response and formatting caches, the rate governor
+    and any PaperQA index whose name (paper directory, embedding model and chunking) is unchanged by the overrides. All
+    variants are submitted to a single inspect_ai eval, which interleaves their samples.
+    """
+
+    def __init__(
+        self,
+        evaluation: MultipleChoiceEval,
+        variants: dict[str, dict[str, Any]],
+        repeats: int = 1,
+    ) -> None:
+        """
+        Args:
+            evaluation (MultipleChoiceEval): Base evaluation, its kwargs are the starting point of every variant.
+            variants (dict[str, dict[str, Any]]): Variant name to its overrides, see expand_grid. Overrides of a Settings
+                field (e.g. "answer.evidence_k", "llm") apply to the 'settings' kwarg (or the agent's default settings), any other
+                key replaces an agent kwarg.
+            repeats (int, optional): Number of runs of every variant. Note that repeats are replayed from a shared
+                ResponseCache, pass the agent a cache of None or in 'write_through' mode for independent repeats. Defaults to 1.
+        """
+        if not variants:
+            raise ValueError("At least one variant is required")
+        if repeats < 1:
+            raise ValueError(f"repeats must be at least 1, got {repeats}")
+
+        self.evaluation = evaluation
+        self.variants = variants
+        self.repeats = repeats
+
+    def variant_kwargs(self, overrides: dict[str, Any]) -> dict:
+        """Get the agent kwargs of a variant.
+
+        Args:
+            overrides (dict[str, Any]): Overrides of the variant.
+
+        Raises:
+            ValueError: If a dotted override is not a field of the settings.
+
+        Returns:
+            dict: Copy of the base kwargs with the overrides applied.
+        """
+        kwargs = dict(self.evaluation.kwargs)
+        settings = kwargs.get("settings")
+        if settings is None and overrides:
+            # Override the agent's default settings, as the evaluation would use them
+            settings = _agent_default_settings(self.evaluation.agent)
+        settings_fields = type(settings).model_fields if settings is not None else {}
+
+        settings_overrides = {}
+        for path, value in overrides.items():
+            if path.split(".")[0] in settings_fields:
+                settings_overrides[path] = value
+            elif "." in path:
+                raise ValueError(f"Override '{path}' is not a field of the agent's settings")
+            else:
+                kwargs[path] = value
+
+        if settings_overrides:
+            kwargs["settings"] = apply_overrides(settings, settings_overrides)
+        return kwargs
+
+    def _warm_up(self, variant_kwargs: dict[str, dict]) -> None:
+        """Build or validate each distinct PaperQA index once, and point every variant at it."""
+        from inspect_agentic_mcq.agents.paperqa_index import (
+            is_paperqa_settings,
+            reuse_index,
+            warm_up_index,
+        )
+
+        warmed = set()
+        for kwargs in variant_kwargs.values():
+            settings = kwargs.get("settings")
+            if settings is None or not is_paperqa_settings(settings):
+                continue
+
+            index_name = settings.agent.index.name or settings.get_index_name()
+            if index_name in warmed:
+                kwargs["settings"] = reuse_index(settings)
+            else:
+                kwargs["settings"] = _run_coroutine(warm_up_index(settings))
+                warmed.add(index_name)
+
+    def run(
+        self,
+        max_samples: int | None,
+        time_limit: float | None,
+        max_tasks: int | None = None,
+        warm_up: bool = True,
+        max_cost: float | None = None,
+        max_tokens: int | None = None,
+    ) -> dict:
+        """Run every variant and compare them.
+
+        Args:
+            max_samples (int | None): Maximum number of samples to run concurrently per variant.
+            time_limit (float | None): Time limit per sample in seconds.
+            max_tasks (int | None, optional): Maximum number of variant runs in parallel. Defaults to None (all of them).
+            warm_up (bool, optional): Prepare the PaperQA indexes before the first sample. Defaults to True.
+            max_cost (float | None, optional): Budget in dollars shared by every variant, no new samples are started once it is spent. Defaults to None.
+            max_tokens (int | None, optional): Budget in tokens shared by every variant. Defaults to None.
+
+        Returns:
+            dict: 'table' with the metrics, cost and tokens of every variant (mean and std over repeats), 'runs' with every
+                individual run, the 'ledger' totals, and the 'eval_result' logs.
+        """
+        from inspect_ai import eval
+
+        variant_kwargs = {
+            name: self.variant_kwargs(overrides) for name, overrides in self.variants.items()
+        }
+        if warm_up:
+            self._warm_up(variant_kwargs)
+
+        # One ledger for the whole sweep
+        ledger = CostLedger(max_cost=max_cost, max_tokens=max_tokens)
+
+        # One task per variant and repeat, all run by the same eval
+        runs = {}
+        tasks = []
+        for name, kwargs in variant_kwargs.items():
+            for repeat in range(self.repeats):
+                task_name = name if self.repeats == 1 else f"{name}_r{repeat + 1}"
+                runs[task_name] = (name, repeat + 1)
+                tasks.append(
+                    self.evaluation._task(
+                        self.evaluation.dataset, kwargs, name=task_name, ledger=ledger
+                    )
+                )
+
+        eval_result = eval(
+            tasks=tasks,
+            time_limit=time_limit,
+            max_samples=max_samples,
+            max_tasks=max_tasks or len(tasks),
+        )
+
+        # Summarise every run
+        rows = []
+        for log in eval_result:
+            name, repeat = runs[log.eval.task]
+            records = {
+                i: r for i, r in self.evaluation._sample_records([log]).items() if not r["skipped"]
+            }
+            evidence_cache = merge_cache_usage(
+                [r["evidence_cache"] for r in records.values() if r.get("evidence_cache")]
+            )
+            rows.append(
+                {
+                    "variant": name,
+                    "repeat": repeat,
+                    "samples": len(records),
+                    **score_summary([record["value"] for record in records.values()]),
+                    "cost": sum(float(r.get("cost") or 0.0) for r in records.values()),
+                    "tokens": sum(count_tokens(r.get("token_counts") or {}) for r in records.values()),
+                    "evidence_hit_rate": evidence_cache["hit_rate"],
+                    "evidence_tokens_saved": evidence_cache["tokens_saved"],
+                    "status": log.status,
+                }
+            )
+        runs_table = DataFrame(rows).sort_values(["variant", "repeat"], ignore_index=True)
+
+        # Compare the variants over their repeats, in the order they were given
+        metric_columns = [
+            "paperqa_accuracy",
+            "paperqa_precision",
+            "paperqa_coverage",
+            "cost",
+            "tokens",
+            "evidence_hit_rate",
+            "evidence_tokens_saved",
+        ]
+        table = runs_table.groupby("variant", sort=False)[metric_columns].agg(["mean", "std"])
+        table = table.reindex([name for name in self.variants if name in table.index])
+        table.columns = [f"{metric}_{stat}" for metric, stat in table.columns]
+        table.insert(0, "runs", runs_table.groupby("variant").size())
+
+        # Print summary
+        print("\n--- Sweep Summary ---")
+        print(table.to_string())
+        print(f"Total cost: ${runs_table['cost'].sum():.6f}")
+        if ledger.skipped:
+            print(f"Budget reached: {ledger.skipped} samples skipped, results are partial")
+        print(f"Rate limits: {get_governor().stats()}")
+        print("---------------------\n")
+
+        return {
+            "table": table,
+            "runs": runs_table,
+            "ledger": ledger.snapshot(),
+            "eval_result": eval_result,
+        }
+
+
+if __name__ == "__main__":
+    import pandas as pd
+
+    from inspect_agentic_mcq.agents.paperqa_agent import paperqa_agent, paperqa_settings
+    from inspect_agentic_mcq.agents.paperqa_evidence_cache import EvidenceSummaryCache
+
+    df = pd.read_parquet("data/LitQA_data/test-00000-of-00001.parquet").head(10)
+    evaluation = MultipleChoiceEval(
+        df, paperqa_agent, settings=paperqa_settings, evidence_cache=EvidenceSummaryCache()
+    )
+
+    sweep = ConfigSweep(evaluation, expand_grid({"answer.evidence_k": [1, 5, 10, 15]}))
+    sweep.run(max_samples=4, time_limit=600)
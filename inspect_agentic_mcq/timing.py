@@ -0,0 +1,94 @@
+# Per-stage timing of samples, e.g. input parsing, the custom agent, output formatting and scoring
+
+from contextlib import contextmanager
+import json
+from pathlib import Path
+import time
+
+from pandas import DataFrame
+
+
+class StageTimer:
+    """Records a timed span for every stage of a sample, with the tokens and cost attributed to it."""
+
+    def __init__(self) -> None:
+        self.spans: list[dict] = []
+
+    @contextmanager
+    def span(self, stage: str):
+        """Time a stage.
+
+        Args:
+            stage (str): Name of the stage, e.g. "agent".
+
+        Yields:
+            dict: The span, set its 'tokens' and 'cost' to attribute usage to the stage.
+        """
+        span = {"stage": stage, "start": time.time(), "duration": 0.0, "tokens": 0, "cost": 0.0}
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span["duration"] = time.perf_counter() - start
+            self.spans.append(span)
+
+
+def stage_summary(spans: list[dict]) -> DataFrame:
+    """Aggregate the spans of many samples per stage.
+
+    Args:
+        spans (list[dict]): Spans recorded by StageTimer.
+
+    Returns:
+        DataFrame: Count, mean, p50, p95 and p99 duration in seconds, and the total tokens and cost of every stage.
+    """
+    if not spans:
+        return DataFrame(columns=["count", "mean", "p50", "p95", "p99", "tokens", "cost"])
+
+    grouped = DataFrame(spans).groupby("stage", sort=False)
+    durations = grouped["duration"]
+    return DataFrame(
+        {
+            "count": durations.size(),
+            "mean": durations.mean(),
+            "p50": durations.quantile(0.5),
+            "p95": durations.quantile(0.95),
+            "p99": durations.quantile(0.99),
+            "tokens": grouped["tokens"].sum(),
+            "cost": grouped["cost"].sum(),
+        }
+    )
+
+
+def export_trace(records: list[dict], path: str | Path) -> None:
+    """Write the spans of samples as a Chrome trace file, viewable in chrome://tracing or Perfetto.
+
+    Args:
+        records (list[dict]): Sample results with an 'id', 'epoch' and the 'timings' spans.
+        path (str | Path): Trace file to write.
+    """
+    events = []
+    for thread, record in enumerate(records):
+        for span in record.get("timings") or []:
+            events.append(
+                {
+                    "name": span["stage"],
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["duration"] * 1e6,
+                    "pid": 1,
+                    # One row per sample
+                    "tid": thread,
+                    "args": {
+                        "sample": record.get("id"),
+                        "epoch": record.get("epoch"),
+                        "tokens": span["tokens"],
+                        "cost": span["cost"],
+                    },
+                }
+            )
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
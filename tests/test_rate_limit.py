@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from inspect_agentic_mcq import rate_limit
+from inspect_agentic_mcq.rate_limit import RateGovernor, model_tokens_per_minute
+
+
+class FakeClock:
+    """Monotonic clock that only moves forward when the governor sleeps."""
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(rate_limit, "asyncio", SimpleNamespace(sleep=clock.sleep))
+    return clock
+
+
+def test_usage_larger_than_bucket_waits_at_most_one_window(clock):
+    governor = RateGovernor(tokens_per_minute=30000)
+
+    # E.g. a PaperQA query that used ten minutes worth of tokens
+    governor.record_usage(10 * governor.tokens_per_minute)
+
+    start = clock.now
+    asyncio.run(governor.acquire())
+    assert clock.now - start <= 60.0
+    assert governor.in_flight == 1
+
+
+def test_usage_within_reservation_does_not_draw_down_bucket(clock):
+    governor = RateGovernor(tokens_per_minute=30000)
+
+    asyncio.run(governor.acquire(20000))
+    governor.record_usage(15000, reserved=20000)
+    governor.release(1.0)
+
+    # The remaining 10000 tokens are available without waiting
+    start = clock.now
+    asyncio.run(governor.acquire(10000))
+    assert clock.now == start
+
+
+def test_model_tokens_per_minute(monkeypatch):
+    model_tokens_per_minute.cache_clear()
+    monkeypatch.setenv("INSPECT_AGENTIC_MCQ_TOKENS_PER_MINUTE", "123456")
+    assert model_tokens_per_minute("gpt-4o-mini") == 123456
+    assert RateGovernor().tokens_per_minute == 123456
+
+    model_tokens_per_minute.cache_clear()
+    monkeypatch.delenv("INSPECT_AGENTIC_MCQ_TOKENS_PER_MINUTE")
+    assert model_tokens_per_minute("not-a-model") == rate_limit.FALLBACK_TOKENS_PER_MINUTE
+    model_tokens_per_minute.cache_clear()
@@ -0,0 +1,63 @@
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from inspect_agentic_mcq.evaluate import MultipleChoiceEval
+from inspect_agentic_mcq.rate_limit import PAPERQA_GOVERNOR, RateGovernor, get_governor, set_governor
+from inspect_agentic_mcq.shard import _shard_governor, run_sharded
+
+DATA = Path(__file__).parents[1] / "data" / "LitQA_data" / "test-00000-of-00001.parquet"
+
+
+async def stub_agent(prompt: str) -> dict:
+    # Deterministic answers and usage, so every run of a question gives the same result
+    h = int(hashlib.sha256(prompt.encode()).hexdigest(), 16)
+    letter = "ABCDEF"[h % 6] if h % 10 else "NA"
+    return {
+        "answer": f"Text (foo2024 pages 1-2).\n\nANSWER: {letter}",
+        "cost": 0.001 * (h % 7),
+        "token_counts": {"stub": [h % 100, 3]},
+    }
+
+
+@pytest.fixture
+def inspect_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("INSPECT_EVAL_MODEL", "mockllm/model")
+    monkeypatch.setenv("INSPECT_LOG_DIR", str(tmp_path / "logs"))
+    monkeypatch.setenv("INSPECT_DISPLAY", "none")
+    return tmp_path
+
+
+def make_evaluation() -> MultipleChoiceEval:
+    return MultipleChoiceEval(pd.read_parquet(DATA).head(24), stub_agent)
+
+
+def test_sharded_run_matches_single_run(inspect_env):
+    single = make_evaluation().run(max_samples=8, time_limit=60)
+    sharded = run_sharded(make_evaluation(), 3, inspect_env / "shards", max_samples=8, time_limit=60)
+
+    assert sharded["metrics"] == pytest.approx(single["metrics"])
+    assert sharded["cost"] == pytest.approx(single["cost"])
+    assert sharded["token_counts"] == single["token_counts"]
+    assert [(r["id"], r["value"]) for r in sharded["samples"]] == [(r["id"], r["value"]) for r in single["samples"]]
+
+
+def test_shard_governor_splits_limits():
+    previous = get_governor()
+    set_governor(RateGovernor(tokens_per_minute=30000, max_concurrency=16))
+    try:
+        limits = {"tokens_per_minute": 30000, "max_concurrency": 16, "min_concurrency": 1, "target_latency": None, "cooldown": 5.0}
+        with _shard_governor(limits, 3) as governor:
+            assert get_governor() is governor
+            assert governor.tokens_per_minute == 10000
+            assert governor.max_concurrency == 5
+        assert get_governor().tokens_per_minute == 30000
+
+        # The PaperQA queries' governor is split on its own
+        with _shard_governor(limits, 3, PAPERQA_GOVERNOR) as governor:
+            assert get_governor(PAPERQA_GOVERNOR) is governor
+            assert get_governor().tokens_per_minute == 30000
+    finally:
+        set_governor(previous)
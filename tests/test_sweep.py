@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pandas as pd
+from paperqa import Settings
+import pytest
+
+from inspect_agentic_mcq.evaluate import MultipleChoiceEval
+from inspect_agentic_mcq.sweep import ConfigSweep, expand_grid
+
+DATA = Path(__file__).parents[1] / "data" / "LitQA_data" / "test-00000-of-00001.parquet"
+
+# Default settings of settings_agent, found through its module like the PaperQA agents' 'paperqa_settings'
+paperqa_settings = Settings(answer={"evidence_k": 10})
+
+
+async def settings_agent(prompt: str, settings: Settings | None = None) -> dict:
+    settings = settings or paperqa_settings
+    return {
+        "answer": "Text (foo2024 pages 1-2).\n\nANSWER: A",
+        "cost": 0.001 * settings.answer.evidence_k,
+        "token_counts": {"stub": [10, 2]},
+    }
+
+
+async def stub_agent(prompt: str) -> dict:
+    return {"answer": "ANSWER: A", "cost": 0.0, "token_counts": {}}
+
+
+@pytest.fixture
+def inspect_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("INSPECT_EVAL_MODEL", "mockllm/model")
+    monkeypatch.setenv("INSPECT_LOG_DIR", str(tmp_path / "logs"))
+    monkeypatch.setenv("INSPECT_DISPLAY", "none")
+    return tmp_path
+
+
+def test_sweep_overrides_default_settings(inspect_env):
+    evaluation = MultipleChoiceEval(pd.read_parquet(DATA).head(4), settings_agent)
+    sweep = ConfigSweep(evaluation, expand_grid({"answer.evidence_k": [1, 5]}))
+
+    result = sweep.run(max_samples=4, time_limit=60, warm_up=False)
+
+    assert result["table"]["cost_mean"].to_dict() == pytest.approx({"evidence_k=1": 0.004, "evidence_k=5": 0.02})
+    assert paperqa_settings.answer.evidence_k == 10
+
+
+def test_unknown_dotted_override_is_rejected():
+    sweep = ConfigSweep(MultipleChoiceEval(pd.read_parquet(DATA).head(4), stub_agent), {"k": {"answer.evidence_k": 1}})
+
+    with pytest.raises(ValueError, match="answer.evidence_k"):
+        sweep.variant_kwargs({"answer.evidence_k": 1})